@@ -0,0 +1,12 @@
+"""
+URL configuration for API-only workers (DJANGO_API_ONLY=1).
+
+The API and the metrics of account_transfer/urls.py, without the admin or
+the HTML pages.
+"""
+from django.urls import path, include
+from . import metrics
+urlpatterns = [
+    path('api/accounts/', include('api.accounts.urls')),
+    path('metrics', metrics.metrics_view, name='metrics'),
+]
@@ -0,0 +1,189 @@
+"""Per-view request metrics in Prometheus text format.
+
+:class:`MetricsMiddleware` times every request and counts the queries it
+runs, then adds the numbers to histograms labelled by view. ``/metrics``
+serves the histograms. Each worker process keeps its own, so Prometheus
+should scrape every worker, or sum across them.
+
+Queries are counted by an execute wrapper added to every database
+connection when it opens. The wrapper adds to the counters of the request
+in the current context. Context variables follow a request into
+``sync_to_async`` threads, so this also covers the async views.
+"""
+import bisect
+import contextvars
+import logging
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:
+    """A Prometheus histogram with one series per label value."""
+
+    def __init__(self, name, help_text, buckets, label='view'):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.label = label
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, label_value, value):
+        # Bucket counts are stored per bucket and summed when rendered
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [
+                    [0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}',
+                 f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((value, list(counts), total)
+                            for value, (counts, total) in self._series.items())
+        for label_value, counts, total in series:
+            label = f'{self.label}="{_escape(label_value)}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label}}} {total}')
+            lines.append(f'{self.name}_count{{{label}}} {cumulative}')
+        return '\n'.join(lines)
+
+
+def _escape(value):
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'Wall time of requests by view.',
+    DURATION_BUCKETS)
+REQUEST_QUERIES = Histogram(
+    'http_request_db_queries', 'Database queries run per request by view.',
+    QUERY_BUCKETS)
+REQUEST_DB_DURATION = Histogram(
+    'http_request_db_duration_seconds', 'Time spent in database queries per request by view.',
+    DURATION_BUCKETS)
+HISTOGRAMS = (REQUEST_DURATION, REQUEST_QUERIES, REQUEST_DB_DURATION)
+
+
+def render():
+    return '\n'.join(histogram.render() for histogram in HISTOGRAMS) + '\n'
+
+
+def reset():
+    for histogram in HISTOGRAMS:
+        histogram.reset()
+
+
+class QueryStats:
+    __slots__ = ('queries', 'db_time')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+
+
+_current_stats = contextvars.ContextVar('request_query_stats', default=None)
+
+
+def _count_queries(execute, sql, params, many, context):
+    stats = _current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.db_time += time.perf_counter() - start
+        stats.queries += 1
+
+
+def _install_wrapper(connection, **kwargs):
+    if _count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_queries)
+
+
+connection_created.connect(_install_wrapper, dispatch_uid='account_transfer.metrics')
+
+
+class MetricsMiddleware:
+    """Record wall time, query count and query time for each request.
+
+    Requests running more than ``REQUEST_QUERY_BUDGET`` queries are logged
+    as warnings. Set it to ``None`` to turn the warning off.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        # Connections opened before this module was imported (e.g. by the
+        # test runner) missed the connection_created signal
+        for connection in connections.all(initialized_only=True):
+            _install_wrapper(connection)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        stats = QueryStats()
+        token = _current_stats.set(stats)
+        start = time.perf_counter()
+        try:
+            return self.get_response(request)
+        finally:
+            _current_stats.reset(token)
+            self.record(request, stats, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        stats = QueryStats()
+        token = _current_stats.set(stats)
+        start = time.perf_counter()
+        try:
+            return await self.get_response(request)
+        finally:
+            _current_stats.reset(token)
+            self.record(request, stats, time.perf_counter() - start)
+
+    def record(self, request, stats, duration):
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+        REQUEST_DURATION.observe(view, duration)
+        REQUEST_QUERIES.observe(view, stats.queries)
+        REQUEST_DB_DURATION.observe(view, stats.db_time)
+
+        budget = getattr(settings, 'REQUEST_QUERY_BUDGET', None)
+        if budget is not None and stats.queries > budget:
+            logger.warning(
+                '%s %s ran %d queries (budget %d) in %.1f ms, %.1f ms in the database',
+                request.method, request.path, stats.queries, budget,
+                duration * 1000, stats.db_time * 1000)
+
+
+def metrics_view(request):
+    return HttpResponse(render(), content_type=CONTENT_TYPE)
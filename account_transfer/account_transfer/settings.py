@@ -18,16 +18,27 @@ from pathlib import Path
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 
-# Quick-start development settings - unsuitable for production
+# Settings are driven by environment variables. DJANGO_PROFILE=production
+# turns DEBUG off (DEBUG keeps every SQL query in memory for the lifetime of
+# a request) and requires DJANGO_SECRET_KEY and DJANGO_ALLOWED_HOSTS.
 # See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
 
+PROFILE = os.environ.get('DJANGO_PROFILE', 'development')
+PRODUCTION = PROFILE == 'production'
+
 # SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = 'django-insecure-yyb3l4e7&o4h6i6uwx=n5zl@&f1ug)m8az-m@j0*92m)_c(xhi'
+if PRODUCTION:
+    SECRET_KEY = os.environ['DJANGO_SECRET_KEY']
+else:
+    SECRET_KEY = os.environ.get(
+        'DJANGO_SECRET_KEY',
+        'django-insecure-yyb3l4e7&o4h6i6uwx=n5zl@&f1ug)m8az-m@j0*92m)_c(xhi')
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = os.environ.get('DJANGO_DEBUG', '0' if PRODUCTION else '1') == '1'
 
-ALLOWED_HOSTS = []
+ALLOWED_HOSTS = [host for host in os.environ.get(
+    'DJANGO_ALLOWED_HOSTS', '').split(',') if host]
 
 
 # Application definition
@@ -44,7 +55,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its timings cover the rest of the stack
+    'account_transfer.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # Serves collected static files, which gunicorn does not
+    'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -73,16 +88,87 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'account_transfer.wsgi.application'
 
+# DJANGO_API_ONLY=1 is for worker processes that only serve /api/accounts/ and
+# /metrics. They skip the admin, the HTML pages, sessions, messages, static
+# files and django.contrib.auth, so each worker boots faster and holds less
+# memory. API requests are anonymous either way; throttles key on the client IP.
+# `manage.py startup_profile` compares the two profiles.
+
+API_ONLY = os.environ.get('DJANGO_API_ONLY', '0') == '1'
+
+if API_ONLY:
+    INSTALLED_APPS = [
+        'accounts',
+        'rest_framework',
+    ]
+    MIDDLEWARE = [
+        'account_transfer.metrics.MetricsMiddleware',
+        'django.middleware.security.SecurityMiddleware',
+        'django.middleware.common.CommonMiddleware',
+        'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    ]
+    ROOT_URLCONF = 'account_transfer.api_urls'
+    TEMPLATES[0]['OPTIONS']['context_processors'] = [
+        'django.template.context_processors.debug',
+        'django.template.context_processors.request',
+    ]
+    # DRF's defaults would import django.contrib.auth on every request
+    REST_FRAMEWORK = {
+        'DEFAULT_AUTHENTICATION_CLASSES': [],
+        'DEFAULT_PERMISSION_CLASSES': [],
+        'UNAUTHENTICATED_USER': None,
+    }
+
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
-
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_ENGINE selects the profile: 'sqlite' (default) or 'postgresql'.
+
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgresql':
+    # Needs psycopg 3; DB_POOL=1 also needs its pool extra (psycopg[pool])
+    DB_POOL = os.environ.get('DB_POOL', '0') == '1'
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'account_transfer'),
+            'USER': os.environ.get('DB_USER', 'postgres'),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DB_PORT', '5432'),
+            # Django's built-in pool replaces persistent connections
+            'CONN_MAX_AGE': 0 if DB_POOL else int(os.environ.get('DB_CONN_MAX_AGE', '60')),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'pool': {
+                    'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', '2')),
+                    'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', '10')),
+                },
+            } if DB_POOL else {},
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', '60')),
+            'OPTIONS': {
+                # WAL lets readers run alongside the writer, NORMAL synchronous
+                # is durable in WAL mode while fsyncing far less, and writers
+                # wait up to busy_timeout ms for the lock instead of failing
+                'init_command': (
+                    'PRAGMA journal_mode=WAL;'
+                    'PRAGMA synchronous=NORMAL;'
+                    f"PRAGMA busy_timeout={os.environ.get('DB_BUSY_TIMEOUT_MS', '5000')};"
+                ),
+                # Take the write lock when a transaction starts, so that two
+                # transactions never both read and then deadlock upgrading
+                'transaction_mode': 'IMMEDIATE',
+            },
+        }
     }
-}
 
 
 # Password validation
@@ -123,7 +209,104 @@ STATIC_URL = 'static/'
 STATICFILES_DIRS = [
     BASE_DIR / "static",
 ]
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+# Outside production WhiteNoise looks files up per request, so it works
+# without collectstatic
+WHITENOISE_AUTOREFRESH = not PRODUCTION
+WHITENOISE_USE_FINDERS = not PRODUCTION
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Background account imports
+# Uploads posted with background=true are spooled here and imported by a
+# thread pool of ACCOUNT_IMPORT_WORKERS threads (defaults to the CPU count).
+
+ACCOUNT_IMPORT_SPOOL_DIR = BASE_DIR / 'import_spool'
+ACCOUNT_IMPORT_WORKERS = None
+# A process bumps the heartbeat of its queued and running jobs every
+# ACCOUNT_IMPORT_HEARTBEAT_SECONDS. A job whose heartbeat is older than
+# ACCOUNT_IMPORT_STALE_SECONDS lost its process and is marked failed.
+ACCOUNT_IMPORT_HEARTBEAT_SECONDS = 10
+ACCOUNT_IMPORT_STALE_SECONDS = 60
+
+# Upper bound on the number of transfers in one /api/accounts/transfers/batch/ call
+ACCOUNT_TRANSFER_BATCH_LIMIT = 50000
+
+# With ACCOUNT_GROUP_COMMIT=1, /api/accounts/transfer/ queues transfers to one
+# writer thread per process, which commits up to ACCOUNT_GROUP_COMMIT_MAX_ITEMS
+# of them in one transaction, waiting at most ACCOUNT_GROUP_COMMIT_WAIT_MS for more.
+# A request whose transfer the writer has not taken within
+# ACCOUNT_GROUP_COMMIT_TIMEOUT seconds gets 503 and the transfer is not applied
+ACCOUNT_GROUP_COMMIT = os.environ.get('ACCOUNT_GROUP_COMMIT', '0') == '1'
+ACCOUNT_GROUP_COMMIT_MAX_ITEMS = 500
+ACCOUNT_GROUP_COMMIT_WAIT_MS = float(os.environ.get('ACCOUNT_GROUP_COMMIT_WAIT_MS', '2'))
+ACCOUNT_GROUP_COMMIT_TIMEOUT = float(os.environ.get('ACCOUNT_GROUP_COMMIT_TIMEOUT', '10'))
+
+# Admission control for the transfer and import endpoints (api/accounts/throttling.py).
+# Token buckets of (requests per second, burst) per client and per transfer source
+# account answer 429 once empty; None turns one off. They live in the
+# ACCOUNT_THROTTLE_CACHE_ALIAS cache, so a shared cache limits across processes.
+ACCOUNT_THROTTLE_RATES = {
+    'transfer_client': (100, 200),
+    'transfer_account': (20, 40),
+    'import_client': (1, 5),
+}
+ACCOUNT_THROTTLE_CACHE_ALIAS = 'default'
+# Transfer and import requests in progress per process past which further ones
+# get 503 with Retry-After; queued background imports count until they finish.
+# Keep them below the request threads of a worker (GUNICORN_THREADS, default 8).
+ACCOUNT_TRANSFER_MAX_CONCURRENT = 6
+ACCOUNT_IMPORT_MAX_CONCURRENT = 2
+
+# GET /api/accounts/stats/ reports how many accounts have a balance of at least
+# each of these bounds and below the next one. The counts are kept up to date by
+# every write (accounts/stats.py); run manage.py rebuild_account_stats after
+# changing the bounds.
+ACCOUNT_STATS_BUCKETS = [0, 10, 100, 1_000, 10_000, 100_000, 1_000_000]
+
+# Responses stored under an Idempotency-Key header are replayed to retries
+# for at least this many seconds; manage.py prune_idempotency_keys drops older ones
+ACCOUNT_IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+
+# Requests running more than this many queries are logged as warnings by
+# MetricsMiddleware; None turns the warning off. Histograms are at /metrics.
+REQUEST_QUERY_BUDGET = 50
+
+# Account listings are paginated by cursor; clients may ask for up to
+# ACCOUNT_MAX_PAGE_SIZE rows with ?page_size=
+ACCOUNT_PAGE_SIZE = 100
+ACCOUNT_MAX_PAGE_SIZE = 1000
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# Account detail payloads and listing pages are cached in
+# ACCOUNT_CACHE_ALIAS for ACCOUNT_CACHE_TIMEOUT seconds, keyed by the versions
+# they were read at (see accounts.caching). Any cache is therefore correct; a
+# shared one, through REDIS_URL or DJANGO_CACHE_DIR, lets worker processes
+# reuse each other's entries.
+
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+elif os.environ.get('DJANGO_CACHE_DIR'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ['DJANGO_CACHE_DIR'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'account-transfer',
+        }
+    }
+ACCOUNT_CACHE_ALIAS = 'default'
+ACCOUNT_CACHE_TIMEOUT = 300
@@ -0,0 +1,142 @@
+"""Measure how quickly a fresh worker process serves its first request.
+
+:func:`measure` starts a new interpreter that imports the WSGI application,
+as a gunicorn worker does, and sends one GET request through it. The
+measurements are:
+
+- ``boot``: importing ``account_transfer.wsgi``, which sets Django up.
+- ``first_request``: the first request. It also imports the URLconf and
+  the views it reaches.
+- ``rss``: peak resident memory of the process after that request.
+- ``modules``: the number of modules imported by then.
+
+With ``importtime=True`` the child runs under ``python -X importtime`` and
+the result carries ``imports``: ``(module, self seconds, cumulative
+seconds)`` for each imported module. The instrumentation slows imports
+down, so timings come from separate runs.
+"""
+import dataclasses
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+
+PROFILES = {
+    'full': {'DJANGO_API_ONLY': '0'},
+    'api': {'DJANGO_API_ONLY': '1'},
+}
+
+# Runs in the child. Everything it needs besides the app is imported
+# before the clock starts.
+_CHILD = '''
+import io, json, resource, sys, time
+from wsgiref.util import setup_testing_defaults
+
+start = time.perf_counter()
+from account_transfer.wsgi import application
+booted = time.perf_counter()
+
+path, _, query = sys.argv[1].partition('?')
+environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query,
+           'HTTP_HOST': 'localhost', 'SERVER_NAME': 'localhost',
+           'wsgi.input': io.BytesIO()}
+setup_testing_defaults(environ)
+statuses = []
+body = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+b''.join(body)
+body.close()
+served = time.perf_counter()
+
+print(json.dumps({
+    'boot': booted - start,
+    'first_request': served - booted,
+    'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    'modules': len(sys.modules),
+    'status': int(statuses[0].split()[0]),
+}))
+'''
+
+
+@dataclasses.dataclass
+class StartupResult:
+    profile: str
+    boot: float
+    first_request: float
+    rss: int
+    modules: int
+    status: int
+    imports: list = dataclasses.field(default_factory=list)
+
+    @property
+    def total(self):
+        return self.boot + self.first_request
+
+
+def run_child(profile, path, importtime=False):
+    """Boot one worker process with ``profile`` and return its :class:`StartupResult`."""
+    env = {**os.environ, **PROFILES[profile]}
+    env.setdefault('DJANGO_SETTINGS_MODULE', 'account_transfer.settings')
+    command = [sys.executable]
+    if importtime:
+        command += ['-X', 'importtime']
+    command += ['-c', _CHILD, path]
+    completed = subprocess.run(command, cwd=settings.BASE_DIR, env=env,
+                               capture_output=True, text=True, check=True)
+    result = StartupResult(profile=profile, **json.loads(completed.stdout.splitlines()[-1]))
+    if importtime:
+        result.imports = parse_importtime(completed.stderr)
+    return result
+
+
+def parse_importtime(output):
+    """``(module, self seconds, cumulative seconds)`` from ``-X importtime`` output."""
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        if not self_us.strip().isdigit():
+            continue  # The header
+        imports.append((module.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6))
+    return imports
+
+
+def measure(profiles, path='/api/accounts/', repeat=5, importtime=False):
+    """The median of ``repeat`` fresh boots of each of ``profiles``.
+
+    Boots of the profiles alternate, so that a busy machine slows them down
+    alike. With ``importtime`` one more boot per profile records per-module
+    import times.
+    """
+    runs = {profile: [] for profile in profiles}
+    for _ in range(repeat):
+        for profile in profiles:
+            runs[profile].append(run_child(profile, path))
+    results = []
+    for profile in profiles:
+        profile_runs = runs[profile]
+        result = StartupResult(
+            profile=profile,
+            boot=statistics.median(run.boot for run in profile_runs),
+            first_request=statistics.median(run.first_request for run in profile_runs),
+            rss=int(statistics.median(run.rss for run in profile_runs)),
+            modules=profile_runs[-1].modules,
+            status=profile_runs[-1].status,
+        )
+        if importtime:
+            result.imports = run_child(profile, path, importtime=True).imports
+        results.append(result)
+    return results
+
+
+def by_package(imports):
+    """Self import time and module count per top-level package, slowest first."""
+    totals = {}
+    for module, self_time, _ in imports:
+        package = module.split('.')[0]
+        seconds, count = totals.get(package, (0.0, 0))
+        totals[package] = (seconds + self_time, count + 1)
+    return sorted(totals.items(), key=lambda item: item[1][0], reverse=True)
@@ -16,11 +16,12 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from . import views
+from . import metrics, views
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', views.home, name='home'),
     path('home/', views.home, name='home'),
     path('accounts/', include('accounts.urls')),
     path('api/accounts/', include('api.accounts.urls')),
+    path('metrics', metrics.metrics_view, name='metrics'),
 ]
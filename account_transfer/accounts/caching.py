@@ -0,0 +1,70 @@
+"""Read-through caching of account payloads.
+
+A payload is cached under a key that includes the state it was read at:
+the account's ``(version, shard version)`` for a detail payload (see
+:func:`~accounts.models.account_state`), the whole table's
+:func:`~accounts.models.table_state` for a listing or search page. Every
+write moves that state, so the next read looks up a new key. Nothing has
+to be deleted, and stale entries expire after ``ACCOUNT_CACHE_TIMEOUT``.
+
+A reader racing a write stores what it loaded under the state it read
+first. The write moves the state, so no later request looks that entry
+up. A payload can never be served under a newer state than it was
+loaded at, so an ETag never vouches for stale data.
+"""
+import hashlib
+import json
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+
+_MISSING = object()
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0}
+
+
+def get_cache():
+    return caches[settings.ACCOUNT_CACHE_ALIAS]
+
+
+def detail_key(namespace, account_id, state):
+    """The key of an account's payload as of its ``(version, shard version)``."""
+    return f'account:{namespace}:{account_id}:' + ':'.join(map(str, state))
+
+
+def list_key(namespace, params, state):
+    """The key of a page for ``params`` as of the table's ``state``."""
+    digest = hashlib.md5(
+        json.dumps([params, state], sort_keys=True, default=str).encode()).hexdigest()
+    return f'accounts:{namespace}:{digest}'
+
+
+def read_through(key, loader):
+    """Return the cached value for ``key``, calling ``loader`` on a miss."""
+    cache = get_cache()
+    value = cache.get(key, _MISSING)
+    hit = value is not _MISSING
+    with _stats_lock:
+        _stats['hits' if hit else 'misses'] += 1
+    if not hit:
+        value = loader()
+        cache.set(key, value, settings.ACCOUNT_CACHE_TIMEOUT)
+    return value
+
+
+def get_stats():
+    with _stats_lock:
+        hits, misses = _stats['hits'], _stats['misses']
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / total, 4) if total else 0.0,
+    }
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.update(hits=0, misses=0)
+
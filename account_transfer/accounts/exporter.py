@@ -0,0 +1,52 @@
+"""Streaming account export.
+
+Rows are read with ``QuerySet.iterator()`` and encoded a chunk at a time.
+Memory use stays flat whatever the table size. The CSV layout is the
+``ID,Name,Balance`` layout that :mod:`accounts.importer` reads, so an
+export can be imported again unchanged.
+"""
+import csv
+import io
+import json
+
+from .models import Account, quantize_balance, total_balance
+
+CSV_HEADER = ['ID', 'Name', 'Balance']
+DEFAULT_CHUNK_SIZE = 2000
+
+
+def _rows(queryset, chunk_size):
+    rows = (queryset.order_by().annotate(total=total_balance())
+            .values_list('id', 'name', 'total').iterator(chunk_size=chunk_size))
+    return ((account_id, name, quantize_balance(balance)) for account_id, name, balance in rows)
+
+
+def iter_csv(queryset=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield the accounts as CSV text, one chunk of rows per item."""
+    if queryset is None:
+        queryset = Account.objects.all()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_HEADER)
+    for count, row in enumerate(_rows(queryset, chunk_size), start=1):
+        writer.writerow(row)
+        if count % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_ndjson(queryset=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield the accounts as newline-delimited JSON, one chunk per item."""
+    if queryset is None:
+        queryset = Account.objects.all()
+    lines = []
+    for account_id, name, balance in _rows(queryset, chunk_size):
+        lines.append(json.dumps(
+            {'id': str(account_id), 'name': name, 'balance': str(balance)}))
+        if len(lines) >= chunk_size:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
@@ -0,0 +1,189 @@
+"""Group commit for single transfers.
+
+Every call to :func:`accounts.transfers.transfer` commits its own
+transaction, and on SQLite each commit takes the database write lock. With
+``ACCOUNT_GROUP_COMMIT`` on, :func:`transfer` queues the transfer to one
+writer thread per process instead and waits. The writer takes whatever
+has queued up, waiting up to ``ACCOUNT_GROUP_COMMIT_WAIT_MS`` for more, up
+to ``ACCOUNT_GROUP_COMMIT_MAX_ITEMS`` transfers. It applies them with
+:func:`accounts.transfers.transfer_batch` in one transaction, then hands
+each caller its own outcome.
+
+``transfer_batch`` checks each debit against the balance left by the
+transfers before it, under lock, so no account can be overdrawn and a
+refused transfer changes nothing, as with ``Account.withdraw``. It
+reports what a client can get wrong, a short balance or a credit past
+``MAX_BALANCE``, as that transfer's outcome, so only its own caller gets
+the error. If the whole transaction fails, e.g. on a database error,
+every transfer in it fails with the same error.
+
+A caller waits at most ``ACCOUNT_GROUP_COMMIT_TIMEOUT`` seconds for the
+writer to take its transfer; past that the transfer is withdrawn and
+:class:`GroupCommitUnavailable` raised. If the writer thread stops, the
+transfers it had not committed fail the same way and the next call starts
+a new writer.
+
+A caller already inside a transaction (e.g. one storing an
+``Idempotency-Key``) needs the transfer in that transaction, so it
+transfers directly.
+"""
+import atexit
+import queue
+import threading
+import time
+from concurrent import futures
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+from . import transfers
+
+_OUTCOME_ERRORS = {
+    transfers.NOT_FOUND: (transfers.AccountNotFound, "Account not found."),
+    transfers.INSUFFICIENT_FUNDS: (transfers.InsufficientFunds, "Insufficient funds."),
+    transfers.SAME_ACCOUNT: (
+        transfers.SameAccount, "You are trying to transfer money to the same account."),
+    transfers.BALANCE_OVERFLOW: (
+        transfers.BalanceOverflow,
+        f"The recipient's balance cannot exceed {transfers.MAX_BALANCE}."),
+}
+
+_STOP = object()
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+class GroupCommitUnavailable(Exception):
+    """The writer did not take the transfer, which was therefore not applied."""
+
+
+class GroupCommitWriter:
+    """A thread that applies queued transfers a group at a time."""
+
+    def __init__(self, max_items=500, max_wait=0.002):
+        self.max_items = max_items
+        self.max_wait = max_wait
+        # Groups committed and transfers in them, for benchmarks and tests
+        self.groups = 0
+        self.items = 0
+        self._queue = queue.SimpleQueue()
+        self._stopped = False
+        self._submit_lock = threading.Lock()
+        self._thread = threading.Thread(
+            target=self._run, name='account-group-commit', daemon=True)
+        self._thread.start()
+
+    def is_alive(self):
+        return self._thread.is_alive()
+
+    def submit(self, from_account_id, to_account_id, amount):
+        """Queue a validated transfer; the future's result is its outcome.
+
+        Cancelling the future before the writer takes the transfer withdraws
+        it.
+        """
+        future = futures.Future()
+        with self._submit_lock:
+            if self._stopped:
+                raise GroupCommitUnavailable("The transfer writer has stopped.")
+            self._queue.put((from_account_id, to_account_id, amount, future))
+        return future
+
+    def shutdown(self):
+        """Commit what is queued, then stop the thread."""
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _collect(self, first):
+        group = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(group) < self.max_items:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            group.append(item)
+            if item is _STOP:
+                break
+        return group
+
+    def _drain(self):
+        items = []
+        while True:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                return items
+
+    def _run(self):
+        group = []
+        try:
+            stopping = False
+            while not stopping:
+                group = self._collect(self._queue.get())
+                stopping = group[-1] is _STOP
+                group = [item for item in group if item is not _STOP]
+                if group:
+                    self._commit(group)
+        finally:
+            with self._submit_lock:
+                self._stopped = True
+            # Nothing will commit these any more; their callers must not wait forever
+            error = GroupCommitUnavailable("The transfer writer has stopped.")
+            for item in group + self._drain():
+                if item is not _STOP and not item[3].done():
+                    item[3].set_exception(error)
+            connection.close()
+
+    def _commit(self, group):
+        # Callers that gave up waiting have withdrawn their transfers
+        group = [item for item in group if item[3].set_running_or_notify_cancel()]
+        if not group:
+            return
+        try:
+            close_old_connections()
+            outcomes = transfers.transfer_batch(
+                [(from_id, to_id, amount) for from_id, to_id, amount, _ in group])
+        except Exception as exc:
+            for *_, future in group:
+                future.set_exception(exc)
+            return
+        self.groups += 1
+        self.items += len(group)
+        for (*_, future), outcome in zip(group, outcomes):
+            future.set_result(outcome)
+
+
+def get_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            if _writer is not None:
+                atexit.unregister(_writer.shutdown)
+            _writer = GroupCommitWriter(
+                max_items=settings.ACCOUNT_GROUP_COMMIT_MAX_ITEMS,
+                max_wait=settings.ACCOUNT_GROUP_COMMIT_WAIT_MS / 1000)
+            atexit.register(_writer.shutdown)
+        return _writer
+
+
+def transfer(from_account_id, to_account_id, amount):
+    """:func:`accounts.transfers.transfer`, committed in a group with others."""
+    if connection.in_atomic_block:
+        return transfers.transfer(from_account_id, to_account_id, amount)
+    from_account_id, to_account_id, amount = transfers.parse_transfer(
+        from_account_id, to_account_id, amount)
+    future = get_writer().submit(from_account_id, to_account_id, amount)
+    try:
+        outcome = future.result(timeout=settings.ACCOUNT_GROUP_COMMIT_TIMEOUT)
+    except futures.TimeoutError:
+        if future.cancel():
+            raise GroupCommitUnavailable(
+                "The transfer was not committed in time and has not been applied.")
+        # The writer is committing it, which ends in an outcome or an error
+        outcome = future.result()
+    if outcome != transfers.OK:
+        error, message = _OUTCOME_ERRORS[outcome]
+        raise error(message)
+    return amount
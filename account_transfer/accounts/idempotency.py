@@ -0,0 +1,93 @@
+"""Idempotency keys for retried writes.
+
+A client that retries a request with the same ``Idempotency-Key`` header
+gets back the response to its first attempt. :func:`run` does the work
+and stores the response in one transaction. A retry then costs one
+primary key lookup and does not touch ``Account`` rows.
+
+Two attempts racing with the same key both try to store a response. The
+loser's insert fails on the primary key. Its transaction, including the
+work it did, rolls back, and it returns the winner's response instead.
+
+Keys are kept for at least ``ACCOUNT_IDEMPOTENCY_KEY_TTL`` seconds;
+``manage.py prune_idempotency_keys`` deletes older ones.
+"""
+import hashlib
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+MAX_KEY_LENGTH = IdempotencyKey._meta.get_field('key').max_length
+
+
+class InvalidKey(ValueError):
+    pass
+
+
+class KeyReused(Exception):
+    """The key was already used for a request with a different fingerprint."""
+
+
+@dataclass
+class Outcome:
+    status_code: int
+    body: str
+    replayed: bool
+
+
+def fingerprint(method, path, body):
+    digest = hashlib.sha256(f'{method} {path}\n'.encode())
+    digest.update(body)
+    return digest.hexdigest()
+
+
+def _replay(key, request_fingerprint):
+    stored = IdempotencyKey.objects.filter(key=key).first()
+    if stored is None:
+        return None
+    if stored.fingerprint != request_fingerprint:
+        raise KeyReused(key)
+    return Outcome(stored.status_code, stored.body, replayed=True)
+
+
+def run(key, request_fingerprint, handler):
+    """Return the stored outcome for ``key``, or call ``handler`` and store its.
+
+    ``handler`` returns ``(status_code, body)``. Server errors are not
+    stored, so the client can retry them. Raises :class:`KeyReused` if
+    ``key`` belongs to another request.
+    """
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise InvalidKey(f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters.")
+
+    outcome = _replay(key, request_fingerprint)
+    if outcome is not None:
+        return outcome
+
+    try:
+        with transaction.atomic():
+            status_code, body = handler()
+            if status_code < 500:
+                IdempotencyKey.objects.create(
+                    key=key, fingerprint=request_fingerprint,
+                    status_code=status_code, body=body)
+    except IntegrityError:
+        # A concurrent attempt stored its response first
+        outcome = _replay(key, request_fingerprint)
+        if outcome is None:
+            raise
+        return outcome
+    return Outcome(status_code, body, replayed=False)
+
+
+def prune(now=None):
+    """Delete keys older than ``ACCOUNT_IDEMPOTENCY_KEY_TTL``; return how many."""
+    cutoff = (now or timezone.now()) - timedelta(
+        seconds=settings.ACCOUNT_IDEMPOTENCY_KEY_TTL)
+    deleted, _ = IdempotencyKey.objects.filter(created_at__lt=cutoff).delete()
+    return deleted
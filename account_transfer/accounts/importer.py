@@ -0,0 +1,409 @@
+"""Streaming, batched CSV import for accounts.
+
+An import reads the file twice. The first pass validates every row and
+writes nothing, so a bad row cannot leave a partial import behind. The
+second pass imports. Both passes go through the file in batches, and each
+batch is converted column by column. Memory use is bounded by the batch
+size, plus one id-to-row-hash entry per row for duplicate detection.
+Each import batch costs one ``id__in`` lookup, one lookup of the newest
+account version and one ``bulk_create``, inside its own transaction.
+
+Gzip-compressed files are detected by their magic number and
+decompressed on the fly.
+
+The mode decides what happens to accounts that already exist:
+
+- ``insert`` skips them.
+- ``upsert`` updates their name and balance. Each batch reads the
+  existing rows once, then writes the new and changed accounts in one
+  ``INSERT ... ON CONFLICT DO UPDATE``. Unchanged rows are not written.
+  A changed sharded account gets the file balance and empty shards. The
+  accounts whose balance changed are re-snapshotted for
+  :mod:`accounts.reconciliation`, so the import does not count as drift.
+- ``replace`` upserts, then deletes the accounts missing from the file.
+  Accounts with journaled transfers are kept, because the journal
+  protects them.
+
+Each batch also updates :mod:`accounts.stats` in its transaction.
+"""
+import csv
+import gzip
+import io
+import itertools
+import uuid
+import zlib
+from dataclasses import dataclass, field
+from decimal import Decimal
+
+from django.db import transaction
+
+from . import reconciliation, search, stats
+from .models import (
+    Account, BalanceShard, Transfer, quantize_balance, stamp_accounts, total_balance,
+    write_stamp,
+)
+
+DEFAULT_BATCH_SIZE = 1000
+
+INSERT = 'insert'
+UPSERT = 'upsert'
+REPLACE = 'replace'
+MODES = (INSERT, UPSERT, REPLACE)
+
+# Errors past this many are counted but not listed
+MAX_REPORTED_ERRORS = 100
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+# Raised while reading a file that is broken as a whole, rather than in a row.
+# Not OSError in general: a failing disk or temporary file is a server error
+UNREADABLE_ERRORS = (UnicodeDecodeError, csv.Error, EOFError, gzip.BadGzipFile, zlib.error)
+
+_balance_field = Account._meta.get_field('balance')
+BALANCE_LIMIT = Decimal(10) ** (_balance_field.max_digits - _balance_field.decimal_places)
+BALANCE_QUANTUM = Decimal(1).scaleb(-_balance_field.decimal_places)
+NAME_MAX_LENGTH = Account._meta.get_field('name').max_length
+
+
+@dataclass
+class ImportResult:
+    imported: int = 0
+    skipped: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    deleted: int = 0
+    kept: int = 0
+
+    @property
+    def processed(self):
+        return self.imported + self.skipped + self.updated + self.unchanged
+
+
+@dataclass
+class RowError:
+    line: int
+    errors: list
+
+
+@dataclass
+class ValidationReport:
+    rows: int = 0
+    error_count: int = 0
+    errors: list = field(default_factory=list)
+    # ``UUID.int`` of every valid ID in the file, mapped to a hash of its row
+    ids: dict = field(default_factory=dict, repr=False)
+
+    def add(self, line, errors):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(RowError(line, errors))
+
+
+class ImportValidationError(ValueError):
+    """The file has invalid rows, so nothing was imported."""
+
+    def __init__(self, report):
+        self.report = report
+        lines = [f"{report.error_count} of {report.rows} rows are invalid; nothing was imported."]
+        lines += [f"line {error.line}: {' '.join(error.errors)}" for error in report.errors]
+        super().__init__('\n'.join(lines))
+
+
+class UnreadableFile(ValueError):
+    """The file could not be read at ``line``."""
+
+    def __init__(self, line, message):
+        self.line = line
+        super().__init__(message)
+
+
+def _unreadable_message(exc, encoding):
+    if isinstance(exc, UnicodeDecodeError):
+        # Text is decoded in chunks, so the bad byte may be a few lines further on
+        return f"The file is not valid {encoding} text from this line on."
+    if isinstance(exc, csv.Error):
+        return f"Unreadable CSV: {exc}."
+    if isinstance(exc, EOFError):
+        return "The gzip file is truncated."
+    if isinstance(exc, zlib.error):
+        return "The gzip file is corrupt."
+    return f"Unreadable file: {exc}."
+
+
+def open_csv(csv_file):
+    """Return ``csv_file``, decompressing it on the fly if it is gzipped."""
+    head = csv_file.read(len(GZIP_MAGIC))
+    csv_file.seek(0)
+    if head == GZIP_MAGIC:
+        return gzip.GzipFile(fileobj=csv_file, mode='rb')
+    return csv_file
+
+
+def iter_batches(csv_file, batch_size, encoding='utf-8'):
+    """Yield lists of ``(line, row)`` for the data rows of an accounts CSV file.
+
+    Raises :class:`UnreadableFile` if the file cannot be decoded or parsed.
+    """
+    text = io.TextIOWrapper(csv_file, encoding=encoding, newline='')
+    try:
+        reader = csv.reader(text)
+        while True:
+            try:
+                batch = [(reader.line_num, row) for row in itertools.islice(reader, batch_size)]
+            except UNREADABLE_ERRORS as exc:
+                # csv counts the line it failed on; the others fail before reading it
+                line = reader.line_num if isinstance(exc, csv.Error) else reader.line_num + 1
+                raise UnreadableFile(line, _unreadable_message(exc, encoding)) from exc
+            if not batch:
+                return
+            # skip blank lines and the header row
+            yield [(line, row) for line, row in batch if row and row[0] != 'ID']
+    finally:
+        # Hand the file back open, so it can be rewound for the next pass
+        text.detach()
+
+
+def _convert_column(values, convert):
+    """Apply ``convert`` to a column, putting ``None`` where it fails."""
+    try:
+        return list(map(convert, values))
+    except (ValueError, ArithmeticError):
+        pass
+    converted = []
+    for value in values:
+        try:
+            converted.append(convert(value))
+        except (ValueError, ArithmeticError):
+            converted.append(None)
+    return converted
+
+
+def _columns_valid(ids, names, balances):
+    """Check whole columns at once; ``False`` means some row needs a closer look."""
+    if not names:
+        return True
+    if None in ids or None in balances:
+        return False
+    if not all(names) or len(max(names, key=len)) > NAME_MAX_LENGTH:
+        return False
+    try:
+        # A sum of decimals keeps the smallest exponent of its terms, and
+        # is NaN or infinite if any term is
+        total = sum(balances)
+    except ArithmeticError:
+        return False
+    return (total.is_finite()
+            and total.as_tuple().exponent >= -_balance_field.decimal_places
+            and max(balances) < BALANCE_LIMIT and min(balances) > -BALANCE_LIMIT)
+
+
+def parse_batch(batch):
+    """Convert a batch of ``(line, row)`` pairs into account fields.
+
+    Returns ``(accounts, errors)``: the ``(line, id, name, balance)`` of
+    each valid row and the ``(line, messages)`` of each invalid one, in
+    file order.
+    """
+    errors = {}
+    lines, rows = [], []
+    for line, row in batch:
+        if len(row) == 3:
+            lines.append(line)
+            rows.append(row)
+        else:
+            errors[line] = [f"Expected 3 columns, got {len(row)}."]
+
+    id_column, names, balance_column = zip(*rows) if rows else ((), (), ())
+    ids = _convert_column(id_column, uuid.UUID)
+    balances = _convert_column(balance_column, Decimal)
+    if _columns_valid(ids, names, balances):
+        return list(zip(lines, ids, names, balances)), sorted(errors.items())
+
+    accounts = []
+    for line, raw_id, account_id, name, raw_balance, balance in zip(
+            lines, id_column, ids, names, balance_column, balances):
+        messages = []
+        if account_id is None:
+            messages.append(f"Invalid ID {raw_id!r}.")
+        if not name:
+            messages.append("Name is empty.")
+        elif len(name) > NAME_MAX_LENGTH:
+            messages.append(f"Name is longer than {NAME_MAX_LENGTH} characters.")
+        if balance is None or not balance.is_finite():
+            messages.append(f"Invalid balance {raw_balance!r}.")
+        elif abs(balance) >= BALANCE_LIMIT:
+            messages.append(f"Balance {raw_balance} is out of range.")
+        elif balance.quantize(BALANCE_QUANTUM) != balance:
+            messages.append(f"Balance {raw_balance} has more than "
+                            f"{_balance_field.decimal_places} decimal places.")
+        if messages:
+            errors[line] = messages
+        else:
+            accounts.append((line, account_id, name, balance))
+    return accounts, sorted(errors.items())
+
+
+def validate_csv(csv_file, batch_size=None):
+    """Check every row of ``csv_file`` without writing anything.
+
+    A repeated ID is an error when the rows differ. An exact repeat is
+    fine, and the import skips it. A file that cannot be decoded or parsed
+    is reported as an error on the line where reading stopped.
+    """
+    report = ValidationReport()
+    seen = report.ids
+    try:
+        for batch in iter_batches(csv_file, batch_size or DEFAULT_BATCH_SIZE):
+            report.rows += len(batch)
+            accounts, errors = parse_batch(batch)
+            row_hashes = {account_id.int: hash((name, balance))
+                          for _, account_id, name, balance in accounts}
+            if len(row_hashes) == len(accounts) and seen.keys().isdisjoint(row_hashes):
+                seen.update(row_hashes)
+            else:
+                for line, account_id, name, balance in accounts:
+                    row_hash = hash((name, balance))
+                    if seen.setdefault(account_id.int, row_hash) != row_hash:
+                        errors.append((line, [f"ID {account_id} appears earlier in the file "
+                                              "with a different name or balance."]))
+            for line, messages in sorted(errors):
+                report.add(line, messages)
+    except UnreadableFile as exc:
+        # The line that could not be read counts as a row
+        report.rows += 1
+        report.add(exc.line, [str(exc)])
+    return report
+
+
+def import_csv(csv_file, batch_size=None, progress=None, mode=INSERT):
+    """Import accounts from a binary CSV file in the ``ID,Name,Balance`` layout.
+
+    Raises :class:`ImportValidationError` without writing anything if any
+    row is invalid. Rows repeated in the file are skipped; existing
+    accounts are handled according to ``mode`` (see the module docstring).
+    ``progress``, if given, is called with the running
+    :class:`ImportResult` after every committed batch.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown import mode {mode!r}; expected one of {', '.join(MODES)}.")
+    batch_size = batch_size or DEFAULT_BATCH_SIZE
+    csv_file = open_csv(csv_file)
+    report = validate_csv(csv_file, batch_size)
+    if report.error_count:
+        raise ImportValidationError(report)
+
+    csv_file.seek(0)
+    result = ImportResult()
+    import_batch = _import_batch if mode == INSERT else _upsert_batch
+    for batch in iter_batches(csv_file, batch_size):
+        accounts, _ = parse_batch(batch)
+        import_batch(accounts, result)
+        if progress is not None:
+            progress(result)
+    if mode == REPLACE:
+        _delete_missing(report.ids, result, batch_size)
+        if progress is not None:
+            progress(result)
+    return result
+
+
+def _dedupe(rows, result):
+    accounts = {}
+    for _, account_id, name, balance in rows:
+        if account_id in accounts:
+            result.skipped += 1
+            continue
+        accounts[account_id] = Account(
+            id=account_id, name=name, balance=balance)
+    return accounts
+
+
+def _import_batch(rows, result):
+    accounts = _dedupe(rows, result)
+
+    with transaction.atomic():
+        existing = set(Account.objects.filter(
+            id__in=list(accounts)).values_list('id', flat=True))
+        new_accounts = [account for account_id, account in accounts.items()
+                        if account_id not in existing]
+        stamp_accounts(new_accounts)
+        Account.objects.bulk_create(new_accounts)
+        # bulk_create skips post_save, so index the new names here
+        search.index_accounts(new_accounts, replace=False)
+        stats.record((None, account.balance) for account in new_accounts)
+
+    result.imported += len(new_accounts)
+    result.skipped += len(existing)
+
+
+def _upsert_batch(rows, result):
+    accounts = _dedupe(rows, result)
+
+    with transaction.atomic():
+        existing, sharded = {}, set()
+        for account_id, name, balance, shard_count in (
+                Account.objects.filter(id__in=list(accounts))
+                .annotate(total=total_balance())
+                .values_list('id', 'name', 'total', 'shard_count')):
+            existing[account_id] = (name, quantize_balance(balance))
+            if shard_count:
+                sharded.add(account_id)
+        new_accounts, changed, renamed = [], [], []
+        for account_id, account in accounts.items():
+            current = existing.get(account_id)
+            if current is None:
+                new_accounts.append(account)
+            elif current != (account.name, account.balance):
+                changed.append(account)
+                if current[0] != account.name:
+                    renamed.append(account)
+        stamp_accounts(new_accounts + changed)
+        # An account created since the read above is updated, not duplicated
+        Account.objects.bulk_create(
+            new_accounts + changed, update_conflicts=True, unique_fields=['id'],
+            update_fields=['name', 'balance', 'version', 'updated_at'])
+        # The file has the whole balance of a sharded account, so its shards are emptied
+        resharded = [account.id for account in changed if account.id in sharded]
+        if resharded:
+            BalanceShard.objects.filter(account_id__in=resharded).update(
+                balance=0, **write_stamp(BalanceShard))
+        # The file sets these balances; reconciliation counts from them on
+        reconciliation.take_snapshots({
+            account.id: account.balance for account in changed
+            if existing[account.id][1] != account.balance})
+        search.index_accounts(new_accounts, replace=False)
+        search.index_accounts(renamed)
+        stats.record([(None, account.balance) for account in new_accounts] + [
+            (existing[account.id][1], account.balance)
+            for account in changed if account.id not in sharded])
+
+    result.imported += len(new_accounts)
+    result.updated += len(changed)
+    result.unchanged += len(existing) - len(changed)
+
+
+def _delete_missing(file_ids, result, chunk_size):
+    """Delete the accounts whose ``UUID.int`` is not in ``file_ids``."""
+    last_id = None
+    while True:
+        chunk = Account.objects.order_by('id').values_list('id', flat=True)
+        if last_id is not None:
+            chunk = chunk.filter(id__gt=last_id)
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            return
+        last_id = chunk[-1]
+
+        missing = [account_id for account_id in chunk if account_id.int not in file_ids]
+        if not missing:
+            continue
+        with transaction.atomic():
+            journaled = set(Transfer.objects.filter(from_account_id__in=missing)
+                            .values_list('from_account_id', flat=True))
+            journaled.update(Transfer.objects.filter(to_account_id__in=missing)
+                             .values_list('to_account_id', flat=True))
+            deletable = [account_id for account_id in missing if account_id not in journaled]
+            if deletable:
+                Account.objects.filter(id__in=deletable).delete()
+        result.deleted += len(deletable)
+        result.kept += len(journaled)
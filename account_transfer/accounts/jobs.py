@@ -0,0 +1,175 @@
+"""Background account imports.
+
+Uploads are spooled to ``ACCOUNT_IMPORT_SPOOL_DIR`` and processed by a
+process-local thread pool, so the request that submitted them returns
+straight away. Progress is stored on :class:`~accounts.models.ImportJob`
+rows, which any worker process can read.
+
+A process that dies takes its queued and running jobs with it. While a
+process has jobs, a heartbeat thread bumps their ``heartbeat_at`` every
+``ACCOUNT_IMPORT_HEARTBEAT_SECONDS``. :func:`fail_abandoned_jobs` marks
+jobs whose heartbeat is older than ``ACCOUNT_IMPORT_STALE_SECONDS`` as
+failed. It runs when an import is queued and when a job's status is read.
+"""
+import dataclasses
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connection
+from django.utils import timezone
+
+from . import importer
+from .models import ImportJob
+
+_executor = None
+_executor_lock = threading.Lock()
+_futures = {}
+_heartbeat = None
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'ACCOUNT_IMPORT_WORKERS', None)
+                or os.cpu_count(),
+                thread_name_prefix='account-import')
+        return _executor
+
+
+def submit_import(uploaded_file, mode=importer.INSERT, on_done=None):
+    """Spool ``uploaded_file`` to disk and queue it for import.
+
+    ``on_done``, if given, is called without arguments when the job ends.
+    """
+    job = ImportJob(mode=mode)
+    spool_dir = settings.ACCOUNT_IMPORT_SPOOL_DIR
+    os.makedirs(spool_dir, exist_ok=True)
+    job.file_path = os.path.join(spool_dir, f'{job.id}.csv')
+    with open(job.file_path, 'wb') as spool:
+        for chunk in uploaded_file.chunks():
+            spool.write(chunk)
+    job.save()
+    fail_abandoned_jobs()
+
+    future = get_executor().submit(run_import_job, job.id)
+    with _executor_lock:
+        _futures[job.id] = future
+        _start_heartbeat()
+    future.add_done_callback(lambda f: _futures.pop(job.id, None))
+    if on_done is not None:
+        future.add_done_callback(lambda f: on_done())
+    return job
+
+
+def wait_for_job(job_id, timeout=None):
+    """Block until a job submitted by this process has finished."""
+    future = _futures.get(job_id)
+    if future is not None:
+        future.result(timeout)
+
+
+def fail_abandoned_jobs(job_ids=None):
+    """Mark queued or running jobs whose process stopped heartbeating as failed.
+
+    Only the ``job_ids`` jobs, if given. Their spooled files are removed.
+    Returns the number of jobs marked.
+    """
+    abandoned = ImportJob.objects.filter(
+        status__in=[ImportJob.PENDING, ImportJob.RUNNING],
+        heartbeat_at__lt=timezone.now() - timedelta(seconds=settings.ACCOUNT_IMPORT_STALE_SECONDS))
+    if job_ids is not None:
+        abandoned = abandoned.filter(id__in=job_ids)
+    file_paths = list(abandoned.values_list('file_path', flat=True))
+    if not file_paths:
+        return 0
+    marked = abandoned.update(
+        status=ImportJob.FAILED, error="The process running the import stopped.",
+        finished_at=timezone.now())
+    for file_path in file_paths:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+    return marked
+
+
+def is_abandoned(job):
+    """Whether :func:`fail_abandoned_jobs` would mark ``job``, without a query."""
+    return (job.status in (ImportJob.PENDING, ImportJob.RUNNING)
+            and job.heartbeat_at < timezone.now() - timedelta(
+                seconds=settings.ACCOUNT_IMPORT_STALE_SECONDS))
+
+
+def _start_heartbeat():
+    # Called with _executor_lock held
+    global _heartbeat
+    if _heartbeat is None:
+        _heartbeat = threading.Thread(
+            target=_beat, name='account-import-heartbeat', daemon=True)
+        _heartbeat.start()
+
+
+def _beat():
+    try:
+        while True:
+            time.sleep(settings.ACCOUNT_IMPORT_HEARTBEAT_SECONDS)
+            if not _beat_jobs():
+                return
+    finally:
+        connection.close()
+
+
+def _beat_jobs():
+    """Bump the heartbeat of this process's jobs; ``False`` once there are none."""
+    global _heartbeat
+    with _executor_lock:
+        job_ids = list(_futures)
+        if not job_ids:
+            _heartbeat = None
+            return False
+    try:
+        ImportJob.objects.filter(id__in=job_ids).update(heartbeat_at=timezone.now())
+    except DatabaseError:
+        # Busy database; the next beat comes well before the jobs go stale
+        pass
+    return True
+
+
+def run_import_job(job_id):
+    close_old_connections()
+    try:
+        _run(job_id)
+    finally:
+        connection.close()
+
+
+def _run(job_id):
+    job = ImportJob.objects.get(id=job_id)
+    started_at = timezone.now()
+    ImportJob.objects.filter(id=job_id).update(
+        status=ImportJob.RUNNING, started_at=started_at)
+
+    def progress(result):
+        ImportJob.objects.filter(id=job_id).update(**_counts(result))
+
+    try:
+        with open(job.file_path, 'rb') as csv_file:
+            result = importer.import_csv(csv_file, progress=progress, mode=job.mode)
+    except Exception as exc:
+        ImportJob.objects.filter(id=job_id).update(
+            status=ImportJob.FAILED, error=str(exc), finished_at=timezone.now())
+        raise
+    else:
+        ImportJob.objects.filter(id=job_id).update(
+            status=ImportJob.DONE, finished_at=timezone.now(), **_counts(result))
+    finally:
+        if os.path.exists(job.file_path):
+            os.remove(job.file_path)
+
+
+def _counts(result):
+    return {'rows_processed': result.processed, **dataclasses.asdict(result)}
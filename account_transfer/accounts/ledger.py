@@ -0,0 +1,69 @@
+"""The transfer journal.
+
+Every successful transfer appends a :class:`~accounts.models.Transfer`
+row in the transaction that moves the money, so the journal and the
+balances cannot disagree. An account's history is read newest first,
+with keyset pagination on ``(created_at, id)``. The outgoing and incoming
+sides are each read through their own ``(account, created_at)`` index
+and merged, so a page costs two bounded index scans however long the
+history is.
+"""
+import heapq
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Transfer
+from .pagination import InvalidCursor, Page, decode_values, encode_values
+
+
+def record(from_account_id, to_account_id, amount):
+    return Transfer.objects.create(
+        from_account_id=from_account_id, to_account_id=to_account_id,
+        amount=amount)
+
+
+def record_many(items):
+    """Journal ``(from_account_id, to_account_id, amount)`` transfers."""
+    created_at = timezone.now()
+    return Transfer.objects.bulk_create(
+        [Transfer(from_account_id=from_account_id, to_account_id=to_account_id,
+                  amount=amount, created_at=created_at)
+         for from_account_id, to_account_id, amount in items],
+        batch_size=1000)
+
+
+def _encode_cursor(transfer):
+    return encode_values([transfer.created_at.isoformat(), transfer.id])
+
+
+def _decode_cursor(cursor):
+    try:
+        created_at, transfer_id = decode_values(cursor)
+        return datetime.fromisoformat(created_at), int(transfer_id)
+    except (ValueError, TypeError):
+        raise InvalidCursor("Invalid cursor.")
+
+
+def history(account_id, cursor=None, page_size=None):
+    """Return a page of the transfers into or out of an account, newest first."""
+    page_size = page_size or settings.ACCOUNT_PAGE_SIZE
+    after = Q()
+    if cursor:
+        created_at, transfer_id = _decode_cursor(cursor)
+        after = Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=transfer_id)
+
+    sides = [
+        Transfer.objects.filter(after, **{field: account_id})
+        .order_by('-created_at', '-id')[:page_size + 1]
+        for field in ('from_account_id', 'to_account_id')
+    ]
+    merged = heapq.merge(*sides, key=lambda t: (t.created_at, t.id), reverse=True)
+    items = list(merged)[:page_size + 1]
+
+    if len(items) > page_size:
+        items = items[:page_size]
+        return Page(items, _encode_cursor(items[-1]))
+    return Page(items)
@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from accounts import sharding
+
+
+class Command(BaseCommand):
+    help = ("Move the shard balances of sharded accounts into the accounts, "
+            "so that debits find them there. Run it periodically.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=sharding.COMPACT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        compacted = sharding.compact(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Compacted {compacted} sharded accounts in {time.perf_counter() - start:.2f}s."))
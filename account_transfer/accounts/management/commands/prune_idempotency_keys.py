@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from accounts import idempotency
+
+
+class Command(BaseCommand):
+    help = ("Delete stored Idempotency-Key responses older than "
+            "ACCOUNT_IDEMPOTENCY_KEY_TTL seconds.")
+
+    def handle(self, *args, **options):
+        deleted = idempotency.prune()
+        self.stdout.write(self.style.SUCCESS(
+            f"Pruned {deleted} idempotency keys older than "
+            f"{settings.ACCOUNT_IDEMPOTENCY_KEY_TTL}s."))
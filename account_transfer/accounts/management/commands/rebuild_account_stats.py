@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from accounts import stats
+
+
+class Command(BaseCommand):
+    help = ("Recompute the account balance statistics served at /api/accounts/stats/ "
+            "from the accounts, and report any drift. Run it after changing "
+            "ACCOUNT_STATS_BUCKETS.")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        drift = stats.rebuild()
+        elapsed = time.perf_counter() - start
+
+        for bucket in drift:
+            upper = 'up' if bucket.upper is None else f'below {bucket.upper}'
+            self.stdout.write(self.style.WARNING(
+                f"Drift in the bucket from {bucket.lower} {upper}: "
+                f"{bucket.accounts:+} accounts, {bucket.total:+} balance"))
+        style = self.style.WARNING if drift else self.style.SUCCESS
+        self.stdout.write(style(
+            f"Rebuilt the account statistics in {elapsed:.2f}s, "
+            f"{len(drift)} buckets had drifted."))
@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from accounts import reconciliation
+
+
+class Command(BaseCommand):
+    help = ("Check that account balances match their last snapshot plus the "
+            "transfers journaled since, for accounts touched since the last run.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Check every account, not only the touched ones.')
+        parser.add_argument('--restart', action='store_true',
+                            help='Discard an interrupted run instead of resuming it.')
+        parser.add_argument('--chunk-size', type=int,
+                            default=reconciliation.DEFAULT_CHUNK_SIZE)
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of worker processes. Parallel runs need a '
+                                 'database that accepts concurrent writers.')
+
+    def handle(self, *args, **options):
+        run = reconciliation.start_run(full=options['full'], restart=options['restart'])
+        if run.last_account_id is not None:
+            self.stdout.write(
+                f"Resuming run {run.pk} after account {run.last_account_id} "
+                f"({run.accounts_checked} accounts already checked).")
+
+        start = time.perf_counter()
+        stats = reconciliation.run_reconciliation(
+            run, chunk_size=options['chunk_size'], workers=options['workers'])
+        elapsed = time.perf_counter() - start
+
+        for drift in stats.drifts:
+            self.stdout.write(self.style.WARNING(
+                f"Drift on {drift.account_id}: expected {drift.expected}, "
+                f"balance {drift.actual} ({drift.actual - drift.expected:+})"))
+        if stats.drift_count > len(stats.drifts):
+            self.stdout.write(f"... and {stats.drift_count - len(stats.drifts)} more.")
+
+        rate = stats.checked / elapsed if elapsed > 0 else 0
+        summary = (f"Checked {stats.checked} accounts in {elapsed:.2f}s "
+                   f"({rate:.0f} rows/sec), {stats.drift_count} drifted.")
+        style = self.style.WARNING if stats.drift_count else self.style.SUCCESS
+        self.stdout.write(style(summary))
@@ -0,0 +1,23 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts import sharding
+from accounts.models import Account
+
+
+class Command(BaseCommand):
+    help = ("Spread the credits to a hot account over several balance shards, "
+            "or unshard it with --shards 0.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('account_id')
+        parser.add_argument('--shards', type=int, default=8,
+                            help=f'Number of shards, 0 to {sharding.MAX_SHARDS}.')
+
+    def handle(self, *args, **options):
+        try:
+            sharding.set_shard_count(options['account_id'], options['shards'])
+        except (Account.DoesNotExist, ValidationError, ValueError) as exc:
+            raise CommandError(exc)
+        self.stdout.write(self.style.SUCCESS(
+            f"Account {options['account_id']} now has {options['shards']} shards."))
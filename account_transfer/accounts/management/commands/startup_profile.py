@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+
+from account_transfer import startup
+
+
+class Command(BaseCommand):
+    help = ("Boot fresh worker processes with the full and the API-only "
+            "(DJANGO_API_ONLY=1) settings and report their boot time, time to "
+            "first request, memory and slowest imports.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profile', choices=['full', 'api', 'both'], default='both')
+        parser.add_argument('--path', default='/api/accounts/',
+                            help='The first request sent to each worker.')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Boots per profile; the medians are reported.')
+        parser.add_argument('--top', type=int, default=15,
+                            help='Slowest imports to list per profile; 0 skips '
+                                 'the -X importtime run.')
+
+    def handle(self, *args, **options):
+        profiles = ['full', 'api'] if options['profile'] == 'both' else [options['profile']]
+        results = startup.measure(profiles, path=options['path'], repeat=options['repeat'],
+                                  importtime=options['top'] > 0)
+
+        self.stdout.write(f"{'profile':<8} {'boot':>9} {'1st req':>9} {'total':>9} "
+                          f"{'RSS':>9} {'modules':>8} status")
+        for result in results:
+            self.stdout.write(
+                f"{result.profile:<8} {result.boot * 1000:7.1f}ms {result.first_request * 1000:7.1f}ms "
+                f"{result.total * 1000:7.1f}ms {result.rss / 2**20:6.1f}MiB {result.modules:>8} "
+                f"{result.status}")
+            if result.status >= 400:
+                self.stdout.write(self.style.WARNING(
+                    f"{options['path']} answered {result.status} under the {result.profile} "
+                    f"profile; pass --path, or migrate the database it uses."))
+
+        for result in results:
+            if not result.imports:
+                continue
+            self.stdout.write(f"\nSlowest imports ({result.profile}), self time:")
+            for module, self_time, cumulative in sorted(
+                    result.imports, key=lambda item: item[1], reverse=True)[:options['top']]:
+                self.stdout.write(f"  {self_time * 1000:7.1f}ms  {module} "
+                                  f"({cumulative * 1000:.1f}ms with its imports)")
+            self.stdout.write(f"By package ({result.profile}):")
+            for package, (seconds, count) in startup.by_package(result.imports)[:options['top']]:
+                self.stdout.write(f"  {seconds * 1000:7.1f}ms  {package} ({count} modules)")
+
+        if len(results) == 2:
+            full, api = results
+            self.stdout.write(self.style.SUCCESS(
+                f"\nAPI-only: boot {api.boot / full.boot - 1:+.0%}, "
+                f"time to first request {api.total / full.total - 1:+.0%}, "
+                f"RSS {api.rss / full.rss - 1:+.0%}, "
+                f"{full.modules - api.modules} fewer modules."))
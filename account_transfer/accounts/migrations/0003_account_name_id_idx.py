@@ -0,0 +1,17 @@
+# Generated by Django 5.1.4 on 2026-10-17 18:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_importjob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='account',
+            index=models.Index(fields=['name', 'id'], name='account_name_id_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.1.4 on 2026-10-17 18:10
+
+import django.db.models.deletion
+import re
+from django.db import migrations, models
+
+
+def index_existing_names(apps, schema_editor):
+    Account = apps.get_model('accounts', 'Account')
+    AccountNameToken = apps.get_model('accounts', 'AccountNameToken')
+    batch = []
+    for account_id, name in Account.objects.values_list('id', 'name').iterator(chunk_size=2000):
+        for token in sorted(set(re.findall(r'\w+', name.casefold()))):
+            batch.append(AccountNameToken(account_id=account_id, token=token))
+        if len(batch) >= 2000:
+            AccountNameToken.objects.bulk_create(batch)
+            batch = []
+    AccountNameToken.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_account_name_id_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountNameToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=255)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='name_tokens', to='accounts.account')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['token', 'account'], name='account_name_token_idx')],
+            },
+        ),
+        migrations.RunPython(index_existing_names, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.4 on 2026-10-17 18:25
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_accountnametoken'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Transfer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=3, max_digits=10)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('from_account', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='transfers_out', to='accounts.account')),
+                ('to_account', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='transfers_in', to='accounts.account')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['from_account', 'created_at'], name='transfer_from_created_idx'), models.Index(fields=['to_account', 'created_at'], name='transfer_to_created_idx')],
+            },
+        ),
+    ]
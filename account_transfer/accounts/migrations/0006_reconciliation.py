@@ -0,0 +1,41 @@
+# Generated by Django 5.1.4 on 2026-10-17 18:29
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_transfer'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceSnapshot',
+            fields=[
+                ('account', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='snapshot', serialize=False, to='accounts.account')),
+                ('balance', models.DecimalField(decimal_places=3, max_digits=10)),
+                ('transfer_id', models.BigIntegerField(default=0)),
+                ('taken_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ReconciliationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('running', 'Running'), ('done', 'Done')], default='running', max_length=10)),
+                ('full', models.BooleanField(default=False)),
+                ('previous_version_high_water', models.BigIntegerField(default=0)),
+                ('version_high_water', models.BigIntegerField(default=0)),
+                ('previous_shard_version_high_water', models.BigIntegerField(default=0)),
+                ('shard_version_high_water', models.BigIntegerField(default=0)),
+                ('last_account_id', models.UUIDField(blank=True, null=True)),
+                ('accounts_checked', models.PositiveBigIntegerField(default=0)),
+                ('drift_count', models.PositiveBigIntegerField(default=0)),
+                ('started_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
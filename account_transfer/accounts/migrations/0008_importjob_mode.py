@@ -0,0 +1,38 @@
+# Generated by Django 5.1.4 on 2026-10-17 19:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0007_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='deleted',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='kept',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='mode',
+            field=models.CharField(default='insert', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='unchanged',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='updated',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
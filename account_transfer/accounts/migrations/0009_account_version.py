@@ -0,0 +1,56 @@
+# Generated by Django 5.1.4 on 2026-10-17 19:18
+
+import django.utils.timezone
+from django.db import migrations, models
+
+# accounts.models.VERSION_SEQUENCES[Account] and COMMIT_SEQUENCE at the time of writing
+SEQUENCES = ['accounts_account_version_seq', 'accounts_commit_seq']
+
+
+def create_sequences(apps, schema_editor):
+    # SQLite computes versions from MAX(version) (see accounts.models.next_version)
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for sequence in SEQUENCES:
+        schema_editor.execute(f'CREATE SEQUENCE {sequence}')
+
+
+def create_counter(apps, schema_editor):
+    # accounts.models.ACCOUNT_DELETES at the time of writing
+    apps.get_model('accounts', 'Counter').objects.create(name='account_deletes')
+
+
+def drop_sequences(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for sequence in SEQUENCES:
+        schema_editor.execute(f'DROP SEQUENCE IF EXISTS {sequence}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0008_importjob_mode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='account',
+            name='version',
+            field=models.PositiveBigIntegerField(db_index=True, default=0),
+        ),
+        migrations.RunPython(create_sequences, drop_sequences),
+        migrations.CreateModel(
+            name='Counter',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_counter, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.1.4 on 2026-10-17 19:40
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+# accounts.models.VERSION_SEQUENCES[BalanceShard] at the time of writing
+VERSION_SEQUENCE = 'accounts_balanceshard_version_seq'
+
+
+def create_sequence(apps, schema_editor):
+    # SQLite computes versions from MAX(version) (see accounts.models.next_version)
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f'CREATE SEQUENCE {VERSION_SEQUENCE}')
+
+
+def drop_sequence(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f'DROP SEQUENCE IF EXISTS {VERSION_SEQUENCE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0009_account_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='shard_count',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='BalanceShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveSmallIntegerField()),
+                ('balance', models.DecimalField(decimal_places=3, default=0, max_digits=10)),
+                ('version', models.PositiveBigIntegerField(db_index=True, default=0)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='accounts.account')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('account', 'index'), name='balance_shard_account_index_uniq')],
+            },
+        ),
+        migrations.RunPython(create_sequence, drop_sequence),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.1.4 on 2026-10-17 20:07
+
+import bisect
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import migrations, models
+
+# accounts.stats.STRIPES at the time of writing
+STRIPES = 8
+
+
+def count_existing_accounts(apps, schema_editor):
+    Account = apps.get_model('accounts', 'Account')
+    BalanceStats = apps.get_model('accounts', 'BalanceStats')
+    bounds = settings.ACCOUNT_STATS_BUCKETS
+    counts = [0] * len(bounds)
+    totals = [Decimal(0)] * len(bounds)
+    for balance in (Account.objects.filter(shard_count=0)
+                    .values_list('balance', flat=True).iterator(chunk_size=2000)):
+        bucket = max(bisect.bisect_right(bounds, balance) - 1, 0)
+        counts[bucket] += 1
+        totals[bucket] += balance
+    BalanceStats.objects.bulk_create(
+        [BalanceStats(stripe=stripe, bucket=bucket,
+                      accounts=counts[bucket] if stripe == 0 else 0,
+                      total=totals[bucket] if stripe == 0 else 0)
+         for bucket in range(len(bounds)) for stripe in range(STRIPES)])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0010_balanceshard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stripe', models.PositiveSmallIntegerField()),
+                ('bucket', models.PositiveSmallIntegerField()),
+                ('accounts', models.BigIntegerField(default=0)),
+                ('total', models.DecimalField(decimal_places=3, default=0, max_digits=20)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='account',
+            index=models.Index(fields=['shard_count', 'balance'], name='account_shard_balance_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='balancestats',
+            constraint=models.UniqueConstraint(fields=('stripe', 'bucket'), name='balance_stats_stripe_bucket_uniq'),
+        ),
+        migrations.RunPython(count_existing_accounts, migrations.RunPython.noop),
+    ]
@@ -1,25 +1,509 @@
-from django.db import models
+from django.db import connection, connections, models, transaction
+from django.db.models import sql
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from decimal import Decimal
 import uuid
 
 # Create your models here.
 
 
+class AccountQuerySet(models.QuerySet):
+    def delete(self):
+        from . import stats
+
+        # One query counts them all out of accounts.stats, instead of the
+        # post_delete signal doing it account by account
+        with transaction.atomic(using=self.db):
+            stats.record((balance, None) for balance in (
+                self.filter(shard_count=0).values_list('balance', flat=True)))
+            deleted = super().delete()
+            if deleted[0]:
+                count_account_deletes()
+            return deleted
+
+
 class Account(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     name = models.CharField(max_length=255)
     balance = models.DecimalField(max_digits=10, decimal_places=3)
+    # Every write, save() included, sets the version one past the newest in
+    # the table, so MAX(version) changes whenever any account does (see
+    # next_version)
+    version = models.PositiveBigIntegerField(default=0, db_index=True)
+    updated_at = models.DateTimeField(default=timezone.now)
+    # Above zero, credits are spread over this many BalanceShard rows (see
+    # accounts.sharding) and ``balance`` only holds what they don't
+    shard_count = models.PositiveSmallIntegerField(default=0)
+
+    objects = AccountQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Serves the (name, id) keyset pagination of account listings
+            models.Index(fields=['name', 'id'], name='account_name_id_idx'),
+            # Serves the lowest and highest balance of accounts.stats
+            models.Index(fields=['shard_count', 'balance'], name='account_shard_balance_idx'),
+        ]
+
+    @property
+    def total_balance(self):
+        """``balance`` plus the shards; the balance the account really has.
+
+        Querysets annotated with :func:`total_balance` fill it in. Otherwise
+        a sharded account costs one query to sum its shards.
+        """
+        if '_total_balance' in self.__dict__:
+            return self._total_balance
+        if not self.shard_count:
+            return self.balance
+        return quantize_balance(Account.objects.annotate(total=total_balance())
+                                .values_list('total', flat=True).get(pk=self.pk))
+
+    @total_balance.setter
+    def total_balance(self, value):
+        self._total_balance = quantize_balance(value)
+
+    def save(self, *args, update_fields=None, **kwargs):
+        if update_fields is not None and not update_fields:
+            return super().save(*args, update_fields=update_fields, **kwargs)
+        # Stamped like every other write, so that the ETags move; the
+        # transaction also covers the accounts.signals receivers
+        with transaction.atomic():
+            stamp_accounts([self])
+            if update_fields is not None:
+                update_fields = {*update_fields, 'version', 'updated_at'}
+            super().save(*args, update_fields=update_fields, **kwargs)
 
     def deposit(self, amount):
-        self.balance += Decimal(amount)
-        self.save()
+        from . import sharding, stats, transfers
+
+        # Refused rather than rounded, like a transfer amount
+        amount = transfers.parse_amount(amount)
+        with transaction.atomic():
+            credited = sharding.credit(self.pk, amount)
+            if credited is None:
+                raise transfers.AccountNotFound("Account not found.")
+            if not credited:
+                raise transfers.BalanceOverflow(f"The balance cannot exceed {MAX_BALANCE}.")
+            self.refresh_from_db(fields=['balance', 'version', 'updated_at', 'shard_count'])
+            if not self.shard_count:
+                stats.record([(self.balance - amount, self.balance)])
+        self.__dict__.pop('_total_balance', None)
 
     def withdraw(self, amount):
-        if self.balance >= Decimal(amount):
-            self.balance -= Decimal(amount)
-            self.save()
-            return True
-        return False
+        from . import sharding, stats, transfers
+
+        amount = transfers.parse_amount(amount)
+        with transaction.atomic():
+            # The balance check happens in the UPDATE itself, so two concurrent
+            # withdrawals can never overdraw the account
+            withdrawn = bool(sharding.debit(self.pk, amount))
+            self.refresh_from_db(fields=['balance', 'version', 'updated_at', 'shard_count'])
+            if withdrawn and not self.shard_count:
+                stats.record([(self.balance + amount, self.balance)])
+        self.__dict__.pop('_total_balance', None)
+        return withdrawn
 
     def __str__(self):
         return f"{self.name} has {self.balance}$"
+
+
+class BalanceShard(models.Model):
+    """One of the sub-balances credits to a sharded account are spread over.
+
+    Concurrent credits to a hot account then update different rows instead
+    of queueing on one row lock. ``version`` counts like
+    ``Account.version``, but within this table.
+    """
+    account = models.ForeignKey(
+        Account, on_delete=models.CASCADE, related_name='shards')
+    index = models.PositiveSmallIntegerField()
+    balance = models.DecimalField(max_digits=10, decimal_places=3, default=0)
+    version = models.PositiveBigIntegerField(default=0, db_index=True)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'index'],
+                                    name='balance_shard_account_index_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.account_id}#{self.index} at {self.balance}$"
+
+
+class Counter(models.Model):
+    """A count kept in one row, e.g. :data:`ACCOUNT_DELETES`."""
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+
+# Bumped by every delete of accounts, in its transaction (see table_state)
+ACCOUNT_DELETES = 'account_deletes'
+
+
+def count_account_deletes():
+    Counter.objects.filter(name=ACCOUNT_DELETES).update(value=models.F('value') + 1)
+
+
+class BalanceStats(models.Model):
+    """The unsharded accounts with a balance in one bucket, and their total.
+
+    Kept up to date by :mod:`accounts.stats`. Each bucket is split over a
+    few ``stripe`` rows that writers pick at random; a bucket's figures are
+    the sum of its stripes, so one stripe may run negative.
+    """
+    stripe = models.PositiveSmallIntegerField()
+    # Index into ACCOUNT_STATS_BUCKETS
+    bucket = models.PositiveSmallIntegerField()
+    accounts = models.BigIntegerField(default=0)
+    total = models.DecimalField(max_digits=20, decimal_places=3, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['stripe', 'bucket'],
+                                    name='balance_stats_stripe_bucket_uniq'),
+        ]
+
+    def __str__(self):
+        return f"Bucket {self.bucket}#{self.stripe}: {self.accounts} accounts, {self.total}$"
+
+
+def _quoted(model, field_name):
+    return (connection.ops.quote_name(model._meta.db_table),
+            connection.ops.quote_name(model._meta.get_field(field_name).column))
+
+
+# Versions are what ETags compare. On SQLite a write computes one past
+# MAX(version) while it holds the database write lock, so versions grow in
+# commit order. PostgreSQL lets concurrent transactions compute the same
+# MAX(version) + 1, and commit in another order than they took their
+# versions. There each table draws versions from a sequence, so no two
+# writes share one, and every transaction that wrote a version bumps
+# COMMIT_SEQUENCE after it commits. table_state() reads that counter, so
+# a transaction that commits late still changes the listing ETags. The
+# sequences are created by migrations 0009 and 0010.
+VERSION_SEQUENCES = {
+    Account: 'accounts_account_version_seq',
+    BalanceShard: 'accounts_balanceshard_version_seq',
+}
+COMMIT_SEQUENCE = 'accounts_commit_seq'
+
+
+def _uses_sequences():
+    return connection.vendor == 'postgresql'
+
+
+def _count_commit():
+    """Bump ``COMMIT_SEQUENCE`` once the current transaction has committed."""
+    if not any(func is _bump_commits for _, func, _ in connection.run_on_commit):
+        transaction.on_commit(_bump_commits)
+
+
+def _bump_commits():
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT nextval('{COMMIT_SEQUENCE}')")
+
+
+def next_version(model=Account):
+    """An expression for the version of a ``model`` row written now.
+
+    The ``UPDATE`` computes it from the ``version`` index, or on PostgreSQL
+    takes it from the model's sequence. It is raw SQL because compiling the
+    equivalent ``Subquery`` doubles the Python cost of a transfer. Use it
+    inside the writing transaction.
+    """
+    if _uses_sequences():
+        _count_commit()
+        return RawSQL(f"nextval('{VERSION_SEQUENCES[model]}')", ())
+    table, column = _quoted(model, 'version')
+    return RawSQL(f'SELECT COALESCE(MAX({column}), 0) + 1 FROM {table}', ())
+
+
+def write_stamp(model=Account):
+    """``update()`` keyword arguments that mark the rows as just written."""
+    return {'version': next_version(model), 'updated_at': timezone.now()}
+
+
+def update_returning(queryset, fields, **values):
+    """``queryset.update(**values)``, returning ``fields`` of the updated rows.
+
+    One ``UPDATE ... RETURNING`` where the database has it (PostgreSQL,
+    SQLite 3.35+). Elsewhere the rows are locked and read first, and then
+    updated by primary key.
+    """
+    model = queryset.model
+    db_fields = [model._meta.get_field(name) for name in fields]
+    db_connection = connections[queryset.db]
+    if not db_connection.features.can_return_columns_from_insert:
+        rows = list(queryset.select_for_update().values_list('pk', *fields))
+        model._default_manager.filter(pk__in=[row[0] for row in rows]).update(**values)
+        return [row[1:] for row in model._default_manager.filter(
+            pk__in=[row[0] for row in rows]).values_list(*fields)]
+
+    query = queryset.query.chain(sql.UpdateQuery)
+    query.add_update_values(values)
+    update, params = query.get_compiler(queryset.db).as_sql()
+    returning = ', '.join(db_connection.ops.quote_name(field.column) for field in db_fields)
+    with transaction.mark_for_rollback_on_error(using=queryset.db):
+        with db_connection.cursor() as cursor:
+            cursor.execute(f'{update} RETURNING {returning}', params)
+            rows = cursor.fetchall()
+    return [tuple(field.to_python(value) for field, value in zip(db_fields, row))
+            for row in rows]
+
+
+BALANCE_QUANTUM = Decimal('0.001')
+# The largest balance the column holds; a write past it would fail
+MAX_BALANCE = (Decimal(10) ** (Account._meta.get_field('balance').max_digits
+                               - Account._meta.get_field('balance').decimal_places)
+               - BALANCE_QUANTUM)
+
+
+def quantize_balance(value):
+    """Round a computed balance to the ``balance`` column's decimal places."""
+    return value.quantize(BALANCE_QUANTUM)
+
+
+def total_balance():
+    """An expression for :attr:`Account.total_balance`, to annotate querysets with.
+
+    Unsharded accounts skip the shard lookup. SQLite returns computed
+    decimals unrounded, so pass values that are shown through
+    :func:`quantize_balance`.
+    """
+    shards = (BalanceShard.objects.filter(account=models.OuterRef('pk')).order_by()
+              .values('account').annotate(total=models.Sum('balance')).values('total'))
+    output_field = models.DecimalField(max_digits=10, decimal_places=3)
+    return models.Case(
+        models.When(shard_count=0, then=models.F('balance')),
+        default=models.F('balance') + Coalesce(
+            models.Subquery(shards), models.Value(Decimal(0)), output_field=output_field),
+        output_field=output_field)
+
+
+def table_state():
+    """``(newest account version, deletes, newest shard version, commits)``.
+
+    Any write, inserts included, moves the first or the third, and any
+    delete the second (the :data:`ACCOUNT_DELETES` counter). Each is a
+    subquery of its own, answered from an index or one row, so the cost
+    does not grow with the table. ``commits`` is 0 on SQLite; on
+    PostgreSQL it is the ``COMMIT_SEQUENCE`` counter (see ``next_version``).
+    """
+    accounts, version = _quoted(Account, 'version')
+    shards, shard_version = _quoted(BalanceShard, 'version')
+    counters, value = _quoted(Counter, 'value')
+    name = connection.ops.quote_name(Counter._meta.pk.column)
+    commits = f'(SELECT last_value FROM {COMMIT_SEQUENCE})' if _uses_sequences() else '0'
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT (SELECT MAX({version}) FROM {accounts}), '
+                       f'(SELECT {value} FROM {counters} WHERE {name} = %s), '
+                       f'(SELECT MAX({shard_version}) FROM {shards}), {commits}',
+                       [ACCOUNT_DELETES])
+        newest, deletes, newest_shard, commits = cursor.fetchone()
+    return newest or 0, deletes or 0, newest_shard or 0, commits
+
+
+def account_state(account_id):
+    """``(version, shard version, updated_at)`` of an account; ``None`` if there is none.
+
+    Credits to a sharded account only stamp the shard they land on, so its
+    newest shard counts too. One query, plus one for a sharded account.
+    """
+    state = (Account.objects.filter(id=account_id)
+             .values_list('version', 'updated_at', 'shard_count').first())
+    if state is None:
+        return None
+    version, updated_at, shard_count = state
+    if not shard_count:
+        return version, 0, updated_at
+    shards = BalanceShard.objects.filter(account_id=account_id).aggregate(
+        version=models.Max('version'), updated_at=models.Max('updated_at'))
+    return (version, shards['version'] or 0,
+            max(updated_at, shards['updated_at'] or updated_at))
+
+
+def stamp_accounts(accounts):
+    """Mark ``accounts`` as just written, before a bulk write saves them.
+
+    Costs one indexed ``MAX(version)`` lookup, or one ``nextval`` on
+    PostgreSQL. Bulk statements compile an expression once per row, which
+    is slower than the extra query.
+    """
+    if not accounts:
+        return
+    if _uses_sequences():
+        _count_commit()
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT nextval('{VERSION_SEQUENCES[Account]}')")
+            version = cursor.fetchone()[0]
+    else:
+        version = (Account.objects.aggregate(newest=models.Max('version'))['newest'] or 0) + 1
+    now = timezone.now()
+    for account in accounts:
+        account.version = version
+        account.updated_at = now
+
+
+class ImportJob(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    file_path = models.CharField(max_length=500)
+    # One of accounts.importer.MODES
+    mode = models.CharField(max_length=10, default='insert')
+    rows_processed = models.PositiveBigIntegerField(default=0)
+    imported = models.PositiveBigIntegerField(default=0)
+    skipped = models.PositiveBigIntegerField(default=0)
+    updated = models.PositiveBigIntegerField(default=0)
+    unchanged = models.PositiveBigIntegerField(default=0)
+    deleted = models.PositiveBigIntegerField(default=0)
+    kept = models.PositiveBigIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Bumped while the job is queued or running in a live process; see accounts.jobs
+    heartbeat_at = models.DateTimeField(default=timezone.now)
+
+    @property
+    def rate(self):
+        """Rows processed per second since the job started."""
+        if self.started_at is None:
+            return 0.0
+        end = self.finished_at or timezone.now()
+        elapsed = (end - self.started_at).total_seconds()
+        return self.rows_processed / elapsed if elapsed > 0 else 0.0
+
+    def __str__(self):
+        return f"Import {self.id} ({self.status})"
+
+
+class AccountNameToken(models.Model):
+    """One lower-cased word of an account name, for indexed name search."""
+    account = models.ForeignKey(
+        Account, on_delete=models.CASCADE, related_name='name_tokens')
+    token = models.CharField(max_length=255)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['token', 'account'],
+                         name='account_name_token_idx'),
+        ]
+
+    def __str__(self):
+        return self.token
+
+
+class Transfer(models.Model):
+    """Append-only journal entry, written with the balance change it records.
+
+    The bigint primary key only ever grows. The foreign keys skip database
+    constraints (both accounts were just updated in the same transaction),
+    so an insert appends to the table and two indexes and does no other
+    lookups.
+    """
+    from_account = models.ForeignKey(
+        Account, on_delete=models.PROTECT, related_name='transfers_out',
+        db_constraint=False, db_index=False)
+    to_account = models.ForeignKey(
+        Account, on_delete=models.PROTECT, related_name='transfers_in',
+        db_constraint=False, db_index=False)
+    amount = models.DecimalField(max_digits=10, decimal_places=3)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['from_account', 'created_at'],
+                         name='transfer_from_created_idx'),
+            models.Index(fields=['to_account', 'created_at'],
+                         name='transfer_to_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.amount}$ from {self.from_account_id} to {self.to_account_id}"
+
+
+class BalanceSnapshot(models.Model):
+    """The last reconciled balance of an account.
+
+    ``transfer_id`` is the newest journal entry already counted in
+    ``balance``; later entries are what the next reconciliation replays.
+    """
+    account = models.OneToOneField(
+        Account, on_delete=models.CASCADE, primary_key=True,
+        related_name='snapshot')
+    balance = models.DecimalField(max_digits=10, decimal_places=3)
+    transfer_id = models.BigIntegerField(default=0)
+    taken_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.account_id} at {self.balance}$"
+
+
+class ReconciliationRun(models.Model):
+    """A checkpoint of ``manage.py reconcile``.
+
+    A run covers the accounts written since the previous run: those with a
+    ``version`` in ``(previous_version_high_water, version_high_water]``,
+    or with a shard in the same range of shard versions. It also covers
+    the accounts with no snapshot yet. Every write stamps one of the two,
+    deposits, withdrawals and imports included. ``last_account_id`` records
+    how far it got, so an interrupted run can be resumed.
+    """
+    RUNNING = 'running'
+    DONE = 'done'
+    STATUS_CHOICES = [
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+    ]
+
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=RUNNING)
+    full = models.BooleanField(default=False)
+    previous_version_high_water = models.BigIntegerField(default=0)
+    version_high_water = models.BigIntegerField(default=0)
+    previous_shard_version_high_water = models.BigIntegerField(default=0)
+    shard_version_high_water = models.BigIntegerField(default=0)
+    last_account_id = models.UUIDField(null=True, blank=True)
+    accounts_checked = models.PositiveBigIntegerField(default=0)
+    drift_count = models.PositiveBigIntegerField(default=0)
+    started_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Reconciliation {self.pk} ({self.status})"
+
+
+class IdempotencyKey(models.Model):
+    """The response to a request sent with an ``Idempotency-Key`` header.
+
+    Written in the same transaction as the change it answers for, so a
+    stored key always means the change was applied. ``fingerprint`` hashes
+    the request, to reject a key reused for a different request.
+    """
+    key = models.CharField(max_length=255, primary_key=True)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField()
+    body = models.TextField()
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"{self.key} ({self.status_code})"
@@ -0,0 +1,96 @@
+"""Keyset (cursor) pagination over accounts ordered by ``(name, id)``.
+
+A page is fetched with ``WHERE (name, id) > (last name, last id)`` and
+an index on ``(name, id)``. The cost of a page does not depend on how
+deep into the table it is, unlike ``OFFSET``. Cursors are opaque
+URL-safe tokens that encode the last row of the previous page.
+"""
+import base64
+import json
+import uuid
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.db.models import Q
+
+ORDERING = ('name', 'id')
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+@dataclass
+class Page:
+    items: list
+    next_cursor: str = None
+
+
+def encode_values(values):
+    """Pack a list of JSON-serializable values into an opaque cursor."""
+    payload = json.dumps(values)
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_values(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise InvalidCursor("Invalid cursor.")
+
+
+def encode_cursor(account):
+    return encode_values([account.name, str(account.id)])
+
+
+def decode_cursor(cursor):
+    try:
+        name, account_id = decode_values(cursor)
+        return str(name), uuid.UUID(account_id)
+    except (ValueError, TypeError):
+        raise InvalidCursor("Invalid cursor.")
+
+
+def get_page_size(value=None):
+    """Parse a requested page size, clamped to ``ACCOUNT_MAX_PAGE_SIZE``."""
+    if value in (None, ''):
+        return settings.ACCOUNT_PAGE_SIZE
+    try:
+        page_size = int(value)
+    except (TypeError, ValueError):
+        raise ValueError("page_size should be a positive integer.")
+    if page_size <= 0:
+        raise ValueError("page_size should be a positive integer.")
+    return min(page_size, settings.ACCOUNT_MAX_PAGE_SIZE)
+
+
+def _page_queryset(queryset, cursor, page_size):
+    queryset = queryset.order_by(*ORDERING)
+    if cursor:
+        name, account_id = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(name__gt=name) | Q(name=name, id__gt=account_id))
+    # One extra row tells us whether there is a next page
+    return queryset[:page_size + 1]
+
+
+def _make_page(items, page_size):
+    if len(items) > page_size:
+        items = items[:page_size]
+        return Page(items, encode_cursor(items[-1]))
+    return Page(items)
+
+
+def paginate(queryset, cursor=None, page_size=None):
+    """Return the page of ``queryset`` that follows ``cursor``."""
+    page_size = page_size or settings.ACCOUNT_PAGE_SIZE
+    items = list(_page_queryset(queryset, cursor, page_size))
+    return _make_page(items, page_size)
+
+
+async def apaginate(queryset, cursor=None, page_size=None):
+    """Async version of :func:`paginate` for async views."""
+    page_size = page_size or settings.ACCOUNT_PAGE_SIZE
+    items = [item async for item in _page_queryset(queryset, cursor, page_size)]
+    return _make_page(items, page_size)
@@ -0,0 +1,215 @@
+"""Incremental balance reconciliation.
+
+Each account has a :class:`~accounts.models.BalanceSnapshot`: its balance
+as of a given journal entry. To check an account, take the snapshot,
+replay the journal entries recorded since, and compare the result with
+the account's balance, shards included. Any difference is drift, meaning money that moved
+outside :mod:`accounts.transfers` (e.g. ``Account.deposit``) or was lost.
+The account is then re-snapshotted at its current balance. ``upsert`` and
+``replace`` imports set balances on purpose, so they re-snapshot the
+accounts they change in the same transaction (see :func:`take_snapshots`).
+
+A run only checks the accounts written since the previous run, found
+through ``Account.version`` and ``BalanceShard.version``, plus accounts
+that have no snapshot yet (new imports). Every write stamps a version,
+so deposits and withdrawals are checked as well as transfers. ``full``
+checks every account. Accounts are processed in id order, in chunks, and
+the run's progress is checkpointed after every chunk so it can resume.
+"""
+import multiprocessing
+from collections import deque
+from dataclasses import dataclass, field
+
+from django.db import connections, transaction
+from django.db.models import F, Max, Q
+from django.utils import timezone
+
+from .models import Account, BalanceShard, BalanceSnapshot, ReconciliationRun, Transfer
+
+DEFAULT_CHUNK_SIZE = 1000
+MAX_REPORTED_DRIFTS = 100
+
+
+@dataclass
+class Drift:
+    account_id: object
+    expected: object
+    actual: object
+
+
+@dataclass
+class ChunkResult:
+    last_account_id: object
+    checked: int
+    drifts: list
+
+
+@dataclass
+class RunStats:
+    checked: int = 0
+    drift_count: int = 0
+    drifts: list = field(default_factory=list)
+
+
+def start_run(full=False, restart=False):
+    """Return the unfinished run to resume, or start a new one."""
+    unfinished = ReconciliationRun.objects.filter(
+        status=ReconciliationRun.RUNNING).order_by('-pk').first()
+    if unfinished is not None:
+        if not restart:
+            return unfinished
+        unfinished.delete()
+
+    previous = ReconciliationRun.objects.filter(
+        status=ReconciliationRun.DONE).order_by('-pk').first()
+    if full:
+        previous = None
+    return ReconciliationRun.objects.create(
+        full=full,
+        previous_version_high_water=previous.version_high_water if previous else 0,
+        version_high_water=Account.objects.aggregate(
+            high_water=Max('version'))['high_water'] or 0,
+        previous_shard_version_high_water=previous.shard_version_high_water if previous else 0,
+        shard_version_high_water=BalanceShard.objects.aggregate(
+            high_water=Max('version'))['high_water'] or 0)
+
+
+def iter_chunks(run, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield sorted lists of account ids still to be checked by ``run``.
+
+    Each chunk is one query for the next ``chunk_size`` ids after the last
+    one, so only a chunk of ids is ever held in memory.
+    """
+    accounts = Account.objects.order_by('id')
+    if not run.full:
+        accounts = accounts.filter(
+            Q(version__gt=run.previous_version_high_water, version__lte=run.version_high_water)
+            # Credits to a sharded account only stamp the shard
+            | Q(id__in=BalanceShard.objects.filter(
+                version__gt=run.previous_shard_version_high_water,
+                version__lte=run.shard_version_high_water,
+            ).values('account_id'))
+            | Q(snapshot__isnull=True))
+
+    last_id = run.last_account_id
+    while True:
+        chunk = accounts if last_id is None else accounts.filter(id__gt=last_id)
+        chunk = list(chunk.values_list('id', flat=True)[:chunk_size].iterator())
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1]
+
+
+def reconcile_chunk(account_ids):
+    """Check and re-snapshot one chunk of accounts."""
+    with transaction.atomic():
+        # Locking the accounts holds back transfers that touch them, so every
+        # journal entry for them is committed and visible from here on
+        balances, sharded = {}, []
+        for account_id, balance, shard_count in (
+                Account.objects.select_for_update().filter(id__in=account_ids)
+                .order_by('id').values_list('id', 'balance', 'shard_count')):
+            balances[account_id] = balance
+            if shard_count:
+                sharded.append(account_id)
+        if sharded:
+            # Credits to shards leave the account row alone, so lock them too
+            for account_id, balance in (BalanceShard.objects.select_for_update()
+                                        .filter(account_id__in=sharded)
+                                        .order_by('account_id', 'index')
+                                        .values_list('account_id', 'balance')):
+                balances[account_id] += balance
+        high_water = Transfer.objects.aggregate(high_water=Max('id'))['high_water'] or 0
+        snapshots = {snapshot.account_id: snapshot
+                     for snapshot in BalanceSnapshot.objects.filter(account_id__in=account_ids)}
+
+        expected = {account_id: snapshot.balance
+                    for account_id, snapshot in snapshots.items()}
+        if snapshots:
+            since = min(snapshot.transfer_id for snapshot in snapshots.values())
+            journal = Transfer.objects.filter(
+                Q(from_account_id__in=list(snapshots)) | Q(to_account_id__in=list(snapshots)),
+                id__gt=since, id__lte=high_water,
+            ).values_list('id', 'from_account_id', 'to_account_id', 'amount')
+            for transfer_id, from_account_id, to_account_id, amount in journal.iterator():
+                for account_id, delta in ((from_account_id, -amount), (to_account_id, amount)):
+                    snapshot = snapshots.get(account_id)
+                    if snapshot is not None and transfer_id > snapshot.transfer_id:
+                        expected[account_id] += delta
+
+        drifts = [Drift(account_id, expected[account_id], balance)
+                  for account_id, balance in balances.items()
+                  if account_id in expected and expected[account_id] != balance]
+
+        take_snapshots(balances, high_water)
+
+    return ChunkResult(account_ids[-1], len(balances), drifts)
+
+
+def take_snapshots(balances, high_water=None):
+    """Snapshot accounts at the ``{account_id: balance}`` they have now.
+
+    Call it in the transaction that wrote or locked the accounts, so that
+    no journal entry for them is pending. ``high_water`` is the newest
+    journal entry already counted, looked up if not given.
+    """
+    if not balances:
+        return
+    if high_water is None:
+        high_water = Transfer.objects.aggregate(high_water=Max('id'))['high_water'] or 0
+    taken_at = timezone.now()
+    BalanceSnapshot.objects.bulk_create(
+        [BalanceSnapshot(account_id=account_id, balance=balance,
+                         transfer_id=high_water, taken_at=taken_at)
+         for account_id, balance in balances.items()],
+        update_conflicts=True, unique_fields=['account'],
+        update_fields=['balance', 'transfer_id', 'taken_at'])
+
+
+def _reconcile_chunk_in_worker(account_ids):
+    try:
+        return reconcile_chunk(account_ids)
+    finally:
+        connections.close_all()
+
+
+def run_reconciliation(run, chunk_size=DEFAULT_CHUNK_SIZE, workers=1, progress=None):
+    """Process ``run`` to completion and return its :class:`RunStats`.
+
+    With ``workers > 1`` chunks are checked in forked worker processes,
+    a few chunks ahead of the checkpoint, which only advances in order.
+    ``progress``, if given, is called with the stats after every chunk.
+    """
+    stats = RunStats()
+
+    def record(result):
+        stats.checked += result.checked
+        stats.drift_count += len(result.drifts)
+        room = MAX_REPORTED_DRIFTS - len(stats.drifts)
+        stats.drifts.extend(result.drifts[:max(room, 0)])
+        ReconciliationRun.objects.filter(pk=run.pk).update(
+            last_account_id=result.last_account_id,
+            accounts_checked=F('accounts_checked') + result.checked,
+            drift_count=F('drift_count') + len(result.drifts))
+        if progress is not None:
+            progress(stats)
+
+    if workers > 1:
+        # Forked children must not share the parent's database connections
+        connections.close_all()
+        with multiprocessing.get_context('fork').Pool(workers) as pool:
+            pending = deque()
+            for chunk in iter_chunks(run, chunk_size):
+                pending.append(pool.apply_async(_reconcile_chunk_in_worker, (chunk,)))
+                if len(pending) >= workers * 2:
+                    record(pending.popleft().get())
+            while pending:
+                record(pending.popleft().get())
+    else:
+        for chunk in iter_chunks(run, chunk_size):
+            record(reconcile_chunk(chunk))
+
+    ReconciliationRun.objects.filter(pk=run.pk).update(
+        status=ReconciliationRun.DONE, finished_at=timezone.now())
+    return stats
@@ -0,0 +1,62 @@
+"""Indexed account name search.
+
+Every word of an account name is stored lower-cased in
+:class:`~accounts.models.AccountNameToken`, indexed on ``(token,
+account)``. A query matches the accounts that have, for each query word,
+a name word starting with it. "bry ri" finds "Bryan Rice". Each word is
+an index range scan instead of a ``LOWER(name) LIKE '%...%'`` over the
+whole table. Words shorter than ``MIN_PREFIX_LENGTH`` would match a large
+share of the index, so they are checked with ``icontains``. Queries that
+have only such words fall back to ``icontains`` completely.
+"""
+import re
+
+from django.db.models import Q
+
+from .models import Account, AccountNameToken
+
+TOKEN_RE = re.compile(r'\w+')
+MIN_PREFIX_LENGTH = 3
+
+
+def tokenize(text):
+    return sorted(set(TOKEN_RE.findall(text.casefold())))
+
+
+def index_accounts(accounts, replace=True):
+    """Write the name tokens of ``accounts``.
+
+    Pass ``replace=False`` for accounts that were just created and have no
+    tokens yet, which saves the delete.
+    """
+    if replace:
+        AccountNameToken.objects.filter(account__in=accounts).delete()
+    AccountNameToken.objects.bulk_create(
+        [AccountNameToken(account_id=account.id, token=token)
+         for account in accounts for token in tokenize(account.name)],
+        batch_size=1000)
+
+
+def _prefix_range(prefix):
+    # Every string that starts with prefix sorts in [prefix, upper)
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return {'token__gte': prefix, 'token__lt': upper}
+
+
+def search_accounts(query, queryset=None):
+    """Filter ``queryset`` (all accounts by default) by a name search."""
+    if queryset is None:
+        queryset = Account.objects.all()
+    tokens = tokenize(query)
+    indexed = [token for token in tokens if len(token) >= MIN_PREFIX_LENGTH]
+    if not indexed:
+        return queryset.filter(Q(name__icontains=query))
+    for token in indexed:
+        queryset = queryset.filter(id__in=AccountNameToken.objects.filter(
+            **_prefix_range(token)).values('account_id'))
+    # Very short words match too many tokens to be worth an index range;
+    # check them against the rows the longer words already narrowed down
+    for token in tokens:
+        if len(token) < MIN_PREFIX_LENGTH:
+            queryset = queryset.filter(name__icontains=token)
+    return queryset
@@ -0,0 +1,176 @@
+"""Sharded balances for hot accounts.
+
+Every credit to an account updates its row, so concurrent credits to one
+busy account queue on that row's lock. A sharded account also has
+``shard_count`` :class:`~accounts.models.BalanceShard` rows. Each credit
+goes to one of them, picked at random, and leaves the account row alone.
+The account's balance is ``Account.balance`` plus its shards; readers get
+it from :func:`~accounts.models.total_balance`.
+
+Debits still take from ``Account.balance`` with a conditional ``UPDATE``,
+so an account can never be overdrawn. When that is short, :func:`fold`
+moves the shards into it under lock and the debit is tried once more.
+``manage.py compact_shards`` folds every sharded account. Run it
+periodically, so that most debits find enough in ``Account.balance``.
+
+Unsharded accounts pay nothing extra: their credit is the same single
+``UPDATE``, and only a credit that matches no row looks further.
+
+A credit never takes an account past ``MAX_BALANCE``. A shard credit
+checks the account's whole balance in its ``UPDATE``. That is exact on
+SQLite, which runs one write at a time; on PostgreSQL two concurrent
+credits to different shards of an account close to the limit can both
+pass the check.
+"""
+import random
+
+from django.db import transaction
+from django.db.models import F, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from . import stats
+from .models import (MAX_BALANCE, Account, BalanceShard, stamp_accounts, update_returning,
+                     write_stamp)
+
+MAX_SHARDS = 64
+COMPACT_CHUNK_SIZE = 500
+
+
+def credit(account_id, amount, balances=None):
+    """Add ``amount`` to the account if its balance can hold it.
+
+    Returns ``True`` if it was added, ``False`` if the balance would pass
+    ``MAX_BALANCE`` and ``None`` if there is no such account. The new
+    balance of an unsharded account goes into ``balances``, if given.
+    """
+    updated = update_returning(Account.objects.filter(
+        id=account_id, shard_count=0, balance__lte=MAX_BALANCE - amount,
+    ), ['balance'], balance=F('balance') + amount, **write_stamp())
+    if updated:
+        if balances is not None:
+            balances[account_id] = updated[0][0]
+        return True
+    # Only the failure path pays for looking at the account
+    shard_count = (Account.objects.filter(id=account_id)
+                   .values_list('shard_count', flat=True).first())
+    if not shard_count:
+        return None if shard_count is None else False
+    return credit_shard(account_id, shard_count, amount)
+
+
+def credit_shard(account_id, shard_count, amount):
+    """Add ``amount`` to a random shard of a sharded account; see :func:`credit`."""
+    index = random.randrange(shard_count)
+    # The rest of the balance: the account row and the other shards
+    rest = (Subquery(Account.objects.filter(id=account_id).values('balance'))
+            + Coalesce(Subquery(BalanceShard.objects.filter(account_id=account_id)
+                                .exclude(index=index).order_by()
+                                .values('account').annotate(total=Sum('balance'))
+                                .values('total')), Value(0)))
+    return bool(BalanceShard.objects.filter(
+        account_id=account_id, index=index, balance__lte=MAX_BALANCE - amount - rest,
+    ).update(balance=F('balance') + amount, **write_stamp(BalanceShard)))
+
+
+def debit(account_id, amount, balances=None):
+    """Take ``amount`` if the account has it.
+
+    Returns ``True`` if it was taken, ``False`` if the account is short and
+    ``None`` if there is no such account. The new balance of an unsharded
+    account goes into ``balances``, if given.
+    """
+    if _debit_base(account_id, amount, balances):
+        return True
+    # Only the failure path pays for looking at the account
+    shard_count = (Account.objects.filter(id=account_id)
+                   .values_list('shard_count', flat=True).first())
+    if not shard_count:
+        return None if shard_count is None else False
+    with transaction.atomic():
+        # The shards may hold the rest of the balance
+        fold([account_id])
+        return _debit_base(account_id, amount)
+
+
+def _debit_base(account_id, amount, balances=None):
+    updated = update_returning(Account.objects.filter(
+        id=account_id, balance__gte=amount,
+    ), ['balance', 'shard_count'], balance=F('balance') - amount, **write_stamp())
+    if updated and balances is not None and not updated[0][1]:
+        balances[account_id] = updated[0][0]
+    return bool(updated)
+
+
+def fold(account_ids):
+    """Move the shard balances of the sharded ``account_ids`` into their accounts.
+
+    Returns the folded accounts, each with its new ``balance``.
+    """
+    with transaction.atomic():
+        accounts = list(Account.objects.select_for_update()
+                        .filter(id__in=account_ids, shard_count__gt=0)
+                        .order_by('id').only('id', 'balance'))
+        fold_locked(accounts)
+    return accounts
+
+
+def fold_locked(accounts):
+    """Like :func:`fold`, for account instances already locked by the caller.
+
+    Adds to their ``balance`` in place and writes it.
+    """
+    if not accounts:
+        return
+    by_id = {account.id: account for account in accounts}
+    folded = set()
+    for account_id, balance in (BalanceShard.objects.select_for_update()
+                                .filter(account_id__in=list(by_id)).exclude(balance=0)
+                                .order_by('account_id', 'index')
+                                .values_list('account_id', 'balance')):
+        by_id[account_id].balance += balance
+        folded.add(account_id)
+    if not folded:
+        return
+    BalanceShard.objects.filter(account_id__in=folded).update(
+        balance=0, **write_stamp(BalanceShard))
+    changed = [by_id[account_id] for account_id in folded]
+    stamp_accounts(changed)
+    Account.objects.bulk_update(changed, ['balance', 'version', 'updated_at'])
+
+
+def set_shard_count(account_id, shard_count):
+    """Spread the account's credits over ``shard_count`` shards; 0 unshards it.
+
+    The current shards are folded first, so no balance is lost. Sharded
+    accounts are not counted in :mod:`accounts.stats`, so the account moves
+    out of or back into its figures.
+    """
+    if not 0 <= shard_count <= MAX_SHARDS:
+        raise ValueError(f"Shard count must be between 0 and {MAX_SHARDS}.")
+    with transaction.atomic():
+        account = (Account.objects.select_for_update()
+                   .only('id', 'balance', 'shard_count').get(id=account_id))
+        fold_locked([account])
+        if not account.shard_count and shard_count:
+            stats.record([(account.balance, None)])
+        elif account.shard_count and not shard_count:
+            stats.record([(None, account.balance)])
+        BalanceShard.objects.filter(account_id=account_id).delete()
+        BalanceShard.objects.bulk_create(
+            [BalanceShard(account_id=account_id, index=index) for index in range(shard_count)])
+        Account.objects.filter(id=account_id).update(shard_count=shard_count, **write_stamp())
+
+
+def compact(chunk_size=COMPACT_CHUNK_SIZE):
+    """Fold every sharded account, a chunk per transaction; return how many."""
+    compacted = 0
+    last_id = None
+    while True:
+        chunk = Account.objects.filter(shard_count__gt=0).order_by('id')
+        if last_id is not None:
+            chunk = chunk.filter(id__gt=last_id)
+        chunk = list(chunk.values_list('id', flat=True)[:chunk_size])
+        if not chunk:
+            return compacted
+        last_id = chunk[-1]
+        compacted += len(fold(chunk))
@@ -0,0 +1,50 @@
+from django.db import models
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import search, stats
+from .models import Account, count_account_deletes
+
+_balance_field = Account._meta.get_field('balance')
+
+
+@receiver(pre_save, sender=Account)
+def remember_stored_balance(sender, instance, update_fields=None, **kwargs):
+    # save() does not say what it overwrote; accounts.stats needs the old balance
+    instance._stored_balance = None
+    if not instance._state.adding and (update_fields is None or 'balance' in update_fields):
+        instance._stored_balance = (Account.objects.filter(pk=instance.pk)
+                                    .values_list('balance', 'shard_count').first())
+
+
+@receiver(post_save, sender=Account)
+def index_account_name(sender, instance, created, update_fields=None, **kwargs):
+    # Keep the search tokens in step with the name
+    if created or update_fields is None or 'name' in update_fields:
+        search.index_accounts([instance], replace=not created)
+
+
+@receiver(post_save, sender=Account)
+def count_saved_balance(sender, instance, created, **kwargs):
+    stored = instance.__dict__.pop('_stored_balance', None)
+    # The instance holds whatever it was given, e.g. an int or a string
+    balance = _balance_field.to_python(instance.balance)
+    if created:
+        if not instance.shard_count:
+            stats.record([(None, balance)])
+    elif stored is not None and not stored[1] and stored[0] != balance:
+        stats.record([(stored[0], balance)])
+
+
+@receiver(post_delete, sender=Account)
+def count_deleted_account(sender, instance, origin=None, **kwargs):
+    # AccountQuerySet.delete() counts its delete once, not per account
+    if not isinstance(origin, models.QuerySet):
+        count_account_deletes()
+
+
+@receiver(post_delete, sender=Account)
+def count_deleted_balance(sender, instance, origin=None, **kwargs):
+    # AccountQuerySet.delete() has counted the accounts it deletes
+    if not isinstance(origin, models.QuerySet) and not instance.shard_count:
+        stats.record([(_balance_field.to_python(instance.balance), None)])
@@ -0,0 +1,208 @@
+"""Account balance statistics at a cost independent of the number of accounts.
+
+:class:`~accounts.models.BalanceStats` holds the number of accounts and
+their balance total per bucket of ``ACCOUNT_STATS_BUCKETS``. Every balance
+change updates it in its own transaction through :func:`record`. This
+covers deposits, withdrawals, transfers, imports, and saves and deletes of
+``Account`` instances. A change that leaves every account in its bucket
+and every bucket total as it was (most transfers between accounts of the
+same bucket) writes nothing. Each bucket is striped over :data:`STRIPES`
+rows and a write picks one at random, so concurrent writers rarely queue
+on one row.
+
+Sharded accounts are left out of the table, so that credits to a hot
+account stay off a shared row. :func:`get_stats` adds their few rows when
+it reads. The lowest and highest balances come from the ``(shard_count,
+balance)`` index.
+
+Writes that bypass the paths above, e.g. an ``update()`` of ``balance`` or
+raw SQL, are missed. ``manage.py rebuild_account_stats`` recomputes the
+table from the accounts and reports what had drifted.
+"""
+import bisect
+import dataclasses
+import random
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.db.models import Case, F, Value, When
+
+from .models import Account, BalanceStats, quantize_balance, total_balance
+
+STRIPES = 8
+
+_ZERO = Decimal(0)
+
+
+@dataclasses.dataclass
+class Bucket:
+    lower: Decimal
+    # None for the last bucket
+    upper: Decimal
+    accounts: int = 0
+    total: Decimal = _ZERO
+
+
+@dataclasses.dataclass
+class Stats:
+    accounts: int
+    total: Decimal
+    lowest: Decimal
+    highest: Decimal
+    buckets: list
+
+    @property
+    def average(self):
+        return quantize_balance(self.total / self.accounts) if self.accounts else None
+
+
+def bucket_of(balance):
+    """The index of the ``ACCOUNT_STATS_BUCKETS`` bucket holding ``balance``."""
+    return max(bisect.bisect_right(settings.ACCOUNT_STATS_BUCKETS, balance) - 1, 0)
+
+
+def record(changes):
+    """Count ``(old balance, new balance)`` changes of unsharded accounts.
+
+    ``old`` is ``None`` for an account that was just created, ``new`` for
+    one that was just deleted. Call it in the transaction of the change.
+    """
+    deltas = {}
+    for old, new in changes:
+        for balance, sign in ((old, -1), (new, 1)):
+            if balance is None:
+                continue
+            delta = deltas.setdefault(bucket_of(balance), [0, _ZERO])
+            delta[0] += sign
+            delta[1] += sign * balance
+    deltas = {bucket: delta for bucket, delta in deltas.items() if any(delta)}
+    if not deltas:
+        return
+
+    stripe = random.randrange(STRIPES)
+    rows = BalanceStats.objects.filter(stripe=stripe, bucket__in=deltas)
+    if rows.update(**_increments(deltas)) < len(deltas):
+        # Rows are created by rebuild(); a bucket added since then gets them here
+        missing = set(deltas) - set(rows.values_list('bucket', flat=True))
+        BalanceStats.objects.bulk_create(
+            [BalanceStats(stripe=stripe, bucket=bucket) for bucket in missing],
+            ignore_conflicts=True)
+        BalanceStats.objects.filter(stripe=stripe, bucket__in=missing).update(
+            **_increments({bucket: deltas[bucket] for bucket in missing}))
+
+
+def _increments(deltas):
+    def increment(field, index):
+        output_field = BalanceStats._meta.get_field(field)
+        return F(field) + Case(
+            *[When(bucket=bucket, then=Value(delta[index], output_field=output_field))
+              for bucket, delta in deltas.items()],
+            default=Value(0, output_field=output_field), output_field=output_field)
+
+    return {'accounts': increment('accounts', 0), 'total': increment('total', 1)}
+
+
+def record_accounts(balances, deltas):
+    """:func:`record` for accounts just updated in place.
+
+    ``balances`` maps each unsharded account id to its new balance, as
+    returned by the ``UPDATE`` itself, and ``deltas`` to how much it grew.
+    """
+    record((quantize_balance(balance) - deltas[account_id], quantize_balance(balance))
+           for account_id, balance in balances.items())
+
+
+def get_stats():
+    """The current :class:`Stats`, in three queries whatever the number of accounts."""
+    bounds = settings.ACCOUNT_STATS_BUCKETS
+    buckets = [Bucket(lower=Decimal(lower), upper=Decimal(upper) if upper is not None else None)
+               for lower, upper in zip(bounds, bounds[1:] + [None])]
+    for bucket, accounts, total in (
+            BalanceStats.objects.filter(bucket__lt=len(bounds)).order_by()
+            .values('bucket').annotate(accounts=models.Sum('accounts'), total=models.Sum('total'))
+            .values_list('bucket', 'accounts', 'total')):
+        buckets[bucket].accounts = accounts
+        buckets[bucket].total = quantize_balance(Decimal(total))
+
+    balances = [quantize_balance(balance) for balance in (
+        Account.objects.filter(shard_count__gt=0).annotate(total=total_balance())
+        .values_list('total', flat=True))]
+    for balance in balances:
+        bucket = buckets[bucket_of(balance)]
+        bucket.accounts += 1
+        bucket.total += balance
+    balances += [balance for balance in _unsharded_extremes() if balance is not None]
+
+    return Stats(
+        accounts=sum(bucket.accounts for bucket in buckets),
+        total=sum((bucket.total for bucket in buckets), _ZERO),
+        lowest=min(balances, default=None),
+        highest=max(balances, default=None),
+        buckets=buckets,
+    )
+
+
+def _unsharded_extremes():
+    # One subquery each: SQLite only reads MIN or MAX off an index when it
+    # is the only aggregate of its query
+    quote = connection.ops.quote_name
+    balance = quote(Account._meta.get_field('balance').column)
+    where = (f"FROM {quote(Account._meta.db_table)} "
+             f"WHERE {quote(Account._meta.get_field('shard_count').column)} = 0")
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT (SELECT MIN({balance}) {where}), (SELECT MAX({balance}) {where})')
+        return [Account._meta.get_field('balance').to_python(value)
+                for value in cursor.fetchone()]
+
+
+def rebuild():
+    """Recompute the table from the accounts.
+
+    Returns the :class:`Bucket` list of the drift found, as
+    ``recomputed - recorded`` per bucket; empty if there was none. The
+    rows are locked first, so writers that would change them wait, and
+    none is counted twice or missed.
+    """
+    bounds = settings.ACCOUNT_STATS_BUCKETS
+    with transaction.atomic():
+        recorded = {}
+        for bucket, accounts, total in (BalanceStats.objects.select_for_update()
+                                        .values_list('bucket', 'accounts', 'total')):
+            counted = recorded.setdefault(bucket, [0, _ZERO])
+            counted[0] += accounts
+            counted[1] += total
+
+        bucket = Case(*[When(balance__lt=upper, then=Value(index))
+                        for index, upper in enumerate(bounds[1:])],
+                      default=Value(len(bounds) - 1))
+        recomputed = {
+            index: [accounts, quantize_balance(Decimal(total))]
+            for index, accounts, total in (
+                Account.objects.filter(shard_count=0).order_by()
+                .annotate(bucket=bucket).values('bucket')
+                .annotate(accounts=models.Count('id'), total=models.Sum('balance'))
+                .values_list('bucket', 'accounts', 'total'))
+        }
+
+        # Each bucket's figures go to stripe 0; the other stripes start over at zero
+        BalanceStats.objects.bulk_create(
+            [BalanceStats(stripe=stripe, bucket=index,
+                          accounts=recomputed.get(index, [0, _ZERO])[0] if stripe == 0 else 0,
+                          total=recomputed.get(index, [0, _ZERO])[1] if stripe == 0 else _ZERO)
+             for index in range(len(bounds)) for stripe in range(STRIPES)],
+            update_conflicts=True, unique_fields=['stripe', 'bucket'],
+            update_fields=['accounts', 'total'])
+        BalanceStats.objects.filter(bucket__gte=len(bounds)).delete()
+
+    drift = []
+    for index in sorted(set(recorded) | set(recomputed)):
+        accounts, total = recomputed.get(index, [0, _ZERO])
+        was_accounts, was_total = recorded.get(index, [0, _ZERO])
+        if (accounts, total) != (was_accounts, quantize_balance(was_total)):
+            drift.append(Bucket(
+                lower=Decimal(bounds[index]) if index < len(bounds) else None,
+                upper=Decimal(bounds[index + 1]) if index + 1 < len(bounds) else None,
+                accounts=accounts - was_accounts,
+                total=total - quantize_balance(was_total)))
+    return drift
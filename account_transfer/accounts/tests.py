@@ -1,9 +1,30 @@
-from django.test import TestCase
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from .models import Account
+from django.utils import timezone
+from account_transfer import startup
+from . import (
+    caching, exporter, group_commit, idempotency, importer, reconciliation, search, sharding,
+    stats, transfers,
+)
+from .importer import GZIP_MAGIC
+from .models import (
+    Account, BalanceShard, BalanceSnapshot, BalanceStats, IdempotencyKey, ReconciliationRun,
+    Transfer, quantize_balance, total_balance,
+)
+from datetime import timedelta
 from decimal import Decimal
 from django.http import HttpResponse
+import gzip
+import io
+import random
+import threading
+import time
 import uuid
+from unittest.mock import patch
 
 
 class AccountModelTest(TestCase):
@@ -62,6 +83,24 @@ class AccountModelTest(TestCase):
         # Balance should remain unchanged
         self.assertEqual(self.account.balance, initial_balance)
 
+    def test_amounts_are_parsed_like_transfer_amounts(self):
+        self.account.deposit(0.1)
+        self.assertEqual(self.account.balance, Decimal('1000.100'))
+        self.assertTrue(self.account.withdraw('0.1'))
+        for method, amount in ((self.account.deposit, '0.0004'), (self.account.deposit, 'abc'),
+                               (self.account.withdraw, -5), (self.account.withdraw, '0.0004')):
+            with self.assertRaises(transfers.InvalidAmount):
+                method(amount)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal('1000.000'))
+
+    def test_deposit_past_the_largest_balance(self):
+        with self.assertRaisesMessage(
+                transfers.BalanceOverflow, "The balance cannot exceed 9999999.999."):
+            self.account.deposit('9999000')
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal('1000.000'))
+
     def test_account_str(self):
         """Test the string representation of the Account model."""
         expected_str = "Test Account has 1000.000$"
@@ -73,11 +112,35 @@ class AccountModelTest(TestCase):
             name="Precision Test", balance=Decimal('123.456'))
         self.assertEqual(account.balance, Decimal('123.456'))
 
+    def test_writes_bump_the_version(self):
+        """Every write moves the account past the newest version in the table."""
+        other = Account.objects.create(name="Other", balance=Decimal('10'))
+        Account.objects.filter(pk=other.pk).update(version=41)
+
+        self.account.deposit(Decimal('1'))
+        self.assertEqual(self.account.version, 42)
+        self.account.withdraw(Decimal('1'))
+        self.assertEqual(self.account.version, 43)
+        # a refused withdrawal is not a write
+        self.account.withdraw(Decimal('100000'))
+        self.assertEqual(self.account.version, 43)
+
+        before = self.account.updated_at
+        transfers.transfer(self.account.id, other.id, '1')
+        self.assertEqual(sorted(Account.objects.values_list('version', flat=True)), [44, 45])
+        self.account.refresh_from_db()
+        self.assertGreater(self.account.updated_at, before)
+
+        transfers.transfer_batch([(self.account.id, other.id, Decimal('1'))])
+        self.assertEqual(set(Account.objects.values_list('version', flat=True)), {46})
+
 
 class AccountViewsTest(TestCase):
 
     def setUp(self):
         """Create test accounts."""
+        # Each test starts from the same versions, which key the cache
+        caching.get_cache().clear()
         self.account1 = Account.objects.create(
             name="Account 1", balance=Decimal('1000.000'))
         self.account2 = Account.objects.create(
@@ -100,6 +163,24 @@ class AccountViewsTest(TestCase):
         # 3 existing + 1 new account
         self.assertEqual(Account.objects.count(), 4)
 
+    def test_import_accounts_reports_invalid_rows(self):
+        """An invalid row re-renders the import page with the report."""
+        csv_file = io.BytesIO(f"{uuid.uuid4()},New Account,abc\n".encode())
+        csv_file.name = 'accounts.csv'
+        response = self.client.post(reverse('import_accounts'), {'file': csv_file})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertContains(response, "Line 1: Invalid balance", status_code=400)
+        self.assertEqual(Account.objects.count(), 3)
+
+    def test_import_accounts_reports_unreadable_files(self):
+        csv_file = io.BytesIO(gzip.compress(f"{uuid.uuid4()},New Account,10\n".encode())[:-10])
+        csv_file.name = 'accounts.csv.gz'
+        response = self.client.post(reverse('import_accounts'), {'file': csv_file})
+
+        self.assertContains(response, "Line 1: The gzip file is truncated.", status_code=400)
+        self.assertEqual(Account.objects.count(), 3)
+
     def test_account_list_without_search(self):
         """Test the account_list view without search query."""
         response = self.client.get(reverse('account_list'))
@@ -121,6 +202,21 @@ class AccountViewsTest(TestCase):
         self.assertNotContains(response, "Account 2")
         self.assertNotContains(response, "Account 3")
 
+    def test_account_list_pagination(self):
+        """Test that the account_list view pages through accounts by cursor."""
+        with self.settings(ACCOUNT_PAGE_SIZE=2):
+            response = self.client.get(reverse('account_list'))
+            self.assertContains(response, "Account 2")
+            self.assertNotContains(response, "Account 3")
+            next_cursor = response.context['next_cursor']
+            self.assertIsNotNone(next_cursor)
+
+            response = self.client.get(
+                reverse('account_list'), {'cursor': next_cursor})
+            self.assertContains(response, "Account 3")
+            self.assertNotContains(response, "Account 1")
+            self.assertIsNone(response.context['next_cursor'])
+
     def test_account_detail(self):
         """Test the account_detail view."""
         response = self.client.get(
@@ -183,3 +279,772 @@ class AccountViewsTest(TestCase):
         self.assertEqual(response.status_code, 400)
         self.assertIn(
             "You are trying to transfer money to the same account", response.content.decode())
+
+    def test_transfer_funds_refuses_extra_decimal_places(self):
+        response = self.client.post(reverse('transfer_funds'), {
+            'from_account': self.account1.id,
+            'to_account': self.account2.id,
+            'amount': '1.23456',
+        })
+
+        self.assertContains(
+            response, "Ensure that there are no more than 3 decimal places.", status_code=400)
+        self.account1.refresh_from_db()
+        self.assertEqual(self.account1.balance, Decimal('1000.000'))
+
+
+
+class QueryBudgetTest(TestCase):
+    """Query counts of the model methods and HTML views.
+
+    Views are checked against a small and a larger data set under the
+    same budget, so an N+1 fails here even when behavior is unchanged.
+    """
+
+    def setUp(self):
+        caching.get_cache().clear()
+        self.account1 = Account.objects.create(name="Account 1", balance=Decimal('1000'))
+        self.account2 = Account.objects.create(name="Account 2", balance=Decimal('500'))
+
+    def assertBudget(self, budget, request):
+        """Assert ``request()`` runs ``budget`` queries, then again with 50 more accounts."""
+        with self.assertNumQueries(budget):
+            request()
+        Account.objects.bulk_create(
+            [Account(name=f"Extra {i}", balance=1) for i in range(50)])
+        caching.get_cache().clear()
+        with self.assertNumQueries(budget):
+            request()
+
+    def test_deposit(self):
+        # savepoint, conditional update, balance refresh, stats update, release
+        with self.assertNumQueries(5):
+            self.account1.deposit(Decimal('1'))
+
+    def test_withdraw(self):
+        # savepoint, conditional update, balance refresh, stats update, release
+        with self.assertNumQueries(5):
+            self.account1.withdraw(Decimal('1'))
+        # a refused one also checks whether the account is sharded
+        with self.assertNumQueries(5):
+            self.account1.withdraw(Decimal('100000'))
+
+    def test_account_list(self):
+        # the table state the page is cached under, and the page
+        self.assertBudget(2, lambda: self.client.get(reverse('account_list')))
+        self.assertBudget(2, lambda: self.client.get(
+            reverse('account_list'), {'search': 'Account 1'}))
+
+    def test_account_detail(self):
+        # the account's version the payload is cached under, and the account
+        url = reverse('account_detail', args=[self.account1.id])
+        self.assertBudget(2, lambda: self.client.get(url))
+
+    def test_transfer(self):
+        data = {'from_account': self.account1.id, 'to_account': self.account2.id,
+                'amount': '1'}
+        # Into account2's stats bucket first; transfers within a bucket leave the stats as they are
+        self.account1.withdraw(Decimal('1'))
+        # savepoint, debit, credit, journal insert, release
+        self.assertBudget(5, lambda: self.client.post(reverse('transfer_funds'), data))
+
+    def test_import(self):
+        def import_rows(count):
+            csv_data = "ID,Name,Balance\n" + "".join(
+                f"{uuid.uuid4()},Imported {i},10\n" for i in range(count))
+            csv_file = io.BytesIO(csv_data.encode())
+            csv_file.name = 'accounts.csv'
+            self.client.post(reverse('import_accounts'), {'file': csv_file})
+
+        # savepoint, existing ids, newest version, accounts insert, tokens
+        # insert, stats update, release. One accounts INSERT holds up to 199
+        # rows on SQLite.
+        with self.assertNumQueries(7):
+            import_rows(1)
+        with self.assertNumQueries(7):
+            import_rows(150)
+
+class AccountSearchTest(TestCase):
+
+    def setUp(self):
+        self.bryan = Account.objects.create(name="Bryan Rice", balance=1)
+        self.joy = Account.objects.create(name="Joy Dean", balance=1)
+
+    def test_search_by_word_prefix(self):
+        self.assertEqual(list(search.search_accounts("ric")), [self.bryan])
+        self.assertEqual(list(search.search_accounts("DEAN joy")), [self.joy])
+        self.assertEqual(list(search.search_accounts("bryan dean")), [])
+
+    def test_search_short_words_and_fallback(self):
+        self.assertEqual(list(search.search_accounts("bryan r")), [self.bryan])
+        self.assertEqual(list(search.search_accounts("oy")), [self.joy])
+
+    def test_search_follows_renames(self):
+        self.bryan.name = "Sam Stone"
+        self.bryan.save()
+        self.assertEqual(list(search.search_accounts("rice")), [])
+        self.assertEqual(list(search.search_accounts("stone")), [self.bryan])
+
+    def test_imported_accounts_are_searchable(self):
+        csv_file = io.BytesIO(f"ID,name,balance\n{uuid.uuid4()},Ada Lovelace,10\n".encode())
+        importer.import_csv(csv_file)
+        self.assertEqual(
+            [account.name for account in search.search_accounts("lovel")], ["Ada Lovelace"])
+
+
+class TransferServiceTest(TestCase):
+
+    def setUp(self):
+        self.account1 = Account.objects.create(
+            name="Account 1", balance=Decimal('1000.000'))
+        self.account2 = Account.objects.create(
+            name="Account 2", balance=Decimal('500.000'))
+
+    def test_transfer_uses_two_updates(self):
+        """A transfer is a conditional debit, a credit and a journal entry."""
+        with CaptureQueriesContext(connection) as queries:
+            transfers.transfer(self.account1.id, self.account2.id, '100.5')
+        updates = [q for q in queries if q['sql'].startswith('UPDATE "accounts_account"')]
+        inserts = [q for q in queries if q['sql'].startswith('INSERT')]
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(len(inserts), 1)
+        # plus the savepoint and its release, and the update of the
+        # accounts.stats buckets; the new balances come back from the updates
+        self.assertEqual(len(queries), 6)
+        self.assertTrue(all('RETURNING' in q['sql'] for q in updates))
+        self.account1.refresh_from_db()
+        self.account2.refresh_from_db()
+        self.assertEqual(self.account1.balance, Decimal('899.500'))
+        self.assertEqual(self.account2.balance, Decimal('600.500'))
+
+    def test_transfer_is_journaled(self):
+        transfers.transfer(self.account1.id, self.account2.id, '100.5')
+        entry = Transfer.objects.get()
+        self.assertEqual(entry.from_account_id, self.account1.id)
+        self.assertEqual(entry.to_account_id, self.account2.id)
+        self.assertEqual(entry.amount, Decimal('100.500'))
+
+    def test_batch_locks_accounts_in_id_order(self):
+        """Like transfer(), so that concurrent writers cannot deadlock."""
+        with CaptureQueriesContext(connection) as queries:
+            transfers.transfer_batch([(self.account2.id, self.account1.id, Decimal('1'))])
+        [lock] = [q['sql'] for q in queries if q['sql'].startswith(
+            'SELECT "accounts_account"."id", "accounts_account"."balance"')]
+        self.assertIn('ORDER BY "accounts_account"."id" ASC', lock)
+
+    def test_transfer_insufficient_funds_rolls_back(self):
+        with self.assertRaises(transfers.InsufficientFunds):
+            transfers.transfer(self.account2.id, self.account1.id, 600)
+        self.account1.refresh_from_db()
+        self.assertEqual(self.account1.balance, Decimal('1000.000'))
+        self.assertFalse(Transfer.objects.exists())
+
+    def test_transfer_missing_account_rolls_back(self):
+        # Whichever account sorts first is updated first; both orders must roll back
+        for missing in (uuid.UUID(int=0), uuid.UUID(int=2**128 - 1)):
+            with self.assertRaises(transfers.AccountNotFound):
+                transfers.transfer(self.account1.id, missing, 100)
+            with self.assertRaises(transfers.AccountNotFound):
+                transfers.transfer(missing, self.account1.id, 100)
+        self.account1.refresh_from_db()
+        self.assertEqual(self.account1.balance, Decimal('1000.000'))
+
+    def test_transfer_past_the_largest_balance_rolls_back(self):
+        Account.objects.filter(id=self.account2.id).update(balance=Decimal('9999000'))
+        with self.assertRaisesMessage(
+                transfers.BalanceOverflow, "The recipient's balance cannot exceed 9999999.999."):
+            transfers.transfer(self.account1.id, self.account2.id, '1000')
+        self.account1.refresh_from_db()
+        self.assertEqual(self.account1.balance, Decimal('1000.000'))
+        self.assertFalse(Transfer.objects.exists())
+        transfers.transfer(self.account1.id, self.account2.id, '999.999')
+        self.account2.refresh_from_db()
+        self.assertEqual(self.account2.balance, Decimal('9999999.999'))
+
+    def test_transfer_invalid_amount(self):
+        for amount in (0, -5, 'abc', None, 'NaN'):
+            with self.assertRaises(transfers.InvalidAmount):
+                transfers.transfer(self.account1.id, self.account2.id, amount)
+
+    def test_amounts_a_balance_cannot_hold_are_refused(self):
+        """Like the batch TransferSerializer, rather than rounded or overflowing."""
+        cases = {
+            '1.23456': "Ensure that there are no more than 3 decimal places.",
+            '0.0001': "Ensure that there are no more than 3 decimal places.",
+            '10000000': "Ensure that there are no more than 7 digits before the decimal point.",
+            '1e300': "Ensure that there are no more than 7 digits before the decimal point.",
+            'Infinity': "Amount should be a number.",
+            '-1e300': "Amount should be greater than zero.",
+        }
+        for amount, message in cases.items():
+            with self.assertRaisesMessage(transfers.InvalidAmount, message):
+                transfers.parse_amount(amount)
+        self.assertEqual(transfers.parse_amount('9999999.999'), Decimal('9999999.999'))
+        self.assertEqual(transfers.parse_amount('1.2300'), Decimal('1.230'))
+        self.assertEqual(transfers.parse_amount(0.1), Decimal('0.100'))
+        self.assertEqual(transfers.parse_amount('1E+2'), Decimal('100.000'))
+
+
+class ShardedBalanceTest(TestCase):
+
+    def setUp(self):
+        self.hot = Account.objects.create(name="Hot Account", balance=Decimal('100.000'))
+        self.other = Account.objects.create(name="Other Account", balance=Decimal('1000.000'))
+        sharding.set_shard_count(self.hot.id, 4)
+
+    def total(self):
+        return Account.objects.get(id=self.hot.id).total_balance
+
+    def shard_balances(self):
+        return list(BalanceShard.objects.filter(account=self.hot)
+                    .order_by('index').values_list('balance', flat=True))
+
+    def test_credits_go_to_shards(self):
+        for _ in range(8):
+            transfers.transfer(self.other.id, self.hot.id, '10')
+        self.hot.deposit(Decimal('5'))
+
+        self.assertEqual(self.hot.balance, Decimal('100.000'))
+        self.assertEqual(sum(self.shard_balances()), Decimal('85.000'))
+        self.assertEqual(self.hot.total_balance, Decimal('185.000'))
+        self.assertEqual(self.total(), Decimal('185.000'))
+        annotated = Account.objects.annotate(
+            total_balance=total_balance()).get(id=self.hot.id)
+        self.assertEqual(annotated.total_balance, Decimal('185.000'))
+
+    def test_debits_fold_the_shards_when_short(self):
+        transfers.transfer(self.other.id, self.hot.id, '500')
+        transfers.transfer(self.hot.id, self.other.id, '50')
+        # the account row had enough, so the shards were left alone
+        self.assertEqual(sum(self.shard_balances()), Decimal('500.000'))
+
+        transfers.transfer(self.hot.id, self.other.id, '300')
+        self.hot.refresh_from_db()
+        self.assertEqual(self.hot.balance, Decimal('250.000'))
+        self.assertEqual(self.shard_balances(), [Decimal('0.000')] * 4)
+
+        self.assertFalse(self.hot.withdraw(Decimal('250.001')))
+        self.assertTrue(self.hot.withdraw(Decimal('250')))
+        self.assertIsNone(sharding.debit(uuid.UUID(int=0), Decimal('1')))
+
+    def test_credits_count_the_whole_balance_against_the_limit(self):
+        Account.objects.filter(id=self.hot.id).update(balance=Decimal('9000000'))
+        BalanceShard.objects.filter(account=self.hot, index=0).update(balance=Decimal('999000'))
+        # Whichever shard the credit picks, the total would pass the limit
+        for _ in range(8):
+            self.assertFalse(sharding.credit(self.hot.id, Decimal('1000')))
+        self.assertTrue(sharding.credit(self.hot.id, Decimal('999.999')))
+        self.assertEqual(self.total(), Decimal('9999999.999'))
+        self.assertIsNone(sharding.credit(uuid.UUID(int=0), Decimal('1')))
+
+    def test_batch_transfers_see_the_shards(self):
+        transfers.transfer(self.other.id, self.hot.id, '500')
+        results = transfers.transfer_batch([
+            (self.hot.id, self.other.id, Decimal('550')),
+            (self.hot.id, self.other.id, Decimal('51')),
+        ])
+        self.assertEqual(results, [transfers.OK, transfers.INSUFFICIENT_FUNDS])
+        self.assertEqual(self.total(), Decimal('50.000'))
+
+    def test_batch_credits_go_to_a_shard(self):
+        Account.objects.filter(id=self.hot.id).update(balance=Decimal('9999000'))
+        Account.objects.filter(id=self.other.id).update(balance=Decimal('5000'))
+        self.hot.refresh_from_db()
+        results = transfers.transfer_batch([
+            (self.other.id, self.hot.id, Decimal('600')),
+            (self.other.id, self.hot.id, Decimal('500')),
+        ])
+        self.assertEqual(results, [transfers.OK, transfers.BALANCE_OVERFLOW])
+        # Not folded: the account row is untouched and the credit is in a shard
+        account = Account.objects.get(id=self.hot.id)
+        self.assertEqual((account.balance, account.version),
+                         (Decimal('9999000.000'), self.hot.version))
+        self.assertEqual(sum(self.shard_balances()), Decimal('600.000'))
+        self.assertEqual(self.total(), Decimal('9999600.000'))
+
+    def test_compact_shards(self):
+        transfers.transfer(self.other.id, self.hot.id, '500')
+        out = io.StringIO()
+        call_command('compact_shards', stdout=out)
+        self.assertIn("Compacted 1 sharded accounts", out.getvalue())
+        self.hot.refresh_from_db()
+        self.assertEqual(self.hot.balance, Decimal('600.000'))
+        self.assertEqual(self.shard_balances(), [Decimal('0.000')] * 4)
+
+    def test_shard_account_command(self):
+        transfers.transfer(self.other.id, self.hot.id, '500')
+        call_command('shard_account', str(self.hot.id), '--shards', '2', stdout=io.StringIO())
+        self.assertEqual(len(self.shard_balances()), 2)
+        call_command('shard_account', str(self.hot.id), '--shards', '0', stdout=io.StringIO())
+        self.hot.refresh_from_db()
+        self.assertEqual((self.hot.shard_count, self.hot.balance), (0, Decimal('600.000')))
+        self.assertFalse(BalanceShard.objects.exists())
+
+        with self.assertRaises(CommandError):
+            call_command('shard_account', 'not-a-uuid', stdout=io.StringIO())
+        with self.assertRaises(CommandError):
+            call_command('shard_account', str(self.hot.id), '--shards', '1000')
+
+    def test_readers_include_the_shards(self):
+        transfers.transfer(self.other.id, self.hot.id, '0.5')
+        self.assertIn(f"{self.hot.id},Hot Account,100.500", ''.join(exporter.iter_csv()))
+        response = self.client.get(reverse('account_detail', args=[self.hot.id]))
+        self.assertContains(response, '100.500')
+        response = self.client.get(reverse('account_list'))
+        self.assertContains(response, '100.500')
+
+        call_command('reconcile', stdout=io.StringIO())
+        transfers.transfer(self.other.id, self.hot.id, '7')
+        out = io.StringIO()
+        call_command('reconcile', stdout=out)
+        self.assertIn("0 drifted", out.getvalue())
+
+    def test_upsert_sets_the_whole_balance(self):
+        transfers.transfer(self.other.id, self.hot.id, '500')
+        csv_file = io.BytesIO(f"ID,Name,Balance\n{self.hot.id},Hot Account,42\n".encode())
+        result = importer.import_csv(csv_file, mode=importer.UPSERT)
+        self.assertEqual(result.updated, 1)
+        self.assertEqual(self.total(), Decimal('42.000'))
+
+        csv_file.seek(0)
+        result = importer.import_csv(csv_file, mode=importer.UPSERT)
+        self.assertEqual(result.unchanged, 1)
+
+
+class AccountStatsTest(TestCase):
+
+    def setUp(self):
+        self.account1 = Account.objects.create(name="Account 1", balance=Decimal('1000'))
+        self.account2 = Account.objects.create(name="Account 2", balance=Decimal('5.5'))
+
+    def assertStatsMatchAccounts(self):
+        """The maintained statistics equal a count over every account."""
+        balances = [quantize_balance(balance) for balance in Account.objects.annotate(
+            total=total_balance()).values_list('total', flat=True)]
+        current = stats.get_stats()
+        self.assertEqual(current.accounts, len(balances))
+        self.assertEqual(current.total, sum(balances, Decimal(0)))
+        self.assertEqual(current.lowest, min(balances, default=None))
+        self.assertEqual(current.highest, max(balances, default=None))
+        counts = [0] * len(settings.ACCOUNT_STATS_BUCKETS)
+        for balance in balances:
+            counts[stats.bucket_of(balance)] += 1
+        self.assertEqual([bucket.accounts for bucket in current.buckets], counts)
+
+    def test_every_write_is_counted(self):
+        self.assertStatsMatchAccounts()
+        self.account1.deposit('50')
+        self.account1.withdraw('1040')
+        self.assertFalse(self.account2.withdraw('100'))
+        transfers.transfer(self.account1.id, self.account2.id, '5')
+        transfers.transfer_batch([(self.account2.id, self.account1.id, Decimal('0.5'))])
+        self.assertStatsMatchAccounts()
+
+        self.account2.balance = Decimal('20000')
+        self.account2.save()
+        self.account2.name = "Renamed"
+        self.account2.save(update_fields=['name'])
+        self.assertStatsMatchAccounts()
+        Account.objects.create(name="Closed", balance=Decimal('150')).delete()
+        self.assertStatsMatchAccounts()
+
+    def test_imports_are_counted(self):
+        csv_data = (f"ID,Name,Balance\n{self.account1.id},Account 1,20\n"
+                    f"{uuid.uuid4()},New,300000\n")
+        importer.import_csv(io.BytesIO(csv_data.encode()), mode=importer.REPLACE)
+        self.assertEqual(Account.objects.count(), 2)
+        self.assertStatsMatchAccounts()
+        Account.objects.all().delete()
+        self.assertStatsMatchAccounts()
+
+    def test_sharded_accounts_are_read_live(self):
+        sharding.set_shard_count(self.account1.id, 4)
+        for _ in range(5):
+            self.account1.deposit('2000')
+        self.assertStatsMatchAccounts()
+        self.assertEqual(stats.get_stats().highest, Decimal('11000.000'))
+        sharding.set_shard_count(self.account1.id, 0)
+        self.assertStatsMatchAccounts()
+
+    def test_reads_a_fixed_number_of_rows(self):
+        Account.objects.bulk_create(
+            [Account(name=f"Extra {i}", balance=i) for i in range(200)])
+        # bucket rows, sharded accounts, lowest and highest balance
+        with self.assertNumQueries(3):
+            stats.get_stats()
+
+    def test_rebuild_reports_and_repairs_drift(self):
+        self.assertEqual(stats.rebuild(), [])
+        # Writes that bypass accounts.stats
+        Account.objects.filter(id=self.account2.id).update(balance=Decimal('50'))
+        Account.objects.bulk_create([Account(name="Bulk", balance=Decimal('7'))])
+
+        out = io.StringIO()
+        call_command('rebuild_account_stats', stdout=out)
+        self.assertIn("2 buckets had drifted", out.getvalue())
+        self.assertIn("Drift in the bucket from 0 below 10: +0 accounts, +1.500 balance",
+                      out.getvalue())
+        self.assertStatsMatchAccounts()
+        self.assertEqual(stats.rebuild(), [])
+
+    @override_settings(ACCOUNT_STATS_BUCKETS=[0, 100])
+    def test_rebuild_follows_new_buckets(self):
+        stats.rebuild()
+        self.assertEqual([(bucket.lower, bucket.upper, bucket.accounts)
+                          for bucket in stats.get_stats().buckets],
+                         [(0, 100, 1), (100, None, 1)])
+        self.assertFalse(BalanceStats.objects.filter(bucket__gte=2).exists())
+
+
+class ImporterValidationTest(TestCase):
+
+    def test_exact_duplicates_are_not_errors(self):
+        account_id = uuid.uuid4()
+        csv_file = io.BytesIO(
+            f"{account_id},Account,10\n{account_id},Account,10.000\n".encode())
+        report = importer.validate_csv(csv_file)
+        self.assertEqual((report.rows, report.error_count), (2, 0))
+
+    def test_reported_errors_are_capped(self):
+        csv_file = io.BytesIO(b"".join(b"bad,Account,10\n" for _ in range(30)))
+        with patch('accounts.importer.MAX_REPORTED_ERRORS', 5):
+            report = importer.validate_csv(csv_file, batch_size=7)
+        self.assertEqual(report.error_count, 30)
+        self.assertEqual([error.line for error in report.errors], [1, 2, 3, 4, 5])
+
+    def assertUnreadable(self, data, line, message):
+        with self.assertRaises(importer.ImportValidationError) as raised:
+            importer.import_csv(io.BytesIO(data), batch_size=2)
+        report = raised.exception.report
+        self.assertEqual(report.error_count, 1)
+        self.assertEqual(report.errors[0].line, line)
+        self.assertIn(message, report.errors[0].errors[0])
+        self.assertFalse(Account.objects.filter(name="Account").exists())
+
+    def test_unreadable_files_are_reported(self):
+        rows = "".join(f"{uuid.uuid4()},Account,10\n" for _ in range(5)).encode()
+        self.assertUnreadable(gzip.compress(rows)[:-20], 5, "The gzip file is truncated.")
+        self.assertUnreadable(rows + b"\xff\xfe,Account,10\n", 1, "not valid utf-8 text")
+        self.assertUnreadable(rows + f"{uuid.uuid4()},{'x' * 200_000},10\n".encode(), 6,
+                              "Unreadable CSV: field larger than field limit")
+        self.assertUnreadable(GZIP_MAGIC + b"\x00 not gzip", 1, "Unreadable file:")
+        corrupt = bytearray(gzip.compress(rows))
+        corrupt[30:60] = bytes(byte ^ 0xff for byte in corrupt[30:60])
+        self.assertUnreadable(bytes(corrupt), 1, "The gzip file is corrupt.")
+
+
+class IdempotencyTest(TestCase):
+
+    def handler(self):
+        self.calls += 1
+        Account.objects.filter(pk=self.account.pk).update(balance=0)
+        return 200, '{"detail": "done"}'
+
+    def setUp(self):
+        self.calls = 0
+        self.account = Account.objects.create(name="Account", balance=Decimal('100'))
+
+    def test_concurrent_attempt_loses_and_rolls_back(self):
+        IdempotencyKey.objects.create(
+            key='key-1', fingerprint='abc', status_code=201, body='{"detail": "first"}')
+        # The racing attempt looked the key up before the winner committed
+        real_replay = idempotency._replay
+        with patch('accounts.idempotency._replay',
+                   side_effect=[None, real_replay('key-1', 'abc')]):
+            outcome = idempotency.run('key-1', 'abc', self.handler)
+
+        self.assertEqual((outcome.status_code, outcome.replayed), (201, True))
+        self.assertEqual(self.calls, 1)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal('100'))
+
+    def test_server_errors_are_not_stored(self):
+        outcome = idempotency.run('key-1', 'abc', lambda: (503, '{}'))
+        self.assertEqual(outcome.status_code, 503)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_prune(self):
+        now = timezone.now()
+        ttl = timedelta(seconds=settings.ACCOUNT_IDEMPOTENCY_KEY_TTL)
+        IdempotencyKey.objects.create(
+            key='old', fingerprint='a', status_code=200, body='{}',
+            created_at=now - ttl - timedelta(seconds=1))
+        IdempotencyKey.objects.create(
+            key='new', fingerprint='a', status_code=200, body='{}', created_at=now)
+
+        out = io.StringIO()
+        call_command('prune_idempotency_keys', stdout=out)
+        self.assertIn("Pruned 1 idempotency keys", out.getvalue())
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['new'])
+
+class ReconcileCommandTest(TestCase):
+
+    def setUp(self):
+        self.account1 = Account.objects.create(
+            name="Account 1", balance=Decimal('1000.000'))
+        self.account2 = Account.objects.create(
+            name="Account 2", balance=Decimal('500.000'))
+        self.account3 = Account.objects.create(
+            name="Account 3", balance=Decimal('100.000'))
+
+    def reconcile(self, *args):
+        out = io.StringIO()
+        call_command('reconcile', *args, stdout=out)
+        return out.getvalue()
+
+    def test_first_run_snapshots_every_account(self):
+        output = self.reconcile()
+        self.assertIn("Checked 3 accounts", output)
+        self.assertIn("0 drifted", output)
+        self.assertEqual(BalanceSnapshot.objects.count(), 3)
+
+    def test_only_touched_accounts_are_checked(self):
+        self.reconcile()
+        transfers.transfer(self.account1.id, self.account2.id, 100)
+        output = self.reconcile()
+        self.assertIn("Checked 2 accounts", output)
+        self.assertIn("0 drifted", output)
+        self.assertEqual(BalanceSnapshot.objects.get(account=self.account2).balance,
+                         Decimal('600.000'))
+
+    def test_drift_is_reported(self):
+        self.reconcile()
+        transfers.transfer(self.account1.id, self.account2.id, 100)
+        self.account2.deposit(Decimal('5'))  # not journaled
+        # Bypasses the model, so only a full run sees it
+        Account.objects.filter(id=self.account3.id).update(balance=Decimal('107'))
+
+        output = self.reconcile()
+        self.assertIn("Checked 2 accounts", output)
+        self.assertIn(f"Drift on {self.account2.id}: expected 600.000, balance 605.000", output)
+        self.assertIn("1 drifted", output)
+
+        output = self.reconcile('--full')
+        self.assertIn("Checked 3 accounts", output)
+        self.assertIn(f"Drift on {self.account3.id}", output)
+        self.assertIn("1 drifted", output)
+
+    def test_writes_outside_the_journal_are_checked(self):
+        self.reconcile()
+        self.account3.deposit(Decimal('7'))
+        output = self.reconcile()
+        self.assertIn("Checked 1 accounts", output)
+        self.assertIn(f"Drift on {self.account3.id}: expected 100.000, balance 107.000", output)
+
+        sharding.set_shard_count(self.account1.id, 2)
+        self.reconcile()
+        # Lands on a shard and leaves the account row alone
+        self.account1.deposit(Decimal('3'))
+        output = self.reconcile()
+        self.assertIn("Checked 1 accounts", output)
+        self.assertIn(f"Drift on {self.account1.id}: expected 1000.000, balance 1003.000", output)
+        self.assertIn("Checked 0 accounts", self.reconcile())
+
+    def test_imported_balances_are_not_drift(self):
+        self.reconcile()
+        transfers.transfer(self.account1.id, self.account2.id, 1)
+        csv_data = (f"{self.account1.id},Account 1,9\n{self.account2.id},Account 2,500\n"
+                    f"{self.account3.id},Renamed,100\n")
+        importer.import_csv(io.BytesIO(csv_data.encode()), mode=importer.UPSERT)
+        transfers.transfer(self.account2.id, self.account1.id, 2)
+
+        output = self.reconcile('--full')
+        self.assertIn("0 drifted", output)
+        self.assertEqual(BalanceSnapshot.objects.get(account=self.account1).balance,
+                         Decimal('11.000'))
+
+    def test_chunks_hold_only_touched_accounts(self):
+        self.reconcile()
+        sharding.set_shard_count(self.account3.id, 2)
+        self.reconcile()
+        transfers.transfer(self.account1.id, self.account3.id, 1)
+        new = Account.objects.create(name="Account 4", balance=Decimal('1.000'))
+
+        run = reconciliation.start_run()
+        chunks = list(reconciliation.iter_chunks(run, chunk_size=2))
+        self.assertEqual(chunks[0], sorted([self.account1.id, self.account3.id, new.id])[:2])
+        self.assertEqual(sum(chunks, []), sorted([self.account1.id, self.account3.id, new.id]))
+
+    def test_interrupted_run_resumes(self):
+        calls = []
+
+        def fail_second_chunk(account_ids):
+            calls.append(account_ids)
+            if len(calls) == 2:
+                raise KeyboardInterrupt
+            return reconcile_chunk(account_ids)
+
+        reconcile_chunk = reconciliation.reconcile_chunk
+        with patch('accounts.reconciliation.reconcile_chunk', fail_second_chunk):
+            with self.assertRaises(KeyboardInterrupt):
+                self.reconcile('--chunk-size', '1')
+
+        output = self.reconcile('--chunk-size', '1')
+        self.assertIn("Resuming run", output)
+        self.assertIn("Checked 2 accounts", output)
+        run = ReconciliationRun.objects.get()
+        self.assertEqual(run.status, ReconciliationRun.DONE)
+        self.assertEqual(run.accounts_checked, 3)
+
+
+class GroupCommitTest(TransactionTestCase):
+    """The writer thread has its own connection, so the rows must be committed."""
+
+    def setUp(self):
+        self.account1 = Account.objects.create(name="Account 1", balance=Decimal('100.000'))
+        self.account2 = Account.objects.create(name="Account 2", balance=Decimal('0.000'))
+        # A long wait, so the transfers below reliably share one group
+        self.writer = group_commit.GroupCommitWriter(max_items=4, max_wait=0.5)
+        self.addCleanup(self.writer.shutdown)
+
+    def submit(self, *transfers_):
+        return [self.writer.submit(from_id, to_id, Decimal(amount))
+                for from_id, to_id, amount in transfers_]
+
+    def test_transfers_share_a_transaction(self):
+        futures = self.submit(
+            (self.account1.id, self.account2.id, '60'),
+            (self.account1.id, self.account2.id, '60'),
+            (self.account2.id, self.account1.id, '10'),
+            (self.account1.id, uuid.UUID(int=0), '1'),
+        )
+        self.assertEqual([future.result() for future in futures], [
+            transfers.OK, transfers.INSUFFICIENT_FUNDS, transfers.OK, transfers.NOT_FOUND])
+        self.assertEqual((self.writer.groups, self.writer.items), (1, 4))
+        self.account1.refresh_from_db()
+        self.account2.refresh_from_db()
+        self.assertEqual((self.account1.balance, self.account2.balance),
+                         (Decimal('50.000'), Decimal('50.000')))
+        self.assertEqual(Transfer.objects.count(), 2)
+
+    def test_an_overflowing_transfer_fails_alone(self):
+        Account.objects.filter(id=self.account2.id).update(balance=Decimal('9999950'))
+        futures = self.submit((self.account1.id, self.account2.id, '60'),
+                              (self.account1.id, self.account2.id, '40'))
+        self.assertEqual([future.result() for future in futures],
+                         [transfers.BALANCE_OVERFLOW, transfers.OK])
+        self.assertEqual((self.writer.groups, self.writer.items), (1, 2))
+        self.account2.refresh_from_db()
+        self.assertEqual(self.account2.balance, Decimal('9999990.000'))
+
+        self.writer.max_wait = 0
+        with patch('accounts.group_commit.get_writer', return_value=self.writer):
+            with self.assertRaisesMessage(
+                    transfers.BalanceOverflow, "The recipient's balance cannot exceed 9999999.999."):
+                group_commit.transfer(self.account1.id, self.account2.id, '10')
+
+    def test_a_failed_group_fails_every_transfer(self):
+        with patch('accounts.transfers.transfer_batch', side_effect=OperationalError('locked')):
+            futures = self.submit((self.account1.id, self.account2.id, '1'),
+                                  (self.account2.id, self.account1.id, '1'))
+            for future in futures:
+                with self.assertRaises(OperationalError):
+                    future.result()
+        self.assertEqual(self.writer.groups, 0)
+
+    def test_transfer(self):
+        self.writer.max_wait = 0
+        with patch('accounts.group_commit.get_writer', return_value=self.writer):
+            group_commit.transfer(self.account1.id, self.account2.id, '30')
+            with self.assertRaises(transfers.InsufficientFunds):
+                group_commit.transfer(self.account1.id, self.account2.id, '71')
+            with self.assertRaises(transfers.SameAccount):
+                group_commit.transfer(self.account1.id, self.account1.id, '1')
+            # inside a transaction the transfer has to be part of it
+            with transaction.atomic():
+                group_commit.transfer(self.account2.id, self.account1.id, '5')
+        self.assertEqual(self.writer.items, 2)
+        self.account1.refresh_from_db()
+        self.assertEqual(self.account1.balance, Decimal('75.000'))
+
+    @override_settings(ACCOUNT_GROUP_COMMIT_TIMEOUT=0.05)
+    def test_a_transfer_not_taken_in_time_is_withdrawn(self):
+        # The writer holds the transfer for max_wait, waiting for others
+        with patch('accounts.group_commit.get_writer', return_value=self.writer):
+            with self.assertRaises(group_commit.GroupCommitUnavailable):
+                group_commit.transfer(self.account1.id, self.account2.id, '30')
+        self.writer.shutdown()
+        self.assertEqual(self.writer.items, 0)
+        self.assertFalse(Transfer.objects.exists())
+        self.account1.refresh_from_db()
+        self.assertEqual(self.account1.balance, Decimal('100.000'))
+
+    def test_a_stopped_writer_fails_its_transfers_and_is_replaced(self):
+        with patch.object(self.writer, '_commit', side_effect=SystemExit):
+            future = self.writer.submit(self.account1.id, self.account2.id, Decimal('1'))
+            with self.assertRaises(group_commit.GroupCommitUnavailable):
+                future.result(timeout=5)
+        self.writer._thread.join()
+        with self.assertRaises(group_commit.GroupCommitUnavailable):
+            self.writer.submit(self.account1.id, self.account2.id, Decimal('1'))
+
+        with patch('accounts.group_commit._writer', self.writer):
+            writer = group_commit.get_writer()
+            self.addCleanup(writer.shutdown)
+        self.assertIsNot(writer, self.writer)
+        self.assertEqual(writer.submit(self.account1.id, self.account2.id, Decimal('1'))
+                         .result(timeout=5), transfers.OK)
+
+
+class StartupProfileCommandTest(TestCase):
+
+    def test_compares_the_profiles(self):
+        out = io.StringIO()
+        # /metrics needs no database, which the worker processes could not see
+        call_command('startup_profile', '--repeat', '1', '--top', '3', '--path', '/metrics',
+                     stdout=out)
+        output = out.getvalue()
+        self.assertRegex(output, r'\nfull .* 200\n')
+        self.assertRegex(output, r'\napi .* 200\n')
+        self.assertIn("Slowest imports (api)", output)
+        self.assertIn("fewer modules", output)
+
+    def test_parse_importtime(self):
+        output = ("import time: self [us] | cumulative | imported package\n"
+                  "import time:       120 |        120 |   csv\n"
+                  "import time:      1500 |       1620 | accounts.importer\n")
+        self.assertEqual(startup.parse_importtime(output), [
+            ('csv', 0.00012, 0.00012), ('accounts.importer', 0.0015, 0.00162)])
+
+
+class ConcurrentTransferTest(TransactionTestCase):
+
+    THREADS = 8
+    TRANSFERS_PER_THREAD = 25
+
+    def test_total_balance_is_conserved(self):
+        """Random transfers from many threads neither create nor lose money."""
+        accounts = [Account.objects.create(name=f"Account {i}", balance=Decimal('100.000'))
+                    for i in range(5)]
+        ids = [account.id for account in accounts]
+        total = sum(account.balance for account in accounts)
+
+        def worker(seed):
+            rng = random.Random(seed)
+            try:
+                for _ in range(self.TRANSFERS_PER_THREAD):
+                    from_id, to_id = rng.sample(ids, 2)
+                    amount = Decimal(rng.randint(1, 5000)) / 100
+                    while True:
+                        try:
+                            transfers.transfer(from_id, to_id, amount)
+                        except transfers.InsufficientFunds:
+                            pass
+                        except OperationalError:
+                            # SQLite reports lock contention instead of waiting
+                            time.sleep(0.001)
+                            continue
+                        break
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(seed,))
+                   for seed in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        balances = list(Account.objects.values_list('balance', flat=True))
+        self.assertEqual(sum(balances), total)
+        self.assertTrue(all(balance >= 0 for balance in balances))
@@ -0,0 +1,230 @@
+"""Money transfers between accounts.
+
+A transfer is two conditional ``UPDATE`` statements in one transaction:
+the debit only matches while ``balance >= amount`` and the credit while
+the balance stays within ``MAX_BALANCE``. Neither needs the rows to be
+read first, and no concurrent transfer can be lost between a read and a
+write. The two rows are always updated in UUID order, so two transfers
+running in opposite directions lock them in the same order and cannot
+deadlock. Each successful transfer is journaled in :mod:`accounts.ledger`
+and counted in :mod:`accounts.stats` in the same transaction. Credits to
+sharded accounts go through :mod:`accounts.sharding`.
+"""
+import uuid
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import Q
+
+from . import ledger, sharding, stats
+from .models import MAX_BALANCE, Account, quantize_balance, stamp_accounts, total_balance
+
+AMOUNT_QUANTUM = Decimal('0.001')
+# Amounts must fit a balance, as in the batch TransferSerializer
+AMOUNT_DECIMAL_PLACES = Account._meta.get_field('balance').decimal_places
+AMOUNT_WHOLE_DIGITS = Account._meta.get_field('balance').max_digits - AMOUNT_DECIMAL_PLACES
+
+
+class TransferError(Exception):
+    """Base class for transfers that were rejected and rolled back."""
+
+
+class SameAccount(TransferError):
+    pass
+
+
+class InvalidAmount(TransferError):
+    pass
+
+
+class AccountNotFound(TransferError):
+    pass
+
+
+class InsufficientFunds(TransferError):
+    pass
+
+
+class BalanceOverflow(TransferError):
+    pass
+
+
+def parse_amount(amount):
+    """Convert ``amount`` to a positive Decimal with the balance precision.
+
+    Amounts a balance cannot hold are refused, not rounded.
+    """
+    try:
+        amount = Decimal(str(amount).strip())
+    except (InvalidOperation, TypeError, ValueError):
+        raise InvalidAmount("Amount should be a number.")
+    if not amount.is_finite():
+        raise InvalidAmount("Amount should be a number.")
+    if amount <= 0:
+        raise InvalidAmount("Amount should be greater than zero.")
+    if amount.adjusted() >= AMOUNT_WHOLE_DIGITS:
+        raise InvalidAmount(
+            f"Ensure that there are no more than {AMOUNT_WHOLE_DIGITS} digits before the decimal point.")
+    if amount != amount.quantize(AMOUNT_QUANTUM):
+        raise InvalidAmount(
+            f"Ensure that there are no more than {AMOUNT_DECIMAL_PLACES} decimal places.")
+    return amount.quantize(AMOUNT_QUANTUM)
+
+
+def _parse_id(account_id):
+    try:
+        return account_id if isinstance(account_id, uuid.UUID) else uuid.UUID(str(account_id))
+    except ValueError:
+        raise AccountNotFound("Account not found.")
+
+
+def parse_transfer(from_account_id, to_account_id, amount):
+    """Validate a transfer request; return ``(from_id, to_id, amount)``."""
+    from_account_id = _parse_id(from_account_id)
+    to_account_id = _parse_id(to_account_id)
+    if from_account_id == to_account_id:
+        raise SameAccount(
+            "You are trying to transfer money to the same account.")
+    return from_account_id, to_account_id, parse_amount(amount)
+
+
+def transfer(from_account_id, to_account_id, amount):
+    """Move ``amount`` from one account to another, all or nothing."""
+    from_account_id, to_account_id, amount = parse_transfer(
+        from_account_id, to_account_id, amount)
+
+    with transaction.atomic():
+        # The new balances of unsharded accounts, for accounts.stats
+        balances = {}
+        for account_id in sorted((from_account_id, to_account_id)):
+            if account_id == from_account_id:
+                _debit(account_id, amount, balances)
+            else:
+                _credit(account_id, amount, balances)
+        ledger.record(from_account_id, to_account_id, amount)
+        stats.record_accounts(balances, {from_account_id: -amount, to_account_id: amount})
+    return amount
+
+
+def _debit(account_id, amount, balances):
+    debited = sharding.debit(account_id, amount, balances)
+    if debited is None:
+        raise AccountNotFound("Account not found.")
+    if not debited:
+        raise InsufficientFunds("Insufficient funds.")
+
+
+def _credit(account_id, amount, balances):
+    credited = sharding.credit(account_id, amount, balances)
+    if credited is None:
+        raise AccountNotFound("Account not found.")
+    if not credited:
+        raise BalanceOverflow(
+            f"The recipient's balance cannot exceed {MAX_BALANCE}.")
+
+
+# Per-item outcomes of transfer_batch
+OK = 'ok'
+INSUFFICIENT_FUNDS = 'insufficient_funds'
+NOT_FOUND = 'not_found'
+SAME_ACCOUNT = 'same_account'
+BALANCE_OVERFLOW = 'balance_overflow'
+
+LOCK_CHUNK_SIZE = 1000
+
+
+def transfer_batch(items):
+    """Apply ``(from_account_id, to_account_id, amount)`` transfers in order.
+
+    All involved accounts are locked and loaded up front. The transfers are
+    applied in memory, and only the net balance changes are written back
+    with ``bulk_update``. Each item succeeds or fails on its own: a failed
+    item leaves the balances untouched, and later items see the balances
+    left by earlier ones. Returns one outcome per item.
+
+    Sharded accounts that are debited are folded first, so their whole
+    balance is available. Those that are only credited are neither locked
+    nor folded: their net credit goes to a random shard, as in
+    :func:`transfer`, and their account row is left alone.
+    """
+    account_ids = set()
+    debited_ids = set()
+    for from_account_id, to_account_id, _ in items:
+        account_ids.update((from_account_id, to_account_id))
+        debited_ids.add(from_account_id)
+
+    with transaction.atomic():
+        accounts = _lock_accounts(sorted(account_ids), debited_ids)
+        sharding.fold_locked([account for account in accounts.values() if account.shard_count])
+        credited_shards = _load_credited_shards(account_ids - set(accounts))
+        accounts.update(credited_shards)
+        original = {account_id: account.balance
+                    for account_id, account in accounts.items()}
+
+        results = []
+        applied = []
+        for from_account_id, to_account_id, amount in items:
+            from_account = accounts.get(from_account_id)
+            to_account = accounts.get(to_account_id)
+            if from_account is None or to_account is None:
+                results.append(NOT_FOUND)
+            elif from_account_id == to_account_id:
+                results.append(SAME_ACCOUNT)
+            elif from_account.balance < amount:
+                results.append(INSUFFICIENT_FUNDS)
+            elif to_account.balance > MAX_BALANCE - amount:
+                results.append(BALANCE_OVERFLOW)
+            else:
+                from_account.balance -= amount
+                to_account.balance += amount
+                applied.append((from_account_id, to_account_id, amount))
+                results.append(OK)
+
+        for account_id, account in credited_shards.items():
+            credit = account.balance - original[account_id]
+            # Checked above; only a concurrent credit to another shard can have
+            # used up the room since, and then the batch fails as a whole
+            if credit and not sharding.credit_shard(account_id, account.shard_count, credit):
+                raise BalanceOverflow(
+                    f"The recipient's balance cannot exceed {MAX_BALANCE}.")
+        changed = [account for account_id, account in accounts.items()
+                   if account.balance != original[account_id] and account_id not in credited_shards]
+        stamp_accounts(changed)
+        Account.objects.bulk_update(
+            changed, ['balance', 'version', 'updated_at'], batch_size=LOCK_CHUNK_SIZE)
+        ledger.record_many(applied)
+        stats.record((original[account.id], account.balance)
+                     for account in changed if not account.shard_count)
+    return results
+
+
+def _lock_accounts(account_ids, debited_ids):
+    """Lock and load the accounts, except sharded ones that are only credited."""
+    accounts = {}
+    for start in range(0, len(account_ids), LOCK_CHUNK_SIZE):
+        chunk = account_ids[start:start + LOCK_CHUNK_SIZE]
+        debited = [account_id for account_id in chunk if account_id in debited_ids]
+        # In id order, like transfer(), so that the two cannot deadlock
+        for account in (Account.objects.select_for_update()
+                        .filter(Q(id__in=debited) | Q(shard_count=0), id__in=chunk)
+                        .order_by('id').only('id', 'balance', 'shard_count')):
+            accounts[account.id] = account
+    return accounts
+
+
+def _load_credited_shards(account_ids):
+    """Load the sharded accounts among ``account_ids`` with their whole balance.
+
+    :func:`_lock_accounts` leaves out only those and missing accounts, so
+    this costs a query only for batches that credit a sharded account.
+    """
+    accounts = {}
+    account_ids = sorted(account_ids)
+    for start in range(0, len(account_ids), LOCK_CHUNK_SIZE):
+        chunk = account_ids[start:start + LOCK_CHUNK_SIZE]
+        for account in (Account.objects.filter(id__in=chunk, shard_count__gt=0)
+                        .annotate(whole_balance=total_balance())
+                        .only('id', 'shard_count')):
+            account.balance = quantize_balance(account.whole_balance)
+            accounts[account.id] = account
+    return accounts
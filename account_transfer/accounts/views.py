@@ -1,33 +1,22 @@
 # Create your views here.
-import csv
-import uuid
 from django.shortcuts import render, redirect
-from .models import Account
-from django.http import HttpResponse
-from django.db.models import Q
+from . import caching, importer, pagination, search, transfers
+from .models import Account, account_state, table_state, total_balance
+from django.http import Http404, HttpResponse
 
 
 def import_accounts(request):
     if request.method == 'POST' and request.FILES['file']:
         csv_file = request.FILES['file']
-        decoded_file = csv_file.read().decode('utf-8').splitlines()
-        reader = csv.reader(decoded_file)
-
-        for row in reader:
-            if row[0] == 'ID':  # skip the header row
-                continue
-            # CSV row is in format: [UUID, name, balance]
-            account_id = row[0]  # UUID
-            account_name = row[1]  # Account name
-            account_balance = row[2]  # Account balance
-
-            # Check if the UUID already exists, and skip if it does
-            if not Account.objects.filter(id=account_id).exists():
-                Account.objects.create(
-                    id=account_id,
-                    name=account_name,
-                    balance=account_balance
-                )
+        # Existing UUIDs are skipped, updated or replaced depending on the mode
+        mode = request.POST.get('mode', importer.INSERT)
+        if mode not in importer.MODES:
+            return HttpResponse(f"Unknown import mode {mode!r}.", status=400)
+        try:
+            importer.import_csv(csv_file, mode=mode)
+        except importer.ImportValidationError as exc:
+            return render(request, 'accounts/import.html',
+                          {'report': exc.report}, status=400)
 
         return redirect('account_list')
 
@@ -37,17 +26,35 @@ def import_accounts(request):
 def account_list(request):
     # Get the search query from the navbar
     search_query = request.GET.get('search', '')
-    if search_query:
-        accounts = Account.objects.filter(
-            Q(name__icontains=search_query))  # Search by user name
-    else:
-        accounts = Account.objects.all()
+    cursor = request.GET.get('cursor')
+
+    def load_page():
+        if search_query:
+            accounts = search.search_accounts(search_query)  # Search by user name
+        else:
+            accounts = Account.objects.all()
+        return pagination.paginate(accounts.annotate(total_balance=total_balance()), cursor)
 
-    return render(request, 'accounts/account_list.html', {'accounts': accounts, 'search_query': search_query})
+    try:
+        page = caching.read_through(
+            caching.list_key('html', [search_query, cursor], table_state()), load_page)
+    except pagination.InvalidCursor as exc:
+        return HttpResponse(str(exc), status=400)
+
+    return render(request, 'accounts/account_list.html', {
+        'accounts': page.items,
+        'next_cursor': page.next_cursor,
+        'search_query': search_query,
+    })
 
 
 def account_detail(request, account_id):
-    account = Account.objects.get(id=account_id)
+    state = account_state(account_id)
+    if state is None:
+        raise Http404("Account not found.")
+    account = caching.read_through(
+        caching.detail_key('html', account_id, state[:2]),
+        lambda: Account.objects.annotate(total_balance=total_balance()).get(id=account_id))
     return render(request, 'accounts/account_detail.html', {'account': account})
 
 
@@ -55,17 +62,14 @@ def transfer_funds(request):
     if request.method == 'POST':
         from_account_id = request.POST['from_account']
         to_account_id = request.POST['to_account']
-        amount = float(request.POST['amount'])
-        if from_account_id == to_account_id:
-            return HttpResponse("You are trying to transfer money to the same account", status=400)
-
-        from_account = Account.objects.get(id=from_account_id)
-        to_account = Account.objects.get(id=to_account_id)
+        amount = request.POST['amount']
 
-        if from_account.withdraw(amount):
-            to_account.deposit(amount)
-            return redirect('account_list')
-        else:
-            return HttpResponse("Insufficient funds", status=400)
+        try:
+            transfers.transfer(from_account_id, to_account_id, amount)
+        except transfers.AccountNotFound as exc:
+            return HttpResponse(str(exc), status=404)
+        except transfers.TransferError as exc:
+            return HttpResponse(str(exc), status=400)
+        return redirect('account_list')
     accounts = Account.objects.all()
     return render(request, 'accounts/transfer.html', {'accounts': accounts})
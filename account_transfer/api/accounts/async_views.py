@@ -0,0 +1,78 @@
+"""Async counterparts of the account API views, for ASGI deployments.
+
+They return the same payloads as the views in ``views.py``. DRF's
+``APIView`` is synchronous, so these are plain Django async views built
+on the async ORM (``aget``, ``async for``). A slow client then holds a
+coroutine instead of a worker thread.
+
+They read the database directly, not through :mod:`accounts.caching`.
+The transfer endpoint runs the sync ``TransferFundsView`` in
+``sync_to_async``, because ``transaction.atomic`` is synchronous. It
+therefore gets the same throttles, concurrency limit and
+``Idempotency-Key`` handling.
+"""
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+
+from accounts import pagination, search
+from accounts.models import Account, total_balance
+from .serializers import AccountSerializer, account_dicts, account_rows, encode_accounts
+from .views import TransferFundsView
+
+_renderer = JSONRenderer()
+_transfer_view = TransferFundsView.as_view()
+
+
+def _json_response(data, status=status.HTTP_200_OK):
+    return HttpResponse(
+        _renderer.render(data), status=status, content_type='application/json')
+
+
+@require_GET
+async def account_list(request):
+    search_query = request.GET.get('search', '')
+    if search_query:
+        accounts = search.search_accounts(search_query)
+    else:
+        accounts = Account.objects.all()
+
+    fields = AccountSerializer.Meta.fields
+    if request.GET.get('fields'):
+        fields = request.GET['fields'].split(',')
+        unknown = set(fields) - set(AccountSerializer.Meta.fields)
+        if unknown:
+            return _json_response({"detail": f"Unknown fields: {', '.join(sorted(unknown))}."}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        page_size = pagination.get_page_size(request.GET.get('page_size'))
+        page = await pagination.apaginate(
+            account_rows(accounts), request.GET.get('cursor'), page_size)
+    except ValueError as exc:
+        return _json_response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+    response = _json_response(account_dicts(encode_accounts(page.items), fields))
+    if page.next_cursor:
+        query = request.GET.copy()
+        query['cursor'] = page.next_cursor
+        next_url = request.build_absolute_uri(f"{request.path}?{query.urlencode()}")
+        response['Link'] = f'<{next_url}>; rel="next"'
+        response['X-Next-Cursor'] = page.next_cursor
+    return response
+
+
+@require_GET
+async def account_detail(request, account_id):
+    try:
+        account = await Account.objects.annotate(total_balance=total_balance()).aget(id=account_id)
+    except Account.DoesNotExist:
+        return _json_response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+    return _json_response(AccountSerializer(account).data)
+
+
+@csrf_exempt
+async def transfer_funds(request):
+    return await sync_to_async(_transfer_view)(request)
@@ -0,0 +1,38 @@
+import csv
+import io
+import json
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+class CSVRenderer(BaseRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in data if isinstance(data, list) else [data]:
+            writer.writerow(row.values() if isinstance(row, dict) else row)
+        return buffer.getvalue().encode(self.charset)
+
+
+class NDJSONRenderer(BaseRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        rows = data if isinstance(data, list) else [data]
+        return ''.join(json.dumps(row) + '\n' for row in rows).encode(self.charset)
+
+
+class ColumnarJSONRenderer(JSONRenderer):
+    """JSON with one list per field instead of one object per row.
+
+    The view builds the columns; this renderer only gives the layout its
+    own media type and ``?format=columns``.
+    """
+    media_type = 'application/vnd.accounts.columns+json'
+    format = 'columns'
@@ -1,8 +1,115 @@
+from decimal import Context, Decimal
+
 from rest_framework import serializers
-from accounts.models import Account
+from accounts.models import Account, ImportJob, Transfer, total_balance
 
 
 class AccountSerializer(serializers.ModelSerializer):
+    # A sharded account's balance includes its shards
+    balance = serializers.DecimalField(
+        max_digits=10, decimal_places=3, source='total_balance', read_only=True)
+
     class Meta:
         model = Account
         fields = ['id', 'name', 'balance']
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Serialize only the requested subset of fields
+        if fields is not None:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
+
+
+_balance_field = Account._meta.get_field('balance')
+_BALANCE_QUANTUM = Decimal(1).scaleb(-_balance_field.decimal_places)
+_BALANCE_CONTEXT = Context(prec=_balance_field.max_digits)
+
+
+def account_rows(queryset):
+    """Load ``queryset`` as ``(id, name, balance)`` rows for :func:`encode_accounts`.
+
+    The rows are named tuples, so the pagination cursor can be built from
+    them like from model instances. The balance is ``total_balance``.
+    """
+    return queryset.annotate(total_balance=total_balance()).values_list(
+        'id', 'name', 'total_balance', named=True)
+
+
+def encode_accounts(rows):
+    """Format ``(id, name, balance)`` rows the way :class:`AccountSerializer` does.
+
+    Returns plain tuples of strings, without building a serializer field
+    per value. Balances are quantized and formatted like DRF's
+    ``DecimalField``, so the JSON is byte-identical.
+    """
+    return [(str(account_id), name,
+             format(balance.quantize(_BALANCE_QUANTUM, context=_BALANCE_CONTEXT), 'f'))
+            for account_id, name, balance in rows]
+
+
+def _field_indexes(fields):
+    # A field subset keeps the serializer's field order, whatever the request order
+    return [(index, name) for index, name in enumerate(AccountSerializer.Meta.fields)
+            if fields is None or name in fields]
+
+
+def account_dicts(rows, fields=None):
+    """Turn encoded rows into the dicts :class:`AccountSerializer` would return."""
+    indexes = _field_indexes(fields)
+    if len(indexes) == len(AccountSerializer.Meta.fields):
+        return [{'id': account_id, 'name': name, 'balance': balance}
+                for account_id, name, balance in rows]
+    return [{name: row[index] for index, name in indexes} for row in rows]
+
+
+def account_columns(rows, fields=None):
+    """Turn encoded rows into one list per field, e.g. ``{"id": [...], ...}``."""
+    return {name: [row[index] for row in rows] for index, name in _field_indexes(fields)}
+
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    rate = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ImportJob
+        fields = ['id', 'status', 'mode', 'rows_processed', 'imported', 'skipped',
+                  'updated', 'unchanged', 'deleted', 'kept',
+                  'rate', 'error', 'created_at', 'started_at', 'finished_at', 'heartbeat_at']
+
+    def get_rate(self, job):
+        return round(job.rate, 1)
+
+
+class TransferSerializer(serializers.Serializer):
+    from_account = serializers.UUIDField()
+    to_account = serializers.UUIDField()
+    amount = serializers.DecimalField(
+        max_digits=10, decimal_places=3, min_value=Decimal('0.001'))
+
+
+class LedgerEntrySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Transfer
+        fields = ['id', 'from_account', 'to_account', 'amount', 'created_at']
+
+
+class BalanceBucketSerializer(serializers.Serializer):
+    # Balances of at least ``lower`` and below ``upper``; the last bucket has no ``upper``
+    lower = serializers.DecimalField(max_digits=20, decimal_places=3)
+    upper = serializers.DecimalField(max_digits=20, decimal_places=3, allow_null=True)
+    accounts = serializers.IntegerField()
+    total_balance = serializers.DecimalField(max_digits=20, decimal_places=3, source='total')
+
+
+class AccountStatsSerializer(serializers.Serializer):
+    """Serializes :class:`accounts.stats.Stats`."""
+    accounts = serializers.IntegerField()
+    total_balance = serializers.DecimalField(max_digits=20, decimal_places=3, source='total')
+    average_balance = serializers.DecimalField(
+        max_digits=10, decimal_places=3, source='average', allow_null=True)
+    min_balance = serializers.DecimalField(
+        max_digits=10, decimal_places=3, source='lowest', allow_null=True)
+    max_balance = serializers.DecimalField(
+        max_digits=10, decimal_places=3, source='highest', allow_null=True)
+    histogram = BalanceBucketSerializer(many=True, source='buckets')
@@ -1,15 +1,36 @@
 from django.core.files.uploadedfile import InMemoryUploadedFile
-from io import StringIO
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+import gzip
+import json
+import os
+import tempfile
+import time
 import uuid
-from rest_framework.test import APITestCase
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from rest_framework.test import APITestCase, APITransactionTestCase
 from rest_framework import status
-from accounts.models import Account
+from rest_framework.renderers import JSONRenderer
+from account_transfer import metrics
+from accounts import caching, group_commit, importer, jobs, sharding, transfers
+from accounts.models import Account, ImportJob, Transfer, account_state
+from . import throttling
+from .serializers import AccountSerializer
+from .throttling import TokenBucketThrottle
 from django.urls import reverse
+from django.utils import timezone
+from unittest.mock import patch
 
 
 class AccountListViewTests(APITestCase):
 
     def setUp(self):
+        # Each test starts from the same versions, which key the cache
+        caching.get_cache().clear()
         # Create some accounts to test with, using UUIDs for ids
         self.account1 = Account.objects.create(
             id=uuid.uuid4(), name="Account 1", balance=1000)
@@ -30,6 +51,61 @@ class AccountListViewTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data), 1)  # Should return only Account 1
 
+    def test_get_accounts_cursor_pagination(self):
+        url = reverse('account_list_api')
+        response = self.client.get(url, {'page_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([a['name'] for a in response.data], ["Account 1", "Account 2"])
+        self.assertIn('rel="next"', response['Link'])
+
+        response = self.client.get(
+            url, {'page_size': 2, 'cursor': response['X-Next-Cursor']})
+        self.assertEqual([a['name'] for a in response.data], ["Account 3"])
+        self.assertNotIn('Link', response)
+
+    def test_get_accounts_invalid_cursor(self):
+        url = reverse('account_list_api')
+        response = self.client.get(url, {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_accounts_selected_fields(self):
+        url = reverse('account_list_api')
+        response = self.client.get(url, {'fields': 'id,balance'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data[0]), {'id', 'balance'})
+
+        response = self.client.get(url, {'fields': 'id,password'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_json_matches_model_serializer(self):
+        Account.objects.create(id=uuid.uuid4(), name='Zoë "quoted" \\ name', balance=Decimal('-0.5'))
+        Account.objects.create(id=uuid.uuid4(), name="Zero", balance=0)
+        Account.objects.create(id=uuid.uuid4(), name="Max", balance=Decimal('9999999.999'))
+        url = reverse('account_list_api')
+        for fields in (None, 'balance,name', 'id'):
+            params = {'fields': fields} if fields else {}
+            response = self.client.get(url, params)
+            selected = fields.split(',') if fields else None
+            expected = AccountSerializer(
+                Account.objects.order_by('name', 'id'), many=True, fields=selected).data
+            self.assertEqual(response.content, JSONRenderer().render(expected))
+
+    def test_get_accounts_columnar(self):
+        url = reverse('account_list_api')
+        response = self.client.get(url, {'format': 'columns', 'page_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/vnd.accounts.columns+json')
+        self.assertEqual(response.json(), {
+            'id': [str(self.account1.id), str(self.account2.id)],
+            'name': ["Account 1", "Account 2"],
+            'balance': ["1000.000", "1500.000"],
+        })
+        self.assertIn('format=columns', response['Link'])
+
+        response = self.client.get(url, {'fields': 'name'},
+                                   HTTP_ACCEPT='application/vnd.accounts.columns+json')
+        self.assertEqual(response.json(), {'name': ["Account 1", "Account 2", "Account 3"]})
+
 
 class AccountDetailViewTests(APITestCase):
 
@@ -56,6 +132,213 @@ class AccountDetailViewTests(APITestCase):
         self.assertEqual(response.data['detail'], 'Not found.')
 
 
+class ConditionalRequestTests(APITestCase):
+
+    def setUp(self):
+        caching.get_cache().clear()
+        self.account1 = Account.objects.create(
+            id=uuid.uuid4(), name="Account 1", balance=1000)
+        self.account2 = Account.objects.create(
+            id=uuid.uuid4(), name="Account 2", balance=500)
+        self.detail_url = reverse('account_detail_api', kwargs={'account_id': self.account1.id})
+        self.list_url = reverse('account_list_api')
+
+    def assertNotModified(self, url, params=None):
+        etag = self.client.get(url, params)['ETag']
+        response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+        return etag
+
+    def test_unchanged_detail_is_not_modified(self):
+        etag = self.assertNotModified(self.detail_url)
+        response = self.client.get(self.detail_url)
+        self.assertIn('Last-Modified', response)
+        response = self.client.get(
+            self.detail_url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # the version lookup, without loading or serializing the account
+        with self.assertNumQueries(1):
+            self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_detail_changes_with_writes(self):
+        etag = self.assertNotModified(self.detail_url)
+        self.account1.deposit(Decimal('5'))
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['balance'], '1005.000')
+
+        etag = response['ETag']
+        transfers.transfer(self.account2.id, self.account1.id, '1')
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_saves_change_the_etags(self):
+        for changes in [{'name': "Renamed"}, {'balance': Decimal('1234')}]:
+            detail_etag = self.assertNotModified(self.detail_url)
+            list_etag = self.assertNotModified(self.list_url)
+            for field, value in changes.items():
+                setattr(self.account1, field, value)
+            self.account1.save(update_fields=list(changes))
+            response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=detail_etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data['name'], self.account1.name)
+            response = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=list_etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        etag = self.assertNotModified(self.detail_url)
+        self.account1.name = "Saved"
+        self.account1.save()
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_unchanged_list_is_not_modified(self):
+        etag = self.assertNotModified(self.list_url)
+        self.assertNotModified(self.list_url, {'search': 'Account 1'})
+        # each representation has its own tag
+        self.assertNotEqual(self.client.get(self.list_url, {'fields': 'id'})['ETag'], etag)
+        self.assertNotEqual(self.client.get(self.list_url, {'format': 'columns'})['ETag'], etag)
+
+        # the table state, without loading or serializing the page
+        with self.assertNumQueries(1):
+            self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_list_changes_with_writes(self):
+        def upload(csv_data, mode):
+            csv_file = InMemoryUploadedFile(
+                StringIO(csv_data), None, 'accounts.csv', 'text/csv', len(csv_data), None)
+            self.client.post(reverse('import_accounts_api'),
+                             {'file': csv_file, 'mode': mode}, format='multipart')
+
+        writes = [
+            lambda: self.account2.withdraw(Decimal('1')),
+            lambda: transfers.transfer(self.account1.id, self.account2.id, '1'),
+            lambda: transfers.transfer_batch([(self.account2.id, self.account1.id, Decimal('1'))]),
+            lambda: upload(f"{uuid.uuid4()},Account 3,1\n", 'insert'),
+            lambda: upload(f"{self.account1.id},Account 1,7\n{self.account2.id},Account 2,8\n", 'replace'),
+        ]
+        for write in writes:
+            etag = self.assertNotModified(self.list_url)
+            write()
+            response = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_list_changes_with_deletes(self):
+        etag = self.assertNotModified(self.list_url)
+        # The newest account goes and a new one takes its version, so the
+        # newest version and the row count are both what they were
+        self.account2.delete()
+        Account.objects.create(id=uuid.uuid4(), name="Account 3", balance=1)
+        response = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        etag = response['ETag']
+        Account.objects.filter(id=self.account1.id).delete()
+        response = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class AccountTransfersViewTests(APITestCase):
+
+    def setUp(self):
+        self.account1 = Account.objects.create(
+            id=uuid.uuid4(), name="Account 1", balance=1000)
+        self.account2 = Account.objects.create(
+            id=uuid.uuid4(), name="Account 2", balance=500)
+        self.account3 = Account.objects.create(
+            id=uuid.uuid4(), name="Account 3", balance=500)
+
+    def test_transfer_history_pages_newest_first(self):
+        transfers.transfer(self.account1.id, self.account2.id, 1)
+        transfers.transfer(self.account2.id, self.account1.id, 2)
+        transfers.transfer(self.account2.id, self.account3.id, 3)
+        transfers.transfer_batch([(self.account3.id, self.account1.id, Decimal(4)),
+                                  (self.account1.id, self.account3.id, Decimal(5))])
+
+        url = reverse('account_transfers_api', kwargs={'account_id': self.account1.id})
+        response = self.client.get(url, {'page_size': 3})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([entry['amount'] for entry in response.data],
+                         ['5.000', '4.000', '2.000'])
+        self.assertEqual(response.data[0]['from_account'], self.account1.id)
+
+        response = self.client.get(
+            url, {'page_size': 3, 'cursor': response['X-Next-Cursor']})
+        self.assertEqual([entry['amount'] for entry in response.data], ['1.000'])
+        self.assertNotIn('X-Next-Cursor', response)
+
+    def test_transfer_history_not_found(self):
+        url = reverse('account_transfers_api', kwargs={'account_id': uuid.uuid4()})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class AccountCacheTests(APITestCase):
+
+    def setUp(self):
+        caching.get_cache().clear()
+        caching.reset_stats()
+        self.account1 = Account.objects.create(
+            id=uuid.uuid4(), name="Account 1", balance=1000)
+        self.account2 = Account.objects.create(
+            id=uuid.uuid4(), name="Account 2", balance=500)
+
+    def test_detail_is_cached_and_invalidated_on_write(self):
+        url = reverse('account_detail_api', kwargs={'account_id': self.account1.id})
+        self.client.get(url)
+        # only the version lookup behind the ETag
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.data['balance'], '1000.000')
+
+        self.account1.deposit(Decimal('5'))
+        self.assertEqual(self.client.get(url).data['balance'], '1005.000')
+
+        self.client.post(reverse('transfer_funds_api'), {
+            'from_account': str(self.account1.id),
+            'to_account': str(self.account2.id),
+            'amount': 5,
+        }, format='json')
+        self.assertEqual(self.client.get(url).data['balance'], '1000.000')
+
+    def test_payload_stored_by_a_racing_reader_is_not_served(self):
+        url = reverse('account_detail_api', kwargs={'account_id': self.account1.id})
+        response = self.client.get(url)
+        version, shard_version, _ = account_state(self.account1.id)
+        self.account1.deposit(Decimal('5'))
+        # A reader that loaded the account before the deposit committed
+        # stores its payload after it
+        caching.get_cache().set(
+            caching.detail_key('api', self.account1.id, (version, shard_version)), response.data)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['balance'], '1005.000')
+
+    def test_list_is_cached_and_invalidated_on_import(self):
+        url = reverse('account_list_api')
+        self.client.get(url)
+        # only the table state behind the ETag
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(len(response.data), 2)
+
+        csv_data = f"ID,name,balance\n{uuid.uuid4()},Account 3,1"
+        csv_file = InMemoryUploadedFile(
+            StringIO(csv_data), None, 'accounts.csv', 'text/csv', len(csv_data), None)
+        self.client.post(reverse('import_accounts_api'), {'file': csv_file}, format='multipart')
+        self.assertEqual(len(self.client.get(url).data), 3)
+
+    def test_cache_stats(self):
+        url = reverse('account_detail_api', kwargs={'account_id': self.account1.id})
+        for _ in range(4):
+            self.client.get(url)
+        response = self.client.get(reverse('cache_stats_api'))
+        self.assertEqual(response.data, {'hits': 3, 'misses': 1, 'hit_rate': 0.75})
+
+
 class TransferFundsViewTests(APITestCase):
 
     def setUp(self):
@@ -99,6 +382,34 @@ class TransferFundsViewTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertEqual(response.data['detail'], "Insufficient funds.")
 
+    def test_transfer_funds_out_of_range_amounts(self):
+        url = reverse('transfer_funds_api')
+        cases = {
+            '1.23456': "Ensure that there are no more than 3 decimal places.",
+            '1e300': "Ensure that there are no more than 7 digits before the decimal point.",
+        }
+        for amount, detail in cases.items():
+            response = self.client.post(url, {
+                'from_account': str(self.account1.id),
+                'to_account': str(self.account2.id),
+                'amount': amount,
+            }, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.data['detail'], detail)
+        self.assertEqual(Account.objects.get(id=self.account1.id).balance, 1000)
+
+    def test_transfer_funds_past_the_largest_balance(self):
+        Account.objects.filter(id=self.account2.id).update(balance=9999500)
+        response = self.client.post(reverse('transfer_funds_api'), {
+            'from_account': str(self.account1.id),
+            'to_account': str(self.account2.id),
+            'amount': 1000,
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            response.data['detail'], "The recipient's balance cannot exceed 9999999.999.")
+        self.assertEqual(Account.objects.get(id=self.account1.id).balance, 1000)
+
     def test_transfer_funds_account_not_found(self):
         url = reverse('transfer_funds_api')
         data = {
@@ -111,11 +422,311 @@ class TransferFundsViewTests(APITestCase):
         self.assertEqual(response.data['detail'], "Account not found.")
 
 
+@override_settings(ACCOUNT_GROUP_COMMIT=True)
+class GroupCommitTransferViewTests(APITransactionTestCase):
+
+    def setUp(self):
+        self.account1 = Account.objects.create(
+            id=uuid.uuid4(), name="Account 1", balance=1000)
+        self.account2 = Account.objects.create(
+            id=uuid.uuid4(), name="Account 2", balance=500)
+        self.writer = group_commit.GroupCommitWriter(max_wait=0)
+        self.addCleanup(self.writer.shutdown)
+        patcher = patch('accounts.group_commit.get_writer', return_value=self.writer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, from_account, to_account, amount, **headers):
+        return self.client.post(reverse('transfer_funds_api'), {
+            'from_account': str(from_account), 'to_account': str(to_account), 'amount': amount,
+        }, format='json', **headers)
+
+    def test_responses_match_the_direct_path(self):
+        cases = [
+            ((self.account1.id, self.account2.id, 200), 200, "Transfer successful."),
+            ((self.account1.id, self.account2.id, 1200), 400, "Insufficient funds."),
+            ((uuid.uuid4(), self.account2.id, 200), 404, "Account not found."),
+            ((self.account1.id, self.account1.id, 200), 400,
+             "You are trying to transfer money to the same account."),
+        ]
+        for transfer, status_code, detail in cases:
+            response = self.post(*transfer)
+            self.assertEqual(response.status_code, status_code)
+            self.assertEqual(response.data['detail'], detail)
+        self.assertEqual(self.writer.items, 3)
+        self.assertEqual(Account.objects.get(id=self.account2.id).balance, 700)
+
+    def test_unavailable_writer_is_a_503(self):
+        with patch('accounts.group_commit.transfer', side_effect=group_commit.GroupCommitUnavailable(
+                "The transfer writer has stopped.")):
+            response = self.post(self.account1.id, self.account2.id, 200)
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(response.data['detail'], "The transfer writer has stopped.")
+
+    def test_idempotent_transfers_skip_the_queue(self):
+        for _ in range(2):
+            response = self.post(self.account1.id, self.account2.id, 200,
+                                 HTTP_IDEMPOTENCY_KEY='key-1')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.writer.items, 0)
+        self.assertEqual(Account.objects.get(id=self.account2.id).balance, 700)
+
+
+class ShardedAccountViewTests(APITestCase):
+
+    def setUp(self):
+        caching.get_cache().clear()
+        self.hot = Account.objects.create(id=uuid.uuid4(), name="Hot Account", balance=100)
+        self.other = Account.objects.create(id=uuid.uuid4(), name="Other Account", balance=1000)
+        sharding.set_shard_count(self.hot.id, 4)
+        self.detail_url = reverse('account_detail_api', kwargs={'account_id': self.hot.id})
+
+    def test_balances_include_the_shards(self):
+        transfers.transfer(self.other.id, self.hot.id, '12.5')
+        self.assertEqual(self.client.get(self.detail_url).data['balance'], '112.500')
+        response = self.client.get(reverse('account_list_api'), {'search': 'hot'})
+        self.assertEqual(response.json()[0]['balance'], '112.500')
+        expected = AccountSerializer(Account.objects.filter(id=self.hot.id), many=True).data
+        self.assertEqual(response.content, JSONRenderer().render(expected))
+
+    def test_shard_credits_change_the_etags(self):
+        list_url = reverse('account_list_api')
+        detail_etag = self.client.get(self.detail_url)['ETag']
+        list_etag = self.client.get(list_url)['ETag']
+        transfers.transfer(self.other.id, self.hot.id, '1')
+        # the credit only wrote a shard
+        self.assertEqual(Account.objects.get(id=self.hot.id).balance, 100)
+
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=detail_etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['balance'], '101.000')
+        response = self.client.get(list_url, HTTP_IF_NONE_MATCH=list_etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # version lookup, shard versions
+        etag = self.client.get(self.detail_url)['ETag']
+        with self.assertNumQueries(2):
+            response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    async def test_async_detail(self):
+        await sync_to_async(transfers.transfer)(self.other.id, self.hot.id, '2')
+        url = reverse('account_detail_async_api', kwargs={'account_id': self.hot.id})
+        response = await self.async_client.get(url)
+        self.assertEqual(response.json()['balance'], '102.000')
+
+
+class AccountStatsViewTests(APITestCase):
+
+    def setUp(self):
+        self.url = reverse('account_stats_api')
+        Account.objects.create(name="Low", balance=Decimal('2.5'))
+        Account.objects.create(name="High", balance=Decimal('1500'))
+        hot = Account.objects.create(name="Hot", balance=Decimal('20'))
+        sharding.set_shard_count(hot.id, 4)
+        transfers.transfer(Account.objects.get(name="High").id, hot.id, '480')
+
+    def test_stats(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertEqual(data['accounts'], 3)
+        self.assertEqual(data['total_balance'], '1522.500')
+        self.assertEqual(data['average_balance'], '507.500')
+        self.assertEqual(data['min_balance'], '2.500')
+        self.assertEqual(data['max_balance'], '1020.000')
+        self.assertEqual([bucket['lower'] for bucket in data['histogram']],
+                         [f'{lower}.000' for lower in settings.ACCOUNT_STATS_BUCKETS])
+        self.assertEqual(data['histogram'][0],
+                         {'lower': '0.000', 'upper': '10.000', 'accounts': 1, 'total_balance': '2.500'})
+        self.assertEqual(data['histogram'][2]['accounts'], 1)
+        self.assertEqual(data['histogram'][3]['total_balance'], '1020.000')
+        self.assertIsNone(data['histogram'][-1]['upper'])
+
+    def test_queries_do_not_grow_with_accounts(self):
+        Account.objects.bulk_create(
+            [Account(name=f"Extra {i}", balance=i) for i in range(500)])
+        with self.assertNumQueries(3):
+            self.client.get(self.url)
+
+    def test_no_accounts(self):
+        Transfer.objects.all().delete()
+        Account.objects.all().delete()
+        data = self.client.get(self.url).json()
+        self.assertEqual((data['accounts'], data['total_balance'], data['average_balance'],
+                          data['min_balance'], data['max_balance']), (0, '0.000', None, None, None))
+
+
+class AsyncAccountViewTests(TestCase):
+
+    def setUp(self):
+        self.account1 = Account.objects.create(
+            id=uuid.uuid4(), name="Account 1", balance=1000)
+        self.account2 = Account.objects.create(
+            id=uuid.uuid4(), name="Account 2", balance=500)
+
+    async def test_async_list_matches_sync_list(self):
+        sync_response = await sync_to_async(self.client.get)(
+            reverse('account_list_api'), {'page_size': 1})
+        response = await self.async_client.get(
+            reverse('account_list_async_api'), {'page_size': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.content, sync_response.content)
+        self.assertEqual(response['X-Next-Cursor'], sync_response['X-Next-Cursor'])
+
+    async def test_async_detail(self):
+        url = reverse('account_detail_async_api', kwargs={'account_id': self.account1.id})
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {
+            'id': str(self.account1.id), 'name': "Account 1", 'balance': '1000.000'})
+
+        url = reverse('account_detail_async_api', kwargs={'account_id': uuid.uuid4()})
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_async_transfer(self):
+        url = reverse('transfer_funds_async_api')
+        response = await self.async_client.post(url, {
+            'from_account': str(self.account1.id),
+            'to_account': str(self.account2.id),
+            'amount': 200,
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['detail'], "Transfer successful.")
+        account2 = await Account.objects.aget(id=self.account2.id)
+        self.assertEqual(account2.balance, 700)
+
+        response = await self.async_client.post(url, {
+            'from_account': str(self.account1.id),
+            'to_account': str(self.account2.id),
+            'amount': 5000,
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json()['detail'], "Insufficient funds.")
+
+
+class BatchTransferViewTests(APITestCase):
+
+    def setUp(self):
+        self.account1 = Account.objects.create(
+            id=uuid.uuid4(), name="Account 1", balance=1000)
+        self.account2 = Account.objects.create(
+            id=uuid.uuid4(), name="Account 2", balance=500)
+
+    def test_batch_transfer_per_item_results(self):
+        url = reverse('batch_transfer_api')
+        a1, a2 = str(self.account1.id), str(self.account2.id)
+        data = [
+            {'from_account': a1, 'to_account': a2, 'amount': '600'},
+            {'from_account': a2, 'to_account': a1, 'amount': '1100'},  # uses the 600 above
+            {'from_account': a1, 'to_account': a2, 'amount': '2000'},
+            {'from_account': a1, 'to_account': str(uuid.uuid4()), 'amount': '1'},
+            {'from_account': a1, 'to_account': a1, 'amount': '1'},
+            {'from_account': a1, 'to_account': a2, 'amount': '-1'},
+        ]
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [result['status'] for result in response.data['results']],
+            ['ok', 'ok', 'insufficient_funds', 'not_found', 'same_account', 'invalid'])
+        self.assertEqual(response.data['succeeded'], 2)
+        self.assertEqual(response.data['failed'], 4)
+        self.account1.refresh_from_db()
+        self.account2.refresh_from_db()
+        self.assertEqual(self.account1.balance, 1500)
+        self.assertEqual(self.account2.balance, 0)
+
+    def test_batch_transfer_overflow_fails_only_its_item(self):
+        rich = Account.objects.create(id=uuid.uuid4(), name="Rich", balance=Decimal('9999000'))
+        url = reverse('batch_transfer_api')
+        a1, a2 = str(self.account1.id), str(self.account2.id)
+        data = [
+            {'from_account': a1, 'to_account': str(rich.id), 'amount': '999'},
+            {'from_account': a1, 'to_account': str(rich.id), 'amount': '1'},  # past the limit
+            {'from_account': a1, 'to_account': a2, 'amount': '1'},
+        ]
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([result['status'] for result in response.data['results']],
+                         ['ok', 'balance_overflow', 'ok'])
+        rich.refresh_from_db()
+        self.account2.refresh_from_db()
+        self.assertEqual(rich.balance, Decimal('9999999.000'))
+        self.assertEqual(self.account2.balance, 501)
+
+    def test_batch_transfer_ndjson(self):
+        url = reverse('batch_transfer_api')
+        body = "\n".join(json.dumps({
+            'from_account': str(self.account1.id),
+            'to_account': str(self.account2.id),
+            'amount': '10.5',
+        }) for _ in range(3))
+        response = self.client.post(
+            url, body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['succeeded'], 3)
+        self.account2.refresh_from_db()
+        self.assertEqual(self.account2.balance, Decimal('531.5'))
+
+    def test_batch_transfer_queries_do_not_grow_with_batch(self):
+        url = reverse('batch_transfer_api')
+        data = {'transfers': [{
+            'from_account': str(self.account1.id),
+            'to_account': str(self.account2.id),
+            'amount': '1',
+        }] * 50}
+        # savepoint, select_for_update, newest version, bulk_update, journal
+        # insert, stats update, release
+        with self.assertNumQueries(7):
+            response = self.client.post(url, data, format='json')
+        self.assertEqual(response.data['succeeded'], 50)
+
+    def test_batch_transfer_rejects_non_list(self):
+        url = reverse('batch_transfer_api')
+        response = self.client.post(url, {'foo': 'bar'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ExportAccountsViewTests(APITestCase):
+
+    def test_export_ndjson(self):
+        account = Account.objects.create(
+            id=uuid.uuid4(), name="Account 1", balance=Decimal('12.5'))
+        response = self.client.get(
+            reverse('export_accounts_api'), {'format': 'ndjson'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('application/x-ndjson'))
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [
+            {'id': str(account.id), 'name': "Account 1", 'balance': '12.500'}])
+
+    def test_export_csv_round_trips_through_import(self):
+        count = 100_000
+        Account.objects.bulk_create(
+            [Account(id=uuid.uuid4(), name=f"Account {i}", balance=Decimal(i) / 8)
+             for i in range(count)], batch_size=5000)
+        expected = set(Account.objects.values_list('id', 'name', 'balance'))
+
+        response = self.client.get(
+            reverse('export_accounts_api'), {'format': 'csv'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/csv'))
+        exported = b''.join(response.streaming_content)
+        self.assertTrue(exported.startswith(b'ID,Name,Balance\r\n'))
+
+        Account.objects.all().delete()
+        result = importer.import_csv(BytesIO(exported))
+        self.assertEqual(result.imported, count)
+        self.assertEqual(set(Account.objects.values_list('id', 'name', 'balance')), expected)
+
+
 class ImportAccountsViewTests(APITestCase):
 
     def setUp(self):
-        # You can create some accounts if needed, but this test focuses on file upload
-        pass
+        # Start every test with full import rate limit buckets
+        caches[settings.ACCOUNT_THROTTLE_CACHE_ALIAS].clear()
 
     def test_import_accounts_success(self):
         url = reverse('import_accounts_api')
@@ -135,3 +746,637 @@ class ImportAccountsViewTests(APITestCase):
         response = self.client.post(url, {}, format='multipart')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertEqual(response.data['error'], "No file provided.")
+
+    def test_import_accounts_skips_existing_and_duplicate_ids(self):
+        existing = Account.objects.create(
+            id=uuid.uuid4(), name="Existing", balance=100)
+        duplicate_id = uuid.uuid4()
+        url = reverse('import_accounts_api')
+        csv_data = (f"ID,name,balance\n{existing.id},Existing,999\n"
+                    f"{duplicate_id},Account 1,1000\n{duplicate_id},Account 1,1000\n")
+        csv_file = InMemoryUploadedFile(
+            StringIO(csv_data), None, 'accounts.csv', 'text/csv', len(csv_data), None)
+
+        response = self.client.post(url, {'file': csv_file}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['imported'], 1)
+        self.assertEqual(response.data['skipped'], 2)
+        existing.refresh_from_db()
+        self.assertEqual(existing.balance, 100)
+
+    def test_import_accounts_reports_invalid_rows(self):
+        url = reverse('import_accounts_api')
+        duplicate_id = uuid.uuid4()
+        csv_data = (
+            "ID,name,balance\n"
+            f"{uuid.uuid4()},Valid,10\n"
+            "not-a-uuid,Bad ID,10\n"
+            f"{uuid.uuid4()},Bad balance,ten\n"
+            f"{uuid.uuid4()},Too precise,1.2345\n"
+            f"{uuid.uuid4()},Too big,10000000\n"
+            f"{uuid.uuid4()},Missing balance\n"
+            f"{duplicate_id},First,10\n"
+            f"{duplicate_id},Second,10\n"
+        )
+        csv_file = InMemoryUploadedFile(
+            StringIO(csv_data), None, 'accounts.csv', 'text/csv', len(csv_data), None)
+
+        response = self.client.post(url, {'file': csv_file}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['error_count'], 6)
+        self.assertEqual([error['line'] for error in response.data['errors']], [3, 4, 5, 6, 7, 9])
+        self.assertEqual(response.data['errors'][0]['errors'], ["Invalid ID 'not-a-uuid'."])
+        self.assertEqual(response.data['errors'][2]['errors'],
+                         ["Balance 1.2345 has more than 3 decimal places."])
+        self.assertIn("appears earlier in the file", response.data['errors'][5]['errors'][0])
+        # the valid row was not imported either
+        self.assertFalse(Account.objects.exists())
+
+    def test_import_gzipped_accounts(self):
+        url = reverse('import_accounts_api')
+        csv_data = "ID,name,balance\n" + "".join(
+            f"{uuid.uuid4()},Account {i},{i}.5\n" for i in range(20))
+        compressed = gzip.compress(csv_data.encode())
+        csv_file = InMemoryUploadedFile(
+            BytesIO(compressed), None, 'accounts.csv.gz', 'application/gzip',
+            len(compressed), None)
+
+        response = self.client.post(url, {'file': csv_file}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['imported'], 20)
+        self.assertEqual(Account.objects.get(name="Account 3").balance, Decimal('3.500'))
+
+    def test_import_reports_unreadable_files(self):
+        url = reverse('import_accounts_api')
+        csv_data = f"ID,name,balance\n{uuid.uuid4()},Caf\xe9,10\n".encode('latin-1')
+        csv_file = InMemoryUploadedFile(
+            BytesIO(csv_data), None, 'accounts.csv', 'text/csv', len(csv_data), None)
+
+        response = self.client.post(url, {'file': csv_file}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['errors'],
+                         [{'line': 1, 'errors': ["The file is not valid utf-8 text from this line on."]}])
+        self.assertFalse(Account.objects.exists())
+
+        csv_data = bytearray(gzip.compress(f"{uuid.uuid4()},Account,10\n".encode() * 20))
+        csv_data[30:60] = bytes(byte ^ 0xff for byte in csv_data[30:60])
+        csv_file = InMemoryUploadedFile(
+            BytesIO(csv_data), None, 'accounts.csv.gz', 'application/gzip', len(csv_data), None)
+        response = self.client.post(url, {'file': csv_file}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['errors'],
+                         [{'line': 1, 'errors': ["The gzip file is corrupt."]}])
+
+    def upload(self, csv_data, **data):
+        csv_file = InMemoryUploadedFile(
+            StringIO(csv_data), None, 'accounts.csv', 'text/csv', len(csv_data), None)
+        return self.client.post(
+            reverse('import_accounts_api'), {'file': csv_file, **data}, format='multipart')
+
+    def test_upsert_updates_existing_accounts(self):
+        changed = Account.objects.create(id=uuid.uuid4(), name="Old Name", balance=100)
+        same = Account.objects.create(id=uuid.uuid4(), name="Same", balance=100)
+        new_id = uuid.uuid4()
+        detail_url = reverse('account_detail_api', kwargs={'account_id': changed.id})
+        self.client.get(detail_url)  # cache the old payload
+
+        response = self.upload(
+            f"ID,name,balance\n{changed.id},New Name,250.5\n{same.id},Same,100.000\n"
+            f"{new_id},Brand New,10\n", mode='upsert')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            {key: response.data[key] for key in ('imported', 'updated', 'unchanged', 'skipped')},
+            {'imported': 1, 'updated': 1, 'unchanged': 1, 'skipped': 0})
+        self.assertEqual(response.data['message'], "Import completed. 1 accounts imported, "
+                         "1 updated, 1 unchanged, 0 accounts skipped.")
+
+        self.assertEqual(self.client.get(detail_url).data['balance'], '250.500')
+        self.assertEqual(Account.objects.get(id=new_id).name, "Brand New")
+        # the renamed account is found under its new name only
+        self.assertEqual(
+            [row['id'] for row in self.client.get(
+                reverse('account_list_api'), {'search': 'new name'}).data], [str(changed.id)])
+        self.assertEqual(self.client.get(
+            reverse('account_list_api'), {'search': 'old name'}).data, [])
+
+    def test_replace_deletes_missing_accounts_without_transfers(self):
+        kept = Account.objects.create(id=uuid.uuid4(), name="Kept", balance=100)
+        journaled = Account.objects.create(id=uuid.uuid4(), name="Journaled", balance=100)
+        Account.objects.create(id=uuid.uuid4(), name="Dropped", balance=100)
+        transfers.transfer(journaled.id, kept.id, '1')
+
+        response = self.upload(f"ID,name,balance\n{kept.id},Kept,5\n", mode='replace')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual((response.data['updated'], response.data['deleted'], response.data['kept']),
+                         (1, 1, 1))
+        self.assertEqual(set(Account.objects.values_list('name', flat=True)), {"Kept", "Journaled"})
+
+    def test_unknown_import_mode(self):
+        response = self.upload(f"ID,name,balance\n{uuid.uuid4()},Account,5\n", mode='merge')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Account.objects.exists())
+
+    def test_import_accounts_in_batches(self):
+        url = reverse('import_accounts_api')
+        rows = "".join(f"{uuid.uuid4()},Account {i},{i}\n" for i in range(25))
+        csv_data = "ID,name,balance\n" + rows
+        csv_file = InMemoryUploadedFile(
+            StringIO(csv_data), None, 'accounts.csv', 'text/csv', len(csv_data), None)
+
+        with patch('accounts.importer.DEFAULT_BATCH_SIZE', 10), \
+                patch('accounts.importer._import_batch', wraps=importer._import_batch) as import_batch:
+            response = self.client.post(url, {'file': csv_file}, format='multipart')
+        self.assertEqual(import_batch.call_count, 3)
+        self.assertEqual(response.data['imported'], 25)
+        self.assertEqual(Account.objects.count(), 25)
+
+
+class ImportJobTests(APITransactionTestCase):
+
+    def setUp(self):
+        caches[settings.ACCOUNT_THROTTLE_CACHE_ALIAS].clear()
+        spool_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(spool_dir.cleanup)
+        override = self.settings(ACCOUNT_IMPORT_SPOOL_DIR=spool_dir.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_background_import(self):
+        url = reverse('import_accounts_api')
+        csv_data = f"ID,name,balance\n{uuid.uuid4()},Account 1,1000\n{uuid.uuid4()},Account 2,1500"
+        csv_file = InMemoryUploadedFile(
+            StringIO(csv_data), None, 'accounts.csv', 'text/csv', len(csv_data), None)
+
+        response = self.client.post(
+            url, {'file': csv_file, 'background': 'true'}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job_id = uuid.UUID(response.data['job_id'])
+        jobs.wait_for_job(job_id, timeout=10)
+
+        response = self.client.get(response.data['status_url'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], ImportJob.DONE)
+        self.assertEqual(response.data['rows_processed'], 2)
+        self.assertEqual(response.data['imported'], 2)
+        self.assertEqual(response.data['skipped'], 0)
+        self.assertEqual(Account.objects.count(), 2)
+        self.assertFalse(os.path.exists(ImportJob.objects.get(id=job_id).file_path))
+        # the job's import slot is released by a callback right after it ends
+        for _ in range(100):
+            if throttling.import_slots.in_progress == 0:
+                break
+            time.sleep(0.01)
+        self.assertEqual(throttling.import_slots.in_progress, 0)
+
+    def test_background_import_of_invalid_file_fails(self):
+        url = reverse('import_accounts_api')
+        csv_data = f"ID,name,balance\n{uuid.uuid4()},Account 1,1000\nbad,Account 2,1500"
+        csv_file = InMemoryUploadedFile(
+            StringIO(csv_data), None, 'accounts.csv', 'text/csv', len(csv_data), None)
+
+        response = self.client.post(
+            url, {'file': csv_file, 'background': 'true'}, format='multipart')
+        job_id = uuid.UUID(response.data['job_id'])
+        with self.assertRaises(importer.ImportValidationError):
+            jobs.wait_for_job(job_id, timeout=10)
+
+        job = ImportJob.objects.get(id=job_id)
+        self.assertEqual(job.status, ImportJob.FAILED)
+        self.assertIn("line 3: Invalid ID 'bad'.", job.error)
+        self.assertFalse(Account.objects.exists())
+
+    def test_abandoned_job_is_reported_failed(self):
+        spool_path = os.path.join(settings.ACCOUNT_IMPORT_SPOOL_DIR, 'abandoned.csv')
+        with open(spool_path, 'w') as spool:
+            spool.write("ID,name,balance\n")
+        abandoned = ImportJob.objects.create(
+            status=ImportJob.RUNNING, file_path=spool_path,
+            heartbeat_at=timezone.now() - timedelta(seconds=settings.ACCOUNT_IMPORT_STALE_SECONDS + 1))
+        live = ImportJob.objects.create(status=ImportJob.RUNNING, file_path='')
+
+        response = self.client.get(reverse('import_job_api', kwargs={'job_id': abandoned.id}))
+        self.assertEqual(response.data['status'], ImportJob.FAILED)
+        self.assertEqual(response.data['error'], "The process running the import stopped.")
+        self.assertFalse(os.path.exists(spool_path))
+        response = self.client.get(reverse('import_job_api', kwargs={'job_id': live.id}))
+        self.assertEqual(response.data['status'], ImportJob.RUNNING)
+
+    def test_jobs_of_a_live_process_keep_their_heartbeat(self):
+        stale = timezone.now() - timedelta(seconds=settings.ACCOUNT_IMPORT_STALE_SECONDS + 1)
+        job = ImportJob.objects.create(status=ImportJob.PENDING, file_path='', heartbeat_at=stale)
+        with patch.dict(jobs._futures, {job.id: None}):
+            self.assertTrue(jobs._beat_jobs())
+        self.assertEqual(jobs.fail_abandoned_jobs(), 0)
+        self.assertEqual(ImportJob.objects.get(id=job.id).status, ImportJob.PENDING)
+
+    def test_background_upsert(self):
+        account = Account.objects.create(id=uuid.uuid4(), name="Account 1", balance=1)
+        csv_data = f"ID,name,balance\n{account.id},Account 1,1000\n{uuid.uuid4()},Account 2,1500"
+        csv_file = InMemoryUploadedFile(
+            StringIO(csv_data), None, 'accounts.csv', 'text/csv', len(csv_data), None)
+
+        response = self.client.post(
+            reverse('import_accounts_api'),
+            {'file': csv_file, 'background': 'true', 'mode': 'upsert'}, format='multipart')
+        jobs.wait_for_job(uuid.UUID(response.data['job_id']), timeout=10)
+
+        response = self.client.get(response.data['status_url'])
+        self.assertEqual(response.data['mode'], 'upsert')
+        self.assertEqual((response.data['imported'], response.data['updated']), (1, 1))
+        self.assertEqual(response.data['rows_processed'], 2)
+        account.refresh_from_db()
+        self.assertEqual(account.balance, Decimal('1000.000'))
+
+    def test_import_job_not_found(self):
+        url = reverse('import_job_api', kwargs={'job_id': uuid.uuid4()})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class MetricsMiddlewareTests(TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.account1 = Account.objects.create(
+            id=uuid.uuid4(), name="Account 1", balance=1000)
+        self.account2 = Account.objects.create(
+            id=uuid.uuid4(), name="Account 2", balance=500)
+
+    def get_metrics(self):
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        return response.content.decode()
+
+    def test_records_time_and_queries_per_view(self):
+        data = {'from_account': str(self.account1.id),
+                'to_account': str(self.account2.id), 'amount': 200}
+        with self.assertNumQueries(6):
+            self.client.post(reverse('transfer_funds_api'), data,
+                             content_type='application/json')
+
+        body = self.get_metrics()
+        self.assertIn('http_request_duration_seconds_count{view="transfer_funds_api"} 1', body)
+        self.assertIn('http_request_db_queries_sum{view="transfer_funds_api"} 6', body)
+        self.assertIn('http_request_db_queries_bucket{view="transfer_funds_api",le="5"} 0', body)
+        self.assertIn('http_request_db_queries_bucket{view="transfer_funds_api",le="10"} 1', body)
+        self.assertIn('http_request_db_duration_seconds_count{view="transfer_funds_api"} 1', body)
+
+    async def test_counts_queries_of_async_views(self):
+        url = reverse('account_detail_async_api', kwargs={'account_id': self.account1.id})
+        await self.async_client.get(url)
+        body = await sync_to_async(self.get_metrics)()
+        self.assertIn('http_request_db_queries_sum{view="account_detail_async_api"} 1', body)
+
+    def test_warns_when_over_query_budget(self):
+        url = reverse('account_detail_api', kwargs={'account_id': self.account1.id})
+        with self.settings(REQUEST_QUERY_BUDGET=0):
+            with self.assertLogs('account_transfer.metrics', 'WARNING') as logs:
+                self.client.get(url)
+        self.assertIn(f'GET {url} ran 2 queries (budget 0)', logs.output[0])
+
+
+class QueryBudgetTests(APITestCase):
+    """Query counts of every endpoint, which must not grow with the data.
+
+    Each test runs the request against a small and a larger data set under
+    the same budget, so an N+1 fails here even when behavior is unchanged.
+    """
+
+    def setUp(self):
+        caching.get_cache().clear()
+        self.accounts = [Account.objects.create(
+            id=uuid.uuid4(), name=f"Account {i}", balance=1000) for i in range(3)]
+
+    def add_accounts(self, count):
+        Account.objects.bulk_create(
+            [Account(id=uuid.uuid4(), name=f"Extra {i}", balance=1000) for i in range(count)])
+        caching.get_cache().clear()
+
+    def assertBudget(self, budget, request):
+        """Assert ``request()`` runs ``budget`` queries, then again with 50 more accounts."""
+        with self.assertNumQueries(budget):
+            request()
+        self.add_accounts(50)
+        with self.assertNumQueries(budget):
+            request()
+
+    def import_rows(self, count):
+        csv_data = "ID,Name,Balance\n" + "".join(
+            f"{uuid.uuid4()},Imported {i},10\n" for i in range(count))
+        csv_file = InMemoryUploadedFile(
+            StringIO(csv_data), None, 'accounts.csv', 'text/csv', len(csv_data), None)
+        return self.client.post(
+            reverse('import_accounts_api'), {'file': csv_file}, format='multipart')
+
+    def test_list(self):
+        # table state, page
+        self.assertBudget(2, lambda: self.client.get(
+            reverse('account_list_api'), {'page_size': 1000}))
+
+    def test_list_search(self):
+        # table state, page joined to the token prefix lookup
+        self.assertBudget(2, lambda: self.client.get(
+            reverse('account_list_api'), {'search': 'Account 1', 'page_size': 1000}))
+
+    def test_detail(self):
+        url = reverse('account_detail_api', kwargs={'account_id': self.accounts[0].id})
+        # version, account
+        self.assertBudget(2, lambda: self.client.get(url))
+
+    def test_account_transfers(self):
+        for _ in range(3):
+            transfers.transfer(self.accounts[0].id, self.accounts[1].id, '1')
+        url = reverse('account_transfers_api', kwargs={'account_id': self.accounts[0].id})
+        # account exists, outgoing page, incoming page
+        self.assertBudget(3, lambda: self.client.get(url))
+
+    def test_transfer(self):
+        # Transfers within one stats bucket leave the stats as they are
+        self.accounts[0].deposit(1000)
+        data = {'from_account': str(self.accounts[0].id),
+                'to_account': str(self.accounts[1].id), 'amount': '1'}
+        # savepoint, debit, credit, journal insert, release
+        self.assertBudget(5, lambda: self.client.post(
+            reverse('transfer_funds_api'), data, format='json'))
+        # plus the stats update when they are not
+        with self.assertNumQueries(6):
+            self.client.post(reverse('transfer_funds_api'), dict(data, amount='1500'), format='json')
+
+    def test_batch_transfer(self):
+        # Both accounts stay in one stats bucket, as in test_transfer
+        self.accounts[0].deposit(1000)
+
+        def batch(size):
+            return lambda: self.client.post(reverse('batch_transfer_api'), {'transfers': [{
+                'from_account': str(self.accounts[0].id),
+                'to_account': str(self.accounts[1].id),
+                'amount': '1',
+            }] * size}, format='json')
+
+        with self.assertNumQueries(6):
+            batch(1)()
+        with self.assertNumQueries(6):
+            batch(200)()
+
+    def test_import(self):
+        # savepoint, existing ids, newest version, accounts insert, tokens
+        # insert, stats update, release. One accounts INSERT holds up to 199
+        # rows on SQLite.
+        with self.assertNumQueries(7):
+            self.import_rows(1)
+        with self.assertNumQueries(7):
+            self.import_rows(150)
+
+    def test_upsert_import(self):
+        def upsert(count):
+            rows = [(account.id, f"Renamed {count} {i}", count) for i, account in enumerate(self.accounts)]
+            rows += [(uuid.uuid4(), f"Imported {i}", 10) for i in range(count)]
+            csv_data = "".join(f"{account_id},{name},{balance}\n" for account_id, name, balance in rows)
+            csv_file = InMemoryUploadedFile(
+                StringIO(csv_data), None, 'accounts.csv', 'text/csv', len(csv_data), None)
+            return self.client.post(
+                reverse('import_accounts_api'), {'file': csv_file, 'mode': 'upsert'}, format='multipart')
+
+        # savepoint, existing rows, newest version, upsert, journal high
+        # water, snapshots, new tokens, renamed tokens delete and insert,
+        # stats update, release
+        with self.assertNumQueries(11):
+            upsert(1)
+        with self.assertNumQueries(11):
+            upsert(150)
+
+    def test_export(self):
+        def export():
+            response = self.client.get(reverse('export_accounts_api'), {'format': 'csv'})
+            b''.join(response.streaming_content)
+
+        self.assertBudget(1, export)
+
+    def test_async_list_and_detail(self):
+        url = reverse('account_detail_async_api', kwargs={'account_id': self.accounts[0].id})
+        self.assertBudget(1, lambda: self.client.get(url))
+        self.assertBudget(1, lambda: self.client.get(
+            reverse('account_list_async_api'), {'page_size': 1000}))
+
+
+class IdempotencyKeyTests(APITestCase):
+
+    def setUp(self):
+        self.account1 = Account.objects.create(
+            id=uuid.uuid4(), name="Account 1", balance=1000)
+        self.account2 = Account.objects.create(
+            id=uuid.uuid4(), name="Account 2", balance=500)
+        self.data = {'from_account': str(self.account1.id),
+                     'to_account': str(self.account2.id), 'amount': '200'}
+
+    def post(self, url, data, key):
+        return self.client.post(url, data, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_without_transferring_again(self):
+        url = reverse('transfer_funds_api')
+        first = self.post(url, self.data, 'key-1')
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertFalse(first.has_header('Idempotent-Replayed'))
+
+        # one primary key lookup, no Account queries
+        with self.assertNumQueries(1):
+            retry = self.post(url, self.data, 'key-1')
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(json.loads(retry.content), {"detail": "Transfer successful."})
+
+        self.account1.refresh_from_db()
+        self.assertEqual(self.account1.balance, Decimal('800.000'))
+        self.assertEqual(Transfer.objects.count(), 1)
+
+    def test_failed_transfer_is_replayed(self):
+        url = reverse('transfer_funds_api')
+        data = {**self.data, 'amount': '5000'}
+        self.assertEqual(self.post(url, data, 'key-1').status_code, status.HTTP_400_BAD_REQUEST)
+        # money arriving later does not change the answer to the same request
+        self.account1.deposit(Decimal('10000'))
+        retry = self.post(url, data, 'key-1')
+        self.assertEqual(retry.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Transfer.objects.count(), 0)
+
+    def test_key_reused_for_another_request(self):
+        url = reverse('transfer_funds_api')
+        self.post(url, self.data, 'key-1')
+        response = self.post(url, {**self.data, 'amount': '1'}, 'key-1')
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.account1.refresh_from_db()
+        self.assertEqual(self.account1.balance, Decimal('800.000'))
+
+    def test_distinct_keys_transfer_twice(self):
+        url = reverse('transfer_funds_api')
+        self.post(url, self.data, 'key-1')
+        self.post(url, self.data, 'key-2')
+        self.account1.refresh_from_db()
+        self.assertEqual(self.account1.balance, Decimal('600.000'))
+
+    def test_batch_retry_replays(self):
+        url = reverse('batch_transfer_api')
+        data = {'transfers': [self.data] * 3}
+        first = self.post(url, data, 'batch-1')
+        retry = self.post(url, data, 'batch-1')
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.content, first.content)
+        self.account1.refresh_from_db()
+        self.assertEqual(self.account1.balance, Decimal('400.000'))
+
+    def test_invalid_key(self):
+        response = self.post(reverse('transfer_funds_api'), self.data, 'k' * 256)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.account1.refresh_from_db()
+        self.assertEqual(self.account1.balance, Decimal('1000.000'))
+
+
+class AdmissionControlTests(APITestCase):
+
+    def setUp(self):
+        caches[settings.ACCOUNT_THROTTLE_CACHE_ALIAS].clear()
+        self.account1 = Account.objects.create(
+            id=uuid.uuid4(), name="Account 1", balance=1000)
+        self.account2 = Account.objects.create(
+            id=uuid.uuid4(), name="Account 2", balance=500)
+        self.now = 1000.0
+        patcher = patch.object(TokenBucketThrottle, 'timer', lambda _: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def transfer(self, from_account, client='10.0.0.1'):
+        to_account = self.account2 if from_account == self.account1 else self.account1
+        return self.client.post(reverse('transfer_funds_api'), {
+            'from_account': str(from_account.id), 'to_account': str(to_account.id), 'amount': 1,
+        }, format='json', REMOTE_ADDR=client)
+
+    def upload(self):
+        csv_data = f"ID,name,balance\n{uuid.uuid4()},Account 3,1\n"
+        csv_file = InMemoryUploadedFile(
+            StringIO(csv_data), None, 'accounts.csv', 'text/csv', len(csv_data), None)
+        return self.client.post(reverse('import_accounts_api'), {'file': csv_file},
+                                format='multipart')
+
+    def assertRejected(self, response, status_code, retry_after):
+        self.assertEqual(response.status_code, status_code)
+        self.assertEqual(response['Retry-After'], retry_after)
+
+    @override_settings(ACCOUNT_THROTTLE_RATES={'transfer_client': (0.5, 2)})
+    def test_clients_are_limited_by_token_bucket(self):
+        self.assertEqual(self.transfer(self.account1).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.transfer(self.account2).status_code, status.HTTP_200_OK)
+        self.assertRejected(self.transfer(self.account1), status.HTTP_429_TOO_MANY_REQUESTS, '2')
+        # other clients have buckets of their own
+        self.assertEqual(self.transfer(self.account1, client='10.0.0.2').status_code,
+                         status.HTTP_200_OK)
+
+        self.now += 2
+        self.assertEqual(self.transfer(self.account1).status_code, status.HTTP_200_OK)
+        self.assertRejected(self.transfer(self.account1), status.HTTP_429_TOO_MANY_REQUESTS, '2')
+
+    @override_settings(ACCOUNT_THROTTLE_RATES={'transfer_account': (1, 1)})
+    def test_source_accounts_are_limited_across_clients(self):
+        self.assertEqual(self.transfer(self.account1).status_code, status.HTTP_200_OK)
+        self.assertRejected(self.transfer(self.account1, client='10.0.0.2'),
+                            status.HTTP_429_TOO_MANY_REQUESTS, '1')
+        self.assertEqual(self.transfer(self.account2).status_code, status.HTTP_200_OK)
+        self.assertEqual(Transfer.objects.count(), 2)
+
+    @override_settings(ACCOUNT_TRANSFER_MAX_CONCURRENT=1)
+    def test_transfers_past_the_concurrency_limit_are_shed(self):
+        self.assertTrue(throttling.transfer_slots.acquire())
+        try:
+            self.assertRejected(self.transfer(self.account1),
+                                status.HTTP_503_SERVICE_UNAVAILABLE, '1')
+        finally:
+            throttling.transfer_slots.release()
+        self.assertEqual(self.transfer(self.account1).status_code, status.HTTP_200_OK)
+        self.assertEqual(throttling.transfer_slots.in_progress, 0)
+
+    @override_settings(ACCOUNT_THROTTLE_RATES={'transfer_client': (0.5, 2)},
+                       ACCOUNT_TRANSFER_MAX_CONCURRENT=1)
+    def test_async_transfers_are_admitted_alike(self):
+        url = reverse('transfer_funds_async_api')
+        data = {'from_account': str(self.account1.id), 'to_account': str(self.account2.id),
+                'amount': 1}
+        response = self.client.post(url, data, format='json',
+                                    HTTP_IDEMPOTENCY_KEY='async-1', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.post(url, data, format='json',
+                                    HTTP_IDEMPOTENCY_KEY='async-1', REMOTE_ADDR='10.0.0.3')
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+        self.assertEqual(Transfer.objects.count(), 1)
+
+        # the bucket is shared with the sync endpoint
+        self.assertEqual(self.transfer(self.account1).status_code, status.HTTP_200_OK)
+        self.assertRejected(self.client.post(url, data, format='json',
+                                             REMOTE_ADDR='10.0.0.1'),
+                            status.HTTP_429_TOO_MANY_REQUESTS, '2')
+
+        self.assertTrue(throttling.transfer_slots.acquire())
+        try:
+            self.assertRejected(self.client.post(url, data, format='json',
+                                                 REMOTE_ADDR='10.0.0.2'),
+                                status.HTTP_503_SERVICE_UNAVAILABLE, '1')
+        finally:
+            throttling.transfer_slots.release()
+
+    @override_settings(ACCOUNT_IMPORT_MAX_CONCURRENT=1)
+    def test_imports_past_the_concurrency_limit_are_shed(self):
+        self.assertTrue(throttling.import_slots.acquire())
+        try:
+            self.assertRejected(self.upload(), status.HTTP_503_SERVICE_UNAVAILABLE, '5')
+        finally:
+            throttling.import_slots.release()
+        self.assertEqual(self.upload().status_code, status.HTTP_201_CREATED)
+        self.assertEqual(throttling.import_slots.in_progress, 0)
+
+    @override_settings(ACCOUNT_THROTTLE_RATES={'import_client': (0.1, 1)})
+    def test_imports_are_rate_limited(self):
+        self.assertEqual(self.upload().status_code, status.HTTP_201_CREATED)
+        self.assertRejected(self.upload(), status.HTTP_429_TOO_MANY_REQUESTS, '10')
+
+
+@override_settings(
+    ROOT_URLCONF='account_transfer.api_urls',
+    REST_FRAMEWORK={
+        'DEFAULT_AUTHENTICATION_CLASSES': [],
+        'DEFAULT_PERMISSION_CLASSES': [],
+        'UNAUTHENTICATED_USER': None,
+    },
+)
+class ApiOnlyProfileTests(APITestCase):
+    """The URLconf and DRF settings of DJANGO_API_ONLY=1 workers."""
+
+    def setUp(self):
+        caches[settings.ACCOUNT_THROTTLE_CACHE_ALIAS].clear()
+        self.account1 = Account.objects.create(name="Account 1", balance=Decimal('100.000'))
+        self.account2 = Account.objects.create(name="Account 2", balance=Decimal('0.000'))
+
+    def test_serves_the_api_only(self):
+        self.assertEqual(self.client.get(reverse('account_list_api')).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get('/accounts/').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get('/admin/').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_anonymous_requests_are_throttled_by_client(self):
+        with override_settings(ACCOUNT_THROTTLE_RATES={'transfer_client': (0.1, 1)}):
+            for expected in (status.HTTP_200_OK, status.HTTP_429_TOO_MANY_REQUESTS):
+                response = self.client.post(reverse('transfer_funds_api'), {
+                    'from_account': str(self.account1.id),
+                    'to_account': str(self.account2.id),
+                    'amount': '10.000',
+                }, format='json')
+                self.assertEqual(response.status_code, expected)
+
+    def test_imports_load_the_importer(self):
+        csv_data = f"ID,name,balance\n{uuid.uuid4()},Imported,5"
+        csv_file = InMemoryUploadedFile(
+            StringIO(csv_data), None, 'accounts.csv', 'text/csv', len(csv_data), None)
+        response = self.client.post(reverse('import_accounts_api'), {'file': csv_file},
+                                    format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Account.objects.count(), 3)
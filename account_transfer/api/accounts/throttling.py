@@ -0,0 +1,136 @@
+"""Admission control for the transfer and import endpoints.
+
+Two layers keep a burst from piling onto the database:
+
+- Token buckets, as DRF throttles. Each bucket holds up to ``burst``
+  tokens and refills at ``rate`` per second; a request takes one, and an
+  empty bucket means ``429 Too Many Requests`` with ``Retry-After`` set to
+  when the next token arrives. Buckets live in the
+  ``ACCOUNT_THROTTLE_CACHE_ALIAS`` cache. The read and write of a bucket
+  are serialized within a process, not across processes, so with a shared
+  cache concurrent workers can overshoot a limit by a few requests.
+- Concurrency limits per process. Past the limit, a request gets ``503
+  Service Unavailable`` with ``Retry-After`` straight away instead of
+  waiting on database locks behind the others.
+
+Limits are read from settings on every request (see
+``ACCOUNT_THROTTLE_RATES``).
+"""
+import math
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.throttling import BaseThrottle
+
+_bucket_lock = threading.Lock()
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """A token bucket per :meth:`get_ident_key`, sized by ``ACCOUNT_THROTTLE_RATES[scope]``."""
+    scope = None
+    # Wall time, so that processes sharing the cache agree on it
+    timer = time.time
+
+    def get_ident_key(self, request, view):
+        """The identity to limit, or ``None`` to let the request through."""
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        rate, burst = settings.ACCOUNT_THROTTLE_RATES.get(self.scope) or (None, None)
+        if not rate:
+            return True
+        ident = self.get_ident_key(request, view)
+        if ident is None:
+            return True
+
+        cache = caches[settings.ACCOUNT_THROTTLE_CACHE_ALIAS]
+        key = f'throttle:{self.scope}:{ident}'
+        now = self.timer()
+        with _bucket_lock:
+            tokens, updated = cache.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            # A full bucket needs no entry; let it expire once it has refilled
+            cache.set(key, (tokens, now), math.ceil((burst - tokens) / rate) + 1)
+        self.wait_seconds = 0 if allowed else (1 - tokens) / rate
+        return allowed
+
+    def wait(self):
+        return self.wait_seconds
+
+
+def client_ident(throttle, request):
+    if request.user and request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    return throttle.get_ident(request)
+
+
+class ClientTransferThrottle(TokenBucketThrottle):
+    scope = 'transfer_client'
+
+    def get_ident_key(self, request, view):
+        return client_ident(self, request)
+
+
+class SourceAccountThrottle(TokenBucketThrottle):
+    """Limits the transfers out of one account, whoever sends them."""
+    scope = 'transfer_account'
+
+    def get_ident_key(self, request, view):
+        data = request.data
+        if not isinstance(data, dict):
+            return None
+        try:
+            return uuid.UUID(str(data.get('from_account'))).hex
+        except ValueError:
+            # Invalid IDs are rejected by the view without touching an account
+            return None
+
+
+class ClientImportThrottle(TokenBucketThrottle):
+    scope = 'import_client'
+
+    def get_ident_key(self, request, view):
+        return client_ident(self, request)
+
+
+class ConcurrencyLimit:
+    """A non-blocking cap on the requests in progress in this process."""
+
+    def __init__(self, setting, retry_after):
+        self.setting = setting
+        self.retry_after = retry_after
+        self.in_progress = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a slot; ``False`` if they are all taken."""
+        limit = getattr(settings, self.setting)
+        with self._lock:
+            if limit is not None and self.in_progress >= limit:
+                return False
+            self.in_progress += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_progress -= 1
+
+    def overloaded(self):
+        """The response for a request that found no free slot."""
+        response = Response({"detail": "Too many requests in progress; try again later."},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        response['Retry-After'] = str(self.retry_after)
+        return response
+
+
+transfer_slots = ConcurrencyLimit('ACCOUNT_TRANSFER_MAX_CONCURRENT', retry_after=1)
+# Background imports hold their slot until the job finishes
+import_slots = ConcurrencyLimit('ACCOUNT_IMPORT_MAX_CONCURRENT', retry_after=5)
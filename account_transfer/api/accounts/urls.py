@@ -1,10 +1,30 @@
 from django.urls import path
-from .views import AccountListView, AccountDetailView, TransferFundsView, ImportAccountsView
+from . import async_views
+from .views import (AccountListView, AccountDetailView, TransferFundsView,
+                    BatchTransferView, ExportAccountsView, ImportAccountsView,
+                    ImportJobDetailView, AccountTransfersView, CacheStatsView,
+                    AccountStatsView)
 
 urlpatterns = [
     path('', AccountListView.as_view(), name='account_list_api'),
     path('<uuid:account_id>/',
          AccountDetailView.as_view(), name='account_detail_api'),
+    path('<uuid:account_id>/transfers/',
+         AccountTransfersView.as_view(), name='account_transfers_api'),
     path('transfer/', TransferFundsView.as_view(), name='transfer_funds_api'),
+    path('transfers/batch/', BatchTransferView.as_view(),
+         name='batch_transfer_api'),
+    path('cache/stats/', CacheStatsView.as_view(), name='cache_stats_api'),
+    path('stats/', AccountStatsView.as_view(), name='account_stats_api'),
+    path('export/', ExportAccountsView.as_view(), name='export_accounts_api'),
     path('import/', ImportAccountsView.as_view(), name='import_accounts_api'),
+    path('import/<uuid:job_id>/',
+         ImportJobDetailView.as_view(), name='import_job_api'),
+
+    # Async versions of the read and transfer endpoints for ASGI deployments
+    path('async/', async_views.account_list, name='account_list_async_api'),
+    path('async/<uuid:account_id>/',
+         async_views.account_detail, name='account_detail_async_api'),
+    path('async/transfer/', async_views.transfer_funds,
+         name='transfer_funds_async_api'),
 ]
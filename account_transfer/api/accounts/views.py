@@ -1,102 +1,381 @@
-import csv
-from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.parsers import JSONParser, MultiPartParser, FormParser
+import dataclasses
+import hashlib
 import json
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from accounts.models import Account
-from .serializers import AccountSerializer
-from django.db.models import Q
+from accounts import (
+    caching, group_commit, idempotency, ledger, pagination, search, stats, transfers,
+)
+from accounts.models import Account, ImportJob, account_state, table_state, total_balance
+from .parsers import NDJSONParser
+from .renderers import CSVRenderer, ColumnarJSONRenderer, NDJSONRenderer
+from . import throttling
+from .throttling import ClientImportThrottle, ClientTransferThrottle, SourceAccountThrottle
+from .serializers import (
+    AccountSerializer, AccountStatsSerializer, ImportJobSerializer, LedgerEntrySerializer,
+    TransferSerializer, account_columns, account_dicts, account_rows, encode_accounts,
+)
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+
+def paginated_response(request, data, next_cursor):
+    """Return ``data`` with the next page advertised in Link and X-Next-Cursor."""
+    response = Response(data)
+    if next_cursor:
+        query = request.GET.copy()
+        query['cursor'] = next_cursor
+        next_url = request.build_absolute_uri(f"{request.path}?{query.urlencode()}")
+        response['Link'] = f'<{next_url}>; rel="next"'
+        response['X-Next-Cursor'] = next_cursor
+    return response
+
+
+def entity_tag(request, *parts):
+    """A strong ETag for ``parts`` in the representation negotiated for ``request``."""
+    digest = hashlib.md5(json.dumps(
+        [request.accepted_renderer.format, *parts], default=str).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def set_validators(response, etag, last_modified=None):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
+
+
+def not_modified(request, etag, last_modified=None):
+    """Return a 304 if the client's copy is still current, else ``None``."""
+    response = get_conditional_response(
+        request, etag=etag,
+        last_modified=int(last_modified.timestamp()) if last_modified else None)
+    if response is not None:
+        set_validators(response, etag, last_modified)
+    return response
+
+
+def idempotent_response(request, handler):
+    """Call ``handler`` once per ``Idempotency-Key`` header.
+
+    Without the header this is just ``handler()``. With it, a retry gets
+    the stored response to the first attempt, marked ``Idempotent-Replayed``.
+    """
+    key = request.headers.get('Idempotency-Key')
+    if key is None:
+        return handler()
+
+    request_fingerprint = idempotency.fingerprint(
+        request.method, request.path,
+        json.dumps(request.data, sort_keys=True, default=str).encode())
+
+    def render():
+        response = handler()
+        return response.status_code, JSONRenderer().render(response.data).decode()
+
+    try:
+        outcome = idempotency.run(key, request_fingerprint, render)
+    except idempotency.InvalidKey as exc:
+        return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    except idempotency.KeyReused:
+        return Response(
+            {"detail": "Idempotency-Key was already used for a different request."},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    response = HttpResponse(outcome.body, status=outcome.status_code,
+                            content_type='application/json')
+    if outcome.replayed:
+        response['Idempotent-Replayed'] = 'true'
+    return response
 
 
 class AccountListView(APIView):
+    # ?format=columns (or the Accept header) picks the columnar layout
+    renderer_classes = (JSONRenderer, ColumnarJSONRenderer, BrowsableAPIRenderer)
+
     def get(self, request):
         search_query = request.GET.get('search', '')
+        fields = AccountSerializer.Meta.fields
+        if request.GET.get('fields'):
+            fields = request.GET['fields'].split(',')
+            unknown = set(fields) - set(AccountSerializer.Meta.fields)
+            if unknown:
+                return Response({"detail": f"Unknown fields: {', '.join(sorted(unknown))}."}, status=status.HTTP_400_BAD_REQUEST)
+        cursor = request.GET.get('cursor')
+
         if search_query:
-            accounts = Account.objects.filter(Q(name__icontains=search_query))
+            accounts = search.search_accounts(search_query)
         else:
             accounts = Account.objects.all()
 
-        serializer = AccountSerializer(accounts, many=True)
-        return Response(serializer.data)
+        def load_page():
+            page = pagination.paginate(account_rows(accounts), cursor, page_size)
+            return {"rows": encode_accounts(page.items), "next_cursor": page.next_cursor}
+
+        try:
+            page_size = pagination.get_page_size(request.GET.get('page_size'))
+            params = [search_query, cursor, page_size]
+            # The whole table's state validates every listing, so a search
+            # costs no more to check than the first page
+            state = table_state()
+            etag = entity_tag(request, *params, fields, *state)
+            response = not_modified(request, etag)
+            if response is not None:
+                return response
+            # Pages are cached as encoded rows, so one entry serves every
+            # field subset and layout
+            page = caching.read_through(caching.list_key('api', params, state), load_page)
+        except ValueError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if request.accepted_renderer.format == ColumnarJSONRenderer.format:
+            data = account_columns(page["rows"], fields)
+        else:
+            data = account_dicts(page["rows"], fields)
+        return set_validators(paginated_response(request, data, page["next_cursor"]), etag)
 
 
 class AccountDetailView(APIView):
     def get(self, request, account_id):
+        state = account_state(account_id)
+        if state is None:
+            return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+        version, shard_version, updated_at = state
+        etag = entity_tag(request, account_id, version, shard_version)
+        response = not_modified(request, etag, updated_at)
+        if response is not None:
+            return response
+
+        def load_account():
+            return AccountSerializer(
+                Account.objects.annotate(total_balance=total_balance()).get(id=account_id)).data
+
         try:
-            account = Account.objects.get(id=account_id)
+            data = caching.read_through(
+                caching.detail_key('api', account_id, (version, shard_version)), load_account)
         except Account.DoesNotExist:
             return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
 
-        serializer = AccountSerializer(account)
-        return Response(serializer.data)
+        return set_validators(Response(data), etag, updated_at)
+
+
+class AccountTransfersView(APIView):
+    def get(self, request, account_id):
+        if not Account.objects.filter(id=account_id).exists():
+            return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            page_size = pagination.get_page_size(request.GET.get('page_size'))
+            page = ledger.history(account_id, request.GET.get('cursor'), page_size)
+        except ValueError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = LedgerEntrySerializer(page.items, many=True)
+        return paginated_response(request, serializer.data, page.next_cursor)
+
+
+class CacheStatsView(APIView):
+    def get(self, request):
+        return Response(caching.get_stats())
+
+
+class AccountStatsView(APIView):
+    # Read from accounts.stats, so the cost does not grow with the accounts
+    def get(self, request):
+        return Response(AccountStatsSerializer(stats.get_stats()).data)
+
+
+def admitted(slots, handler):
+    """Call ``handler`` if ``slots`` has room, else answer 503 straight away."""
+    if not slots.acquire():
+        return slots.overloaded()
+    try:
+        return handler()
+    finally:
+        slots.release()
 
 
 class TransferFundsView(APIView):
+    throttle_classes = (ClientTransferThrottle, SourceAccountThrottle)
+
     def post(self, request):
+        return admitted(throttling.transfer_slots,
+                        lambda: idempotent_response(request, lambda: self.transfer(request)))
+
+    def transfer(self, request):
         from_account_id = request.data.get('from_account')
         to_account_id = request.data.get('to_account')
         amount = request.data.get('amount')
 
+        transfer = group_commit.transfer if settings.ACCOUNT_GROUP_COMMIT else transfers.transfer
         try:
-            from_account = Account.objects.get(id=from_account_id)
-            to_account = Account.objects.get(id=to_account_id)
-        except Account.DoesNotExist:
-            return Response({"detail": "Account not found."}, status=status.HTTP_404_NOT_FOUND)
+            transfer(from_account_id, to_account_id, amount)
+        except transfers.AccountNotFound as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_404_NOT_FOUND)
+        except transfers.TransferError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        except group_commit.GroupCommitUnavailable as exc:
+            response = Response({"detail": str(exc)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            response['Retry-After'] = '1'
+            return response
+
+        return Response({"detail": "Transfer successful."}, status=status.HTTP_200_OK)
+
+
+class BatchTransferView(APIView):
+    parser_classes = (JSONParser, NDJSONParser)
+    throttle_classes = (ClientTransferThrottle,)
+
+    def post(self, request):
+        return admitted(throttling.transfer_slots,
+                        lambda: idempotent_response(request, lambda: self.transfer_batch(request)))
+
+    def transfer_batch(self, request):
+        items = request.data
+        if isinstance(items, dict):
+            items = items.get('transfers')
+        if not isinstance(items, list):
+            return Response({"detail": "Expected a list of transfers."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > settings.ACCOUNT_TRANSFER_BATCH_LIMIT:
+            return Response(
+                {"detail": f"A batch may contain at most {settings.ACCOUNT_TRANSFER_BATCH_LIMIT} transfers."},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        # Validate every item first; only valid ones reach the database
+        results = [None] * len(items)
+        valid_indexes = []
+        valid_items = []
+        for index, item in enumerate(items):
+            serializer = TransferSerializer(data=item)
+            if serializer.is_valid():
+                data = serializer.validated_data
+                valid_indexes.append(index)
+                valid_items.append((data['from_account'], data['to_account'], data['amount']))
+            else:
+                results[index] = {"status": "invalid", "errors": serializer.errors}
+
+        for index, outcome in zip(valid_indexes, transfers.transfer_batch(valid_items)):
+            results[index] = {"status": outcome}
+
+        succeeded = sum(1 for result in results if result["status"] == transfers.OK)
+        return Response(
+            {
+                "succeeded": succeeded,
+                "failed": len(results) - succeeded,
+                "results": results,
+            },
+            status=status.HTTP_200_OK
+        )
 
-        if from_account_id == to_account_id:
-            return Response({"detail": "You are trying to transfer money to the same account."}, status=status.HTTP_400_BAD_REQUEST)
 
-        if amount <= 0:
-            return Response({"detail": "Amount should be greater than zero."}, status=status.HTTP_400_BAD_REQUEST)
+class ExportAccountsView(APIView):
+    # ?format=csv|ndjson (or the Accept header) picks the renderer
+    renderer_classes = (CSVRenderer, NDJSONRenderer)
 
-        # Ensure sufficient funds before transferring
-        if from_account.withdraw(amount):
-            to_account.deposit(amount)
-            return Response({"detail": "Transfer successful."}, status=status.HTTP_200_OK)
+    def get(self, request):
+        from accounts import exporter
+
+        renderer = request.accepted_renderer
+        if renderer.format == 'ndjson':
+            content = exporter.iter_ndjson()
         else:
-            return Response({"detail": "Insufficient funds."}, status=status.HTTP_400_BAD_REQUEST)
+            content = exporter.iter_csv()
+
+        response = StreamingHttpResponse(
+            content, content_type=f"{renderer.media_type}; charset={renderer.charset}")
+        response['Content-Disposition'] = f'attachment; filename="accounts.{renderer.format}"'
+        return response
 
 
 class ImportAccountsView(APIView):
     parser_classes = (MultiPartParser, FormParser)
+    throttle_classes = (ClientImportThrottle,)
 
     def post(self, request, *args, **kwargs):
+        slots = throttling.import_slots
+        if not slots.acquire():
+            return slots.overloaded()
+        try:
+            response = self.import_accounts(request)
+        except BaseException:
+            slots.release()
+            raise
+        # A queued import keeps its slot until the job finishes
+        if response.status_code != status.HTTP_202_ACCEPTED:
+            slots.release()
+        return response
+
+    def import_accounts(self, request):
+        # The CSV import machinery is only loaded by workers that import
+        from accounts import importer, jobs
+
         # Check if the 'file' key exists in the request data
         if 'file' not in request.FILES:
             return Response({"error": "No file provided."}, status=status.HTTP_400_BAD_REQUEST)
 
-        csv_file = request.FILES['file']
-        decoded_file = csv_file.read().decode('utf-8').splitlines()
-        reader = csv.reader(decoded_file)
-
-        imported_accounts = 0
-        skipped_accounts = 0
-
-        for row in reader:
-            if row[0] == 'ID':  # Skip the header row
-                continue
-
-            account_id = row[0]  # UUID
-            account_name = row[1]  # Account name
-            account_balance = row[2]  # Account balance
-
-            # Check if the account already exists, and skip if it does
-            if not Account.objects.filter(id=account_id).exists():
-                Account.objects.create(
-                    id=account_id,
-                    name=account_name,
-                    balance=account_balance
-                )
-                imported_accounts += 1
-            else:
-                skipped_accounts += 1
+        mode = request.data.get('mode', importer.INSERT)
+        if mode not in importer.MODES:
+            return Response({"error": f"mode must be one of {', '.join(importer.MODES)}."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        # Large uploads can be handed to the background import pool
+        if request.data.get('background') in ('1', 'true', 'True'):
+            job = jobs.submit_import(request.FILES['file'], mode=mode,
+                                     on_done=throttling.import_slots.release)
+            return Response(
+                {
+                    "message": "Import queued.",
+                    "job_id": str(job.id),
+                    "status_url": reverse('import_job_api', kwargs={'job_id': job.id}),
+                },
+                status=status.HTTP_202_ACCEPTED
+            )
 
+        try:
+            result = importer.import_csv(request.FILES['file'], mode=mode)
+        except importer.ImportValidationError as exc:
+            report = exc.report
+            return Response(
+                {
+                    "error": f"{report.error_count} of {report.rows} rows are invalid; nothing was imported.",
+                    "error_count": report.error_count,
+                    "errors": [{"line": error.line, "errors": error.errors} for error in report.errors],
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        counts = [f"{result.imported} accounts imported"]
+        if mode != importer.INSERT:
+            counts += [f"{result.updated} updated", f"{result.unchanged} unchanged"]
+        counts.append(f"{result.skipped} accounts skipped")
+        if mode == importer.REPLACE:
+            counts += [f"{result.deleted} deleted", f"{result.kept} kept for their transfers"]
+        message = f"Import completed. {', '.join(counts)}."
         return Response(
             {
-                "message": f"Import completed. {imported_accounts} accounts imported, {skipped_accounts} accounts skipped.",
-                "imported": imported_accounts,
-                "skipped": skipped_accounts
+                "message": message,
+                **dataclasses.asdict(result),
             },
             status=status.HTTP_201_CREATED
         )
+
+
+class ImportJobDetailView(APIView):
+    def get(self, request, job_id):
+        from accounts import jobs
+
+        try:
+            job = ImportJob.objects.get(id=job_id)
+        except ImportJob.DoesNotExist:
+            return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+        if jobs.is_abandoned(job) and jobs.fail_abandoned_jobs([job.id]):
+            job.refresh_from_db()
+
+        serializer = ImportJobSerializer(job)
+        return Response(serializer.data)
@@ -0,0 +1,71 @@
+"""Load test of the sync and async account API views under ASGI.
+
+Requests go through Django's ASGI handler in process (``AsyncClient``),
+with ``--concurrency`` requests in flight at a time. The cache is
+disabled so both variants hit the database::
+
+    python -m benchmarks.bench_async --requests 2000 --concurrency 50
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from benchmarks.common import percentile, seed_accounts, setup_django
+
+DUMMY_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+
+async def run_load(client, paths, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(path):
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.get(path)
+            latencies.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.content
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(path) for path in paths))
+    return time.perf_counter() - start, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--accounts', type=int, default=10_000)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    args = parser.parse_args()
+
+    setup_django(CACHES=DUMMY_CACHE)
+    from django.test import AsyncClient
+    from django.urls import reverse
+
+    ids = seed_accounts(args.accounts)
+    rng = random.Random(0)
+    sample = [rng.choice(ids) for _ in range(args.requests)]
+    scenarios = {
+        'detail': lambda name: [reverse(name, kwargs={'account_id': account_id})
+                                for account_id in sample],
+        'list': lambda name: [reverse(name)] * args.requests,
+    }
+    views = {
+        'detail': ('account_detail_api', 'account_detail_async_api'),
+        'list': ('account_list_api', 'account_list_async_api'),
+    }
+
+    client = AsyncClient()
+    print(f'{"endpoint":>8} {"view":>6} {"req/s":>9} {"p50 ms":>8} {"p99 ms":>8}')
+    for scenario, build_paths in scenarios.items():
+        for label, name in zip(('sync', 'async'), views[scenario]):
+            elapsed, latencies = asyncio.run(
+                run_load(client, build_paths(name), args.concurrency))
+            print(f'{scenario:>8} {label:>6} {len(latencies) / elapsed:>9.0f} '
+                  f'{percentile(latencies, 50) * 1000:>8.2f} '
+                  f'{percentile(latencies, 99) * 1000:>8.2f}')
+
+
+if __name__ == '__main__':
+    main()
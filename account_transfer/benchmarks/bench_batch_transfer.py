@@ -0,0 +1,53 @@
+"""Compare N calls to /api/accounts/transfer/ with one batch call.
+
+Both variants run the same random transfers over the same seeded
+accounts, in process through the WSGI handler::
+
+    python -m benchmarks.bench_batch_transfer --accounts 10000 --transfers 10000
+"""
+import argparse
+import random
+import time
+
+from benchmarks.common import api_client, seed_accounts, setup_django
+
+
+def make_transfers(ids, count, seed=0):
+    rng = random.Random(seed)
+    return [{
+        'from_account': str(from_id),
+        'to_account': str(to_id),
+        'amount': f'{rng.randint(1, 10000) / 100:.2f}',
+    } for from_id, to_id in (rng.sample(ids, 2) for _ in range(count))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--accounts', type=int, default=10_000)
+    parser.add_argument('--transfers', type=int, default=10_000)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.urls import reverse
+
+    ids = seed_accounts(args.accounts)
+    items = make_transfers(ids, args.transfers)
+    client = api_client()
+
+    start = time.perf_counter()
+    for item in items:
+        client.post(reverse('transfer_funds_api'), item, format='json')
+    single = time.perf_counter() - start
+
+    start = time.perf_counter()
+    response = client.post(reverse('batch_transfer_api'), items, format='json')
+    batch = time.perf_counter() - start
+    assert response.status_code == 200, response.content
+
+    print(f'{args.transfers} transfers over {args.accounts} accounts')
+    print(f'single calls: {single:8.3f}s  {args.transfers / single:10.0f} transfers/sec')
+    print(f'one batch:    {batch:8.3f}s  {args.transfers / batch:10.0f} transfers/sec')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Polling clients with and without conditional requests.
+
+Each round polls the first list page and the detail of a few accounts.
+Every ``--write-every`` rounds a transfer changes two accounts. The
+``conditional`` variant sends back the ETag it last saw, as a polling
+client would; ``unconditional`` downloads everything every time. Both run
+with the default cache, so unchanged payloads are cache hits either way.
+``--no-cache`` swaps in a dummy cache, as when each worker has its own::
+
+    python -m benchmarks.bench_conditional --rounds 500
+"""
+import argparse
+import random
+import time
+
+from benchmarks.common import api_client, seed_accounts, setup_django
+
+
+def poll(client, urls, rounds, write_every, ids, conditional, seed=0):
+    """Poll ``urls`` and return per-request CPU time, bytes and 304 share."""
+    from accounts import transfers
+
+    rng = random.Random(seed)
+    etags = {}
+    cpu = {url: 0.0 for url in urls}
+    received = {url: 0 for url in urls}
+    not_modified = {url: 0 for url in urls}
+    for round_number in range(rounds):
+        if round_number % write_every == write_every - 1:
+            from_id, to_id = rng.sample(ids, 2)
+            transfers.transfer(from_id, to_id, '0.001')
+        for url in urls:
+            headers = {}
+            if conditional and url in etags:
+                headers['HTTP_IF_NONE_MATCH'] = etags[url]
+            start = time.process_time()
+            response = client.get(url, **headers)
+            cpu[url] += time.process_time() - start
+            assert response.status_code in (200, 304), response.status_code
+            etags[url] = response['ETag']
+            received[url] += len(response.content)
+            not_modified[url] += response.status_code == 304
+    requests = rounds * len(urls)
+    return {
+        'cpu_us': sum(cpu.values()) / requests * 1e6,
+        'bytes': sum(received.values()) / requests,
+        'not_modified': sum(not_modified.values()) / requests,
+        'list_cpu_us': cpu[urls[0]] / rounds * 1e6,
+        'list_bytes': received[urls[0]] / rounds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--accounts', type=int, default=10_000)
+    parser.add_argument('--rounds', type=int, default=500)
+    parser.add_argument('--details', type=int, default=5,
+                        help='accounts whose detail is polled every round')
+    parser.add_argument('--write-every', type=int, default=10)
+    parser.add_argument('--no-cache', action='store_true')
+    args = parser.parse_args()
+
+    overrides = {}
+    if args.no_cache:
+        overrides['CACHES'] = {'default': {
+            'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+    setup_django(**overrides)
+    from django.urls import reverse
+
+    ids = seed_accounts(args.accounts)
+    client = api_client()
+    urls = [reverse('account_list_api')] + [
+        reverse('account_detail_api', kwargs={'account_id': account_id})
+        for account_id in ids[:args.details]]
+
+    results = {}
+    for variant in ('unconditional', 'conditional'):
+        results[variant] = stats = poll(
+            client, urls, args.rounds, args.write_every, ids[:args.details],
+            conditional=variant == 'conditional')
+        print(f'{variant:>13}: {stats["cpu_us"]:8.0f} us CPU/request, '
+              f'{stats["bytes"]:8.0f} bytes/request, {stats["not_modified"]:.0%} 304; '
+              f'list page {stats["list_cpu_us"]:8.0f} us, {stats["list_bytes"]:8.0f} bytes')
+
+    before, after = results['unconditional'], results['conditional']
+    print(f'saved {1 - after["bytes"] / before["bytes"]:.0%} of bytes and '
+          f'{1 - after["cpu_us"] / before["cpu_us"]:.0%} of CPU')
+
+
+if __name__ == '__main__':
+    main()
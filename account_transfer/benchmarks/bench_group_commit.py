@@ -0,0 +1,106 @@
+"""Concurrent single transfers: one commit each vs group commit.
+
+Each variant runs in its own process against its own database file.
+``--threads`` threads each run ``--transfers`` random transfers, through
+:func:`accounts.transfers.transfer` (``direct``) or
+:func:`accounts.group_commit.transfer` (``group``). ``--wait-ms`` and
+``--max-items`` configure the group writer. Both variants check that the
+total balance is unchanged afterwards::
+
+    python -m benchmarks.bench_group_commit --threads 32 --wait-ms 2
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+from benchmarks.common import PROJECT_DIR, percentile, seed_accounts, setup_django
+
+VARIANTS = ('direct', 'group')
+
+
+def run_variant(variant, args):
+    setup_django(ACCOUNT_GROUP_COMMIT_WAIT_MS=args.wait_ms,
+                 ACCOUNT_GROUP_COMMIT_MAX_ITEMS=args.max_items)
+    from django.db import connection
+    from django.db.models import Sum
+
+    from accounts import group_commit, transfers
+    from accounts.models import Account
+
+    transfer = group_commit.transfer if variant == 'group' else transfers.transfer
+    ids = seed_accounts(args.accounts)
+    total = Account.objects.aggregate(total=Sum('balance'))['total']
+    latencies = []
+    refused = [0]
+    lock = threading.Lock()
+
+    def worker(seed):
+        rng = random.Random(seed)
+        try:
+            for _ in range(args.transfers):
+                from_id, to_id = rng.sample(ids, 2)
+                start = time.perf_counter()
+                try:
+                    transfer(from_id, to_id, '0.01')
+                except transfers.InsufficientFunds:
+                    with lock:
+                        refused[0] += 1
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=worker, args=(seed,))
+               for seed in range(args.threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    assert Account.objects.aggregate(total=Sum('balance'))['total'] == total, 'money was lost'
+    stats = {
+        'variant': variant,
+        'transfers': len(latencies),
+        'refused': refused[0],
+        'transfers_per_sec': round(len(latencies) / elapsed),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+    }
+    if variant == 'group':
+        writer = group_commit.get_writer()
+        stats['mean_group_size'] = round(writer.items / max(writer.groups, 1), 1)
+    print(json.dumps(stats))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--accounts', type=int, default=1000)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--transfers', type=int, default=100)
+    parser.add_argument('--wait-ms', type=float, default=2)
+    parser.add_argument('--max-items', type=int, default=500)
+    parser.add_argument('--variant', choices=VARIANTS)
+    args = parser.parse_args()
+
+    if args.variant:
+        run_variant(args.variant, args)
+        return
+
+    for variant in VARIANTS:
+        subprocess.run(
+            [sys.executable, '-m', 'benchmarks.bench_group_commit', '--variant', variant,
+             '--accounts', str(args.accounts), '--threads', str(args.threads),
+             '--transfers', str(args.transfers), '--wait-ms', str(args.wait_ms),
+             '--max-items', str(args.max_items)],
+            cwd=PROJECT_DIR, check=True, env={**os.environ, 'DB_ENGINE': 'sqlite'})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Compare the batched importer with the original per-row import loop.
+
+Each variant runs in its own subprocess against its own database so the
+reported peak RSS belongs to that variant alone::
+
+    python -m benchmarks.bench_import --rows 1000000
+"""
+import argparse
+import csv
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import PROJECT_DIR, peak_rss_mb, setup_django, write_accounts_csv
+
+
+def legacy_import(path):
+    """The pre-importer loop: whole file in memory, two queries per row."""
+    from accounts.models import Account
+
+    with open(path, 'rb') as csv_file:
+        decoded_file = csv_file.read().decode('utf-8').splitlines()
+    imported = skipped = 0
+    for row in csv.reader(decoded_file):
+        if row[0] == 'ID':
+            continue
+        if not Account.objects.filter(id=row[0]).exists():
+            Account.objects.create(id=row[0], name=row[1], balance=row[2])
+            imported += 1
+        else:
+            skipped += 1
+    return imported, skipped
+
+
+def bulk_import(path):
+    from accounts import importer
+
+    with open(path, 'rb') as csv_file:
+        result = importer.import_csv(csv_file)
+    return result.imported, result.skipped
+
+
+VARIANTS = {'legacy': legacy_import, 'bulk': bulk_import}
+
+
+def run_variant(variant, path):
+    setup_django()
+    start = time.perf_counter()
+    imported, skipped = VARIANTS[variant](path)
+    elapsed = time.perf_counter() - start
+    rows = imported + skipped
+    print(json.dumps({
+        'variant': variant,
+        'rows': rows,
+        'imported': imported,
+        'seconds': round(elapsed, 3),
+        'rows_per_sec': round(rows / elapsed),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--variant', choices=VARIANTS)
+    parser.add_argument('--csv', help='use an existing CSV instead of generating one')
+    args = parser.parse_args()
+
+    path = args.csv
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(), 'accounts.csv')
+        write_accounts_csv(path, args.rows)
+
+    if args.variant:
+        run_variant(args.variant, path)
+        return
+
+    for variant in VARIANTS:
+        subprocess.run(
+            [sys.executable, '-m', 'benchmarks.bench_import',
+             '--variant', variant, '--csv', path],
+            cwd=PROJECT_DIR, check=True)
+
+
+if __name__ == '__main__':
+    main()
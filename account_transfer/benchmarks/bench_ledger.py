@@ -0,0 +1,56 @@
+"""Overhead of the transfer journal on /api/accounts/transfer/.
+
+The same sequence of transfers is posted with journaling on and with
+``ledger.record`` stubbed out, alternating rounds to even out noise::
+
+    python -m benchmarks.bench_ledger --transfers 5000
+"""
+import argparse
+import time
+from unittest import mock
+
+from benchmarks.bench_batch_transfer import make_transfers
+from benchmarks.common import api_client, seed_accounts, setup_django
+
+# The journal may cost at most this share of transfer throughput
+MAX_OVERHEAD = 0.15
+
+
+def run(client, url, items):
+    start = time.perf_counter()
+    for item in items:
+        client.post(url, item, format='json')
+    return len(items) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--accounts', type=int, default=10_000)
+    parser.add_argument('--transfers', type=int, default=5000)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.urls import reverse
+
+    ids = seed_accounts(args.accounts)
+    client = api_client()
+    url = reverse('transfer_funds_api')
+
+    journaled, bare = [], []
+    for round_number in range(args.rounds):
+        items = make_transfers(ids, args.transfers, seed=round_number)
+        journaled.append(run(client, url, items))
+        with mock.patch('accounts.ledger.record'):
+            bare.append(run(client, url, items))
+
+    with_journal, without_journal = max(journaled), max(bare)
+    overhead = 1 - with_journal / without_journal
+    print(f'without journal: {without_journal:8.0f} transfers/sec')
+    print(f'with journal:    {with_journal:8.0f} transfers/sec')
+    print(f'overhead:        {overhead:8.1%} (bound {MAX_OVERHEAD:.0%}) '
+          f'{"OK" if overhead <= MAX_OVERHEAD else "EXCEEDED"}')
+
+
+if __name__ == '__main__':
+    main()
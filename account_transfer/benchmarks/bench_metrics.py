@@ -0,0 +1,65 @@
+"""Overhead of MetricsMiddleware on the transfer and detail endpoints.
+
+Each transfer and detail request is sent twice, through a client with the
+middleware and one without, and the median times are compared::
+
+    python -m benchmarks.bench_metrics --requests 5000
+"""
+import argparse
+import statistics
+import time
+
+from benchmarks.bench_batch_transfer import make_transfers
+from benchmarks.common import api_client, seed_accounts, setup_django
+
+METRICS_MIDDLEWARE = 'account_transfer.metrics.MetricsMiddleware'
+
+# The middleware may cost at most this share of request throughput
+MAX_OVERHEAD = 0.03
+
+
+def timed(request, *args, **kwargs):
+    start = time.perf_counter()
+    request(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--accounts', type=int, default=10_000)
+    parser.add_argument('--requests', type=int, default=5000)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from django.test import modify_settings
+    from django.urls import reverse
+
+    assert METRICS_MIDDLEWARE in settings.MIDDLEWARE
+    ids = seed_accounts(args.accounts)
+    transfer_url = reverse('transfer_funds_api')
+
+    instrumented_client = api_client()
+    bare_client = api_client()
+    # Clients load the middleware on their first request
+    instrumented_client.get(reverse('account_list_api'))
+    with modify_settings(MIDDLEWARE={'remove': METRICS_MIDDLEWARE}):
+        bare_client.get(reverse('account_list_api'))
+
+    instrumented, bare = [], []
+    for item in make_transfers(ids, args.requests // 2):
+        # The transfer just moved this account's version, so neither client hits the cache
+        detail_url = reverse('account_detail_api', kwargs={'account_id': item['from_account']})
+        for client, times in ((instrumented_client, instrumented), (bare_client, bare)):
+            times.append(timed(client.post, transfer_url, item, format='json')
+                         + timed(client.get, detail_url))
+
+    with_metrics, without_metrics = statistics.median(instrumented), statistics.median(bare)
+    overhead = with_metrics / without_metrics - 1
+    print(f'without metrics: {without_metrics * 1000:8.3f} ms per transfer + detail')
+    print(f'with metrics:    {with_metrics * 1000:8.3f} ms per transfer + detail')
+    print(f'overhead:        {overhead:8.1%} (bound {MAX_OVERHEAD:.0%}) '
+          f'{"OK" if overhead <= MAX_OVERHEAD else "EXCEEDED"}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""Transfer endpoint under overload, with and without admission control.
+
+``--clients`` threads, each with its own client address, post transfers
+to ``/api/accounts/transfer/`` for ``--seconds``. A rejected client waits
+as long as ``Retry-After`` says and tries again. ``open`` runs without limits,
+so every request waits its turn on the database. ``admission`` gives each
+client a token bucket of ``--client-rate`` per second and caps the
+transfers in progress at ``--max-concurrent``. Each variant runs in its
+own process against its own database file::
+
+    python -m benchmarks.bench_overload --clients 64 --seconds 10
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+from benchmarks.common import PROJECT_DIR, api_client, percentile, seed_accounts, setup_django
+
+VARIANTS = ('open', 'admission')
+
+
+def run_variant(variant, args):
+    overrides = {}
+    if variant == 'admission':
+        overrides = {
+            'ACCOUNT_THROTTLE_RATES': {
+                'transfer_client': (args.client_rate, args.client_rate)},
+            'ACCOUNT_TRANSFER_MAX_CONCURRENT': args.max_concurrent,
+        }
+    setup_django(**overrides)
+    from django.db import connection
+    from django.urls import reverse
+
+    ids = [str(account_id) for account_id in seed_accounts(args.accounts)]
+    url = reverse('transfer_funds_api')
+    admitted, rejected, failed = [], [], [0]
+    statuses = {}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.seconds
+
+    def client(number):
+        rng = random.Random(number)
+        http = api_client()
+        # Count server errors (e.g. "database is locked") instead of raising them
+        http.raise_request_exception = False
+        address = f'10.0.{number // 256}.{number % 256}'
+        try:
+            while time.perf_counter() < deadline:
+                from_id, to_id = rng.sample(ids, 2)
+                start = time.perf_counter()
+                response = http.post(url, {'from_account': from_id, 'to_account': to_id,
+                                           'amount': '0.01'},
+                                     format='json', REMOTE_ADDR=address)
+                latency = time.perf_counter() - start
+                with lock:
+                    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                    if response.status_code in (200, 400):
+                        admitted.append(latency)
+                    elif response.status_code in (429, 503):
+                        rejected.append(latency)
+                    else:
+                        failed[0] += 1
+                if response.status_code in (429, 503):
+                    time.sleep(float(response['Retry-After']))
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=client, args=(number,)) for number in range(args.clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    print(json.dumps({
+        'variant': variant,
+        'admitted_per_sec': round(len(admitted) / elapsed),
+        'admitted_p50_ms': round(percentile(admitted, 50) * 1000, 2),
+        'admitted_p99_ms': round(percentile(admitted, 99) * 1000, 2),
+        'admitted_max_ms': round(max(admitted, default=0) * 1000, 2),
+        'rejected_per_sec': round(len(rejected) / elapsed),
+        'rejected_p99_ms': round(percentile(rejected, 99) * 1000, 2),
+        'failed': failed[0],
+        'statuses': statuses,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--accounts', type=int, default=1000)
+    parser.add_argument('--clients', type=int, default=64)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--client-rate', type=float, default=5,
+                        help='admitted transfers per second per client')
+    parser.add_argument('--max-concurrent', type=int, default=8)
+    parser.add_argument('--variant', choices=VARIANTS)
+    args = parser.parse_args()
+
+    if args.variant:
+        run_variant(args.variant, args)
+        return
+
+    for variant in VARIANTS:
+        subprocess.run(
+            [sys.executable, '-m', 'benchmarks.bench_overload', '--variant', variant,
+             '--accounts', str(args.accounts), '--clients', str(args.clients),
+             '--seconds', str(args.seconds), '--client-rate', str(args.client_rate),
+             '--max-concurrent', str(args.max_concurrent)],
+            cwd=PROJECT_DIR, check=True, env={**os.environ, 'DB_ENGINE': 'sqlite'})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""Name search latency: icontains scan versus the token index.
+
+The table is grown step by step and, at each size, the first page of a
+few typical navbar searches is timed with both strategies::
+
+    python -m benchmarks.bench_search --sizes 10000 100000 1000000
+"""
+import argparse
+import statistics
+import time
+
+from benchmarks.common import seed_accounts, setup_django
+
+QUERIES = ['rice', 'bry', 'joy dean', 'an', 'zzyzx']
+
+
+def time_query(build_queryset, repeat):
+    from accounts import pagination
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        pagination.paginate(build_queryset())
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    setup_django()
+    from accounts import search
+    from accounts.models import Account
+
+    print(f'{"accounts":>10} {"query":>10} {"icontains ms":>13} {"token ms":>9}')
+    seeded = 0
+    for step, size in enumerate(sorted(args.sizes)):
+        seed_accounts(size - seeded, seed=step)
+        seeded = size
+        for query in QUERIES:
+            scan = time_query(
+                lambda: Account.objects.filter(name__icontains=query), args.repeat)
+            indexed = time_query(
+                lambda: search.search_accounts(query), args.repeat)
+            print(f'{size:>10} {query:>10} {scan:>13.2f} {indexed:>9.2f}')
+
+
+if __name__ == '__main__':
+    main()
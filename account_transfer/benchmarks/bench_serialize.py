@@ -0,0 +1,74 @@
+"""Account list serialization: ``ModelSerializer`` vs the lean row encoder.
+
+Loads ``--rows`` accounts once per variant, then times turning them into
+JSON bytes and traces the memory that allocates. Loading is timed
+separately, because the lean path also reads tuples instead of model
+instances::
+
+    python -m benchmarks.bench_serialize --rows 10000
+"""
+import argparse
+import statistics
+import time
+import tracemalloc
+
+from benchmarks.common import seed_accounts, setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=10_000)
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    setup_django()
+    from rest_framework.renderers import JSONRenderer
+
+    from accounts.models import Account
+    from api.accounts.serializers import (
+        AccountSerializer, account_columns, account_dicts, account_rows, encode_accounts,
+    )
+
+    seed_accounts(args.rows)
+    renderer = JSONRenderer()
+    queryset = Account.objects.order_by('name', 'id')
+
+    variants = {
+        'serializer': (
+            lambda: list(queryset.all()),
+            lambda accounts: renderer.render(AccountSerializer(accounts, many=True).data)),
+        'lean': (
+            lambda: list(account_rows(queryset)),
+            lambda rows: renderer.render(account_dicts(encode_accounts(rows)))),
+        'columns': (
+            lambda: list(account_rows(queryset)),
+            lambda rows: renderer.render(account_columns(encode_accounts(rows)))),
+    }
+
+    outputs = {}
+    for name, (load, serialize) in variants.items():
+        load_times, times = [], []
+        for _ in range(args.rounds):
+            start = time.perf_counter()
+            items = load()
+            load_times.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            outputs[name] = serialize(items)
+            times.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        serialize(items)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        per_10k = 10_000 / args.rows
+        print(f'{name:>10}: serialize {statistics.median(times) * per_10k * 1000:7.2f} ms, '
+              f'load {statistics.median(load_times) * per_10k * 1000:7.2f} ms, '
+              f'peak alloc {peak * per_10k / 2**20:6.2f} MiB per 10k rows, '
+              f'{len(outputs[name]) * per_10k / 2**20:5.2f} MiB of JSON')
+
+    assert outputs['lean'] == outputs['serializer'], 'lean JSON differs from the serializer'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""Startup time and requests/sec of ``runserver`` compared with gunicorn.
+
+Both servers run as subprocesses against the same seeded database. Startup
+is timed from launch until the first response. Then ``--clients`` threads
+each send ``--requests`` requests, split between the list and detail
+endpoints::
+
+    python -m benchmarks.bench_server --clients 16
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from benchmarks.common import PROJECT_DIR, percentile, seed_accounts, setup_django
+
+SERVERS = {
+    'runserver': [sys.executable, 'manage.py', 'runserver', '--noreload'],
+    'gunicorn': [sys.executable, '-m', 'gunicorn'],
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(server, url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f'server exited with status {server.returncode}')
+        try:
+            urllib.request.urlopen(url).read()
+            return
+        except urllib.error.HTTPError:
+            raise
+        except OSError:
+            time.sleep(0.02)
+    raise RuntimeError(f'server did not answer {url} within {timeout}s')
+
+
+def drive(base_url, ids, clients, requests):
+    latencies = []
+    lock = threading.Lock()
+
+    def client(seed):
+        rng = random.Random(seed)
+        for i in range(requests):
+            path = (f'/api/accounts/{rng.choice(ids)}/' if i % 2
+                    else '/api/accounts/')
+            start = time.perf_counter()
+            urllib.request.urlopen(base_url + path).read()
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client, args=(seed,))
+               for seed in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(latencies) / (time.perf_counter() - start), latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--accounts', type=int, default=10000)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    db_name = setup_django()
+    ids = [str(account_id) for account_id in seed_accounts(args.accounts)]
+
+    for name, command in SERVERS.items():
+        port = free_port()
+        env = {**os.environ, 'DB_NAME': db_name, 'PORT': str(port),
+               'DJANGO_DEBUG': '0', 'DJANGO_ALLOWED_HOSTS': '127.0.0.1'}
+        if name == 'runserver':
+            command = command + [f'127.0.0.1:{port}']
+        base_url = f'http://127.0.0.1:{port}'
+
+        start = time.perf_counter()
+        server = subprocess.Popen(command, cwd=PROJECT_DIR, env=env,
+                                  stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL)
+        try:
+            wait_until_up(server, base_url + '/api/accounts/')
+            startup = time.perf_counter() - start
+            rate, latencies = drive(base_url, ids, args.clients, args.requests)
+        finally:
+            server.terminate()
+            server.wait()
+
+        print(json.dumps({
+            'server': name,
+            'startup_s': round(startup, 2),
+            'requests_per_sec': round(rate),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        }))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Concurrent credits to one hot account, by shard count.
+
+``--threads`` threads each credit the same account ``--credits`` times
+through :func:`accounts.transfers.transfer`, for each shard count in
+``--shards`` (0 is an unsharded account). ``--hold-ms`` keeps each
+transaction open a little longer after its credit, like a request that
+does more work before committing. A row lock is held until commit, so that
+is what makes the hot row the bottleneck.
+
+On PostgreSQL (``DB_ENGINE=postgresql``) unsharded credits queue on the
+account's row lock, and throughput grows with the number of shards. SQLite
+has a single database-wide write lock, so sharding cannot help there and
+the numbers stay flat::
+
+    DB_ENGINE=postgresql python -m benchmarks.bench_shards --threads 16
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+from decimal import Decimal
+
+from benchmarks.common import percentile, setup_django
+
+
+def run(shard_count, source_ids, hot_id, args):
+    from django.db import OperationalError, connection, transaction
+
+    from accounts import sharding, transfers
+
+    sharding.set_shard_count(hot_id, shard_count)
+    latencies = []
+    locked = [0]
+    lock = threading.Lock()
+
+    def worker(source_id):
+        try:
+            for _ in range(args.credits):
+                start = time.perf_counter()
+                try:
+                    with transaction.atomic():
+                        transfers.transfer(source_id, hot_id, '0.001')
+                        time.sleep(args.hold_ms / 1000)
+                except OperationalError as exc:
+                    if 'locked' not in str(exc):
+                        raise
+                    with lock:
+                        locked[0] += 1
+                    continue
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=worker, args=(source_id,)) for source_id in source_ids]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return {
+        'shards': shard_count,
+        'ok': len(latencies),
+        'locked': locked[0],
+        'credits_per_sec': round(len(latencies) / elapsed),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--credits', type=int, default=100, help='credits per thread')
+    parser.add_argument('--hold-ms', type=float, default=2.0)
+    parser.add_argument('--shards', default='0,1,2,4,8,16')
+    args = parser.parse_args()
+
+    setup_django()
+    from accounts.models import Account
+
+    # Every thread debits its own account, so only the credits contend
+    sources = Account.objects.bulk_create(
+        [Account(id=uuid.uuid4(), name=f'Bench source {i}', balance=Decimal(1000))
+         for i in range(args.threads)])
+    hot = Account.objects.create(id=uuid.uuid4(), name='Bench hot account', balance=0)
+    source_ids = [account.id for account in sources]
+
+    results = [run(int(shard_count), source_ids, hot.id, args)
+               for shard_count in args.shards.split(',')]
+    for stats in results:
+        print(json.dumps(stats))
+    base = results[0]['credits_per_sec'] or 1
+    print('throughput vs first: ' + ', '.join(
+        f"{stats['shards']} shards {stats['credits_per_sec'] / base:.2f}x" for stats in results))
+
+    credited = Account.objects.get(id=hot.id).total_balance
+    expected = sum(stats['ok'] for stats in results) * Decimal('0.001')
+    assert credited == expected, f'hot account has {credited}, expected {expected}'
+
+
+if __name__ == '__main__':
+    main()
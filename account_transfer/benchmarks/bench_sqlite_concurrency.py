@@ -0,0 +1,142 @@
+"""Concurrent transfers against SQLite: a stock setup vs the tuned profile.
+
+Each variant runs in its own process against its own database file.
+``--threads`` threads each run ``--transfers`` random transfers. A
+transfer that fails with "database is locked" is counted and not retried.
+
+``default`` is what an app on stock Django settings does: a rollback
+journal, DEFERRED transactions, the default 5s busy timeout, and a
+transfer that reads both balances and then writes them. Two such
+transactions can both hold a read lock and then both want the write lock,
+and SQLite fails one of them at once rather than wait. It skips the
+journal and the statistics, so each transfer does less work than in
+``tuned``. ``tuned`` is the shipped profile running
+:func:`accounts.transfers.transfer`. The variants are printed side by
+side at the end::
+
+    python -m benchmarks.bench_sqlite_concurrency --threads 16
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.common import PROJECT_DIR, percentile, seed_accounts, setup_django
+
+VARIANTS = ('default', 'tuned')
+COLUMNS = ('variant', 'ok', 'locked', 'transfers_per_sec', 'p50_ms', 'p99_ms')
+
+
+def read_then_write_transfer(from_id, to_id, amount):
+    """A transfer that reads the balances first, as code without conditional updates does."""
+    from decimal import Decimal
+
+    from django.db import transaction
+
+    from accounts import transfers
+    from accounts.models import Account
+
+    amount = Decimal(amount)
+    with transaction.atomic():
+        balances = dict(Account.objects.filter(id__in=[from_id, to_id])
+                        .values_list('id', 'balance'))
+        if balances[from_id] < amount:
+            raise transfers.InsufficientFunds("Insufficient funds.")
+        Account.objects.filter(id=from_id).update(balance=balances[from_id] - amount)
+        Account.objects.filter(id=to_id).update(balance=balances[to_id] + amount)
+
+
+def run_variant(variant, args):
+    db_name = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+    overrides = {}
+    if variant == 'default':
+        # Stock Django SQLite: rollback journal, deferred transactions, 5s timeout
+        overrides['DATABASES'] = {'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': db_name,
+        }}
+    setup_django(db_name, **overrides)
+    from django.db import OperationalError, connection
+
+    from accounts import transfers
+
+    transfer = read_then_write_transfer if variant == 'default' else transfers.transfer
+    ids = seed_accounts(args.accounts)
+    latencies = []
+    locked = [0]
+    lock = threading.Lock()
+
+    def worker(seed):
+        rng = random.Random(seed)
+        try:
+            for _ in range(args.transfers):
+                from_id, to_id = rng.sample(ids, 2)
+                start = time.perf_counter()
+                try:
+                    transfer(from_id, to_id, '0.01')
+                except transfers.InsufficientFunds:
+                    pass
+                except OperationalError as exc:
+                    if 'locked' not in str(exc):
+                        raise
+                    with lock:
+                        locked[0] += 1
+                    continue
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=worker, args=(seed,))
+               for seed in range(args.threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    print(json.dumps({
+        'variant': variant,
+        'ok': len(latencies),
+        'locked': locked[0],
+        'transfers_per_sec': round(len(latencies) / elapsed),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--accounts', type=int, default=1000)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--transfers', type=int, default=200)
+    parser.add_argument('--variant', choices=VARIANTS)
+    args = parser.parse_args()
+
+    if args.variant:
+        run_variant(args.variant, args)
+        return
+
+    results = []
+    for variant in VARIANTS:
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.bench_sqlite_concurrency',
+             '--variant', variant, '--accounts', str(args.accounts),
+             '--threads', str(args.threads), '--transfers', str(args.transfers)],
+            cwd=PROJECT_DIR, check=True, capture_output=True, text=True,
+            env={**os.environ, 'DB_ENGINE': 'sqlite'}).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(''.join(f'{column:>18}' for column in COLUMNS))
+    for result in results:
+        print(''.join(f'{result[column]:>18}' for column in COLUMNS))
+
+
+if __name__ == '__main__':
+    main()
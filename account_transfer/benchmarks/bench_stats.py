@@ -0,0 +1,108 @@
+"""/api/accounts/stats/ compared with aggregating every account per request.
+
+For each size in ``--sizes`` the accounts are seeded, the statistics table
+is rebuilt, and the median latency of the endpoint is compared with a scan
+that computes the same figures from ``accounts_account``. Both results are
+checked to agree. Then it measures what keeping the table current costs
+transfers, posting the same transfers with ``accounts.stats`` recording and
+with it stubbed out, in alternating rounds::
+
+    python -m benchmarks.bench_stats --sizes 10000,100000
+"""
+import argparse
+import statistics
+import time
+from decimal import Decimal
+from unittest import mock
+
+from benchmarks.bench_batch_transfer import make_transfers
+from benchmarks.common import api_client, seed_accounts, setup_django
+
+
+def scan():
+    """The figures of accounts.stats, computed from every account."""
+    from django.conf import settings
+    from django.db import models
+    from django.db.models import Case, Value, When
+
+    from accounts.models import Account, quantize_balance, total_balance
+
+    bounds = settings.ACCOUNT_STATS_BUCKETS
+    balances = Account.objects.annotate(balance_total=total_balance())
+    totals = balances.aggregate(
+        accounts=models.Count('id'), total=models.Sum('balance_total'),
+        lowest=models.Min('balance_total'), highest=models.Max('balance_total'))
+    bucket = Case(*[When(balance_total__lt=upper, then=Value(index))
+                    for index, upper in enumerate(bounds[1:])],
+                  default=Value(len(bounds) - 1))
+    # SQLite sums decimals as floats
+    totals['total'] = quantize_balance(totals['total'])
+    histogram = dict(balances.annotate(bucket=bucket).order_by().values('bucket')
+                     .annotate(accounts=models.Count('id')).values_list('bucket', 'accounts'))
+    return totals, [histogram.get(index, 0) for index in range(len(bounds))]
+
+
+def timed(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), result
+
+
+def transfers_per_sec(client, url, items):
+    start = time.perf_counter()
+    for item in items:
+        client.post(url, item, format='json')
+    return len(items) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default='10000,100000')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--transfers', type=int, default=2000)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.urls import reverse
+
+    from accounts import stats
+    from accounts.models import Account
+
+    client = api_client()
+    stats_url = reverse('account_stats_api')
+    seeded = 0
+    ids = []
+    for size in map(int, args.sizes.split(',')):
+        # seed_accounts bulk inserts, which accounts.stats does not see
+        ids += seed_accounts(size - seeded, seed=size)
+        seeded = size
+        stats.rebuild()
+
+        endpoint, response = timed(lambda: client.get(stats_url), args.repeat)
+        full, (totals, histogram) = timed(scan, args.repeat)
+        data = response.json()
+        assert data['accounts'] == totals['accounts'] == Account.objects.count()
+        assert Decimal(data['total_balance']) == totals['total']
+        assert [bucket['accounts'] for bucket in data['histogram']] == histogram
+        print(f'{size:>9} accounts: endpoint {endpoint * 1000:8.2f}ms, '
+              f'full scan {full * 1000:8.2f}ms ({full / endpoint:.0f}x)')
+
+    url = reverse('transfer_funds_api')
+    recorded, bare = [], []
+    for round_number in range(args.rounds):
+        items = make_transfers(ids, args.transfers, seed=round_number)
+        recorded.append(transfers_per_sec(client, url, items))
+        with mock.patch('accounts.stats.record'), mock.patch('accounts.stats.record_accounts'):
+            bare.append(transfers_per_sec(client, url, items))
+    with_stats, without_stats = max(recorded), max(bare)
+    print(f'transfers without stats: {without_stats:8.0f}/sec')
+    print(f'transfers with stats:    {with_stats:8.0f}/sec '
+          f'({1 - with_stats / without_stats:.1%} overhead)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""Micro-benchmarks of every account endpoint, saved as a JSON baseline.
+
+Each case is timed for a fixed number of rounds after a warmup round, at
+every size in ``--sizes``. The database grows from one size to the next. The
+cache is swapped for a dummy backend, so every request does its full
+database work. Save a baseline, then compare a later commit against it::
+
+    python -m benchmarks.bench_suite --save baseline.json
+    python -m benchmarks.bench_suite --compare baseline.json
+
+``--compare`` prints the change in median time of each case. It exits
+with status 1 if any case is more than ``--threshold`` slower.
+"""
+import argparse
+import io
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.bench_batch_transfer import make_transfers
+from benchmarks.common import (
+    PROJECT_DIR, api_client, generate_accounts, seed_accounts, setup_django,
+)
+
+DEFAULT_SIZES = (10_000, 100_000)
+
+
+def make_cases(client, ids, rng):
+    """Return ``{name: (callable, rounds)}`` for the current data set."""
+    from django.db import transaction
+    from django.urls import reverse
+
+    def get(url, params=None):
+        response = client.get(url, params)
+        assert response.status_code == 200, (url, response.status_code)
+        return response
+
+    def detail():
+        get(reverse('account_detail_api', kwargs={'account_id': rng.choice(ids)}))
+
+    def transfer():
+        client.post(reverse('transfer_funds_api'), make_transfers(
+            ids, 1, seed=rng.random())[0], format='json')
+
+    def batch_transfer():
+        client.post(reverse('batch_transfer_api'), {
+            'transfers': make_transfers(ids, 1000, seed=rng.random())}, format='json')
+
+    def import_rows():
+        csv_file = io.StringIO()
+        csv_file.write('ID,Name,Balance\n')
+        for account_id, name, balance in generate_accounts(1000, seed=rng.random()):
+            csv_file.write(f'{account_id},{name},{balance}\n')
+        upload = io.BytesIO(csv_file.getvalue().encode())
+        upload.name = 'accounts.csv'
+        # Rolled back so the data set keeps its size for the other cases
+        with transaction.atomic():
+            client.post(reverse('import_accounts_api'), {'file': upload}, format='multipart')
+            transaction.set_rollback(True)
+
+    def export():
+        response = get(reverse('export_accounts_api'), {'format': 'csv'})
+        for _ in response.streaming_content:
+            pass
+
+    return {
+        'list': (lambda: get(reverse('account_list_api')), 50),
+        'list_search': (lambda: get(reverse('account_list_api'), {'search': 'john'}), 50),
+        'detail': (detail, 200),
+        'transfer': (transfer, 200),
+        'batch_transfer_1000': (batch_transfer, 10),
+        'import_1000_rows': (import_rows, 10),
+        'export': (export, 3),
+    }
+
+
+def measure(fn, rounds):
+    fn()  # warmup
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return {
+        'rounds': rounds,
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'mean': statistics.fmean(timings),
+        'stddev': statistics.stdev(timings) if rounds > 1 else 0.0,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_DIR,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Print median changes against ``baseline``; return the regressed cases."""
+    regressed = []
+    for size, cases in results.items():
+        for name, stats in cases.items():
+            before = baseline['results'].get(size, {}).get(name)
+            if before is None:
+                continue
+            change = stats['median'] / before['median'] - 1
+            flag = ''
+            if change > threshold:
+                flag = ' REGRESSED'
+                regressed.append(f'{name}@{size}')
+            print(f'{name:>20} @ {size:>7}: {before["median"] * 1000:9.3f} ms '
+                  f'-> {stats["median"] * 1000:9.3f} ms ({change:+.1%}){flag}')
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--cases', nargs='+', help='run only these cases')
+    parser.add_argument('--save', help='write results to this JSON file')
+    parser.add_argument('--compare', help='compare against this JSON baseline')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='slowdown of the median that counts as a regression')
+    args = parser.parse_args()
+
+    setup_django(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+    client = api_client()
+    rng = random.Random(0)
+
+    ids = []
+    results = {}
+    for size in sorted(args.sizes):
+        ids += seed_accounts(size - len(ids), seed=size)
+        cases = make_cases(client, ids, rng)
+        results[str(size)] = {}
+        for name, (fn, rounds) in cases.items():
+            if args.cases and name not in args.cases:
+                continue
+            stats = measure(fn, rounds)
+            results[str(size)][name] = stats
+            print(f'{name:>20} @ {size:>7}: median {stats["median"] * 1000:9.3f} ms '
+                  f'(min {stats["min"] * 1000:.3f}, stddev {stats["stddev"] * 1000:.3f})')
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'machine': platform.platform(),
+        'results': results,
+    }
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f'\ncompared with {baseline.get("commit") or args.compare}:')
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Refreshing existing accounts: upsert import vs one save() per row.
+
+Seeds ``--rows`` accounts, then re-imports them from a CSV in which
+``--changed`` of the balances differ. The ``save`` variant runs
+``update_or_create`` per row, as a refresh script would without the
+upsert mode::
+
+    python -m benchmarks.bench_upsert --rows 100000
+"""
+import argparse
+import csv
+import os
+import random
+import tempfile
+import time
+from decimal import Decimal
+
+from benchmarks.common import seed_accounts, setup_django
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def write_refresh_csv(path, changed_share, seed=0):
+    from accounts.models import Account
+
+    rng = random.Random(seed)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['ID', 'Name', 'Balance'])
+        for account_id, name, balance in Account.objects.values_list('id', 'name', 'balance').iterator():
+            if rng.random() < changed_share:
+                balance += Decimal('1.5')
+            writer.writerow([account_id, name, balance])
+
+
+def refresh_with_save(path):
+    from accounts.models import Account
+
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        next(reader)
+        for account_id, name, balance in reader:
+            Account.objects.update_or_create(
+                id=account_id, defaults={'name': name, 'balance': balance})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--changed', type=float, default=0.5)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.db import connection
+
+    from accounts import importer
+
+    seed_accounts(args.rows)
+    path = os.path.join(tempfile.mkdtemp(), 'refresh.csv')
+
+    for variant in ('upsert', 'save'):
+        write_refresh_csv(path, args.changed, seed=len(variant))
+        counter = QueryCounter()
+        start = time.perf_counter()
+        with connection.execute_wrapper(counter):
+            if variant == 'upsert':
+                with open(path, 'rb') as f:
+                    importer.import_csv(f, mode=importer.UPSERT)
+            else:
+                refresh_with_save(path)
+        elapsed = time.perf_counter() - start
+        print(f'{variant:>6}: {args.rows / elapsed:8.0f} rows/sec, '
+              f'{counter.count:8d} statements')
+
+
+if __name__ == '__main__':
+    main()
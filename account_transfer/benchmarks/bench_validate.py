@@ -0,0 +1,46 @@
+"""Validation throughput of the importer on plain and gzipped CSV files.
+
+Writes ``accounts.csv`` scaled up to ``--rows`` rows, plus a gzipped copy,
+and times :func:`accounts.importer.validate_csv` over each. Nothing is
+written to the database::
+
+    python -m benchmarks.bench_validate --rows 1000000
+"""
+import argparse
+import gzip
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks.common import peak_rss_mb, setup_django, write_accounts_csv
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    setup_django()
+    from accounts import importer
+
+    workdir = tempfile.mkdtemp()
+    plain_path = write_accounts_csv(os.path.join(workdir, 'accounts.csv'), args.rows)
+    gzip_path = plain_path + '.gz'
+    with open(plain_path, 'rb') as src, gzip.open(gzip_path, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+
+    for label, path in (('plain', plain_path), ('gzip', gzip_path)):
+        with open(path, 'rb') as f:
+            start = time.perf_counter()
+            report = importer.validate_csv(importer.open_csv(f))
+            elapsed = time.perf_counter() - start
+        assert report.rows == args.rows and not report.error_count
+        print(f'{label:>5}: {os.path.getsize(path) / 2**20:7.1f} MiB upload, '
+              f'{args.rows / elapsed:9.0f} rows/sec')
+    print(f'peak RSS: {peak_rss_mb():.0f} MiB')
+    shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
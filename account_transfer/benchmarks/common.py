@@ -0,0 +1,122 @@
+"""Shared helpers for the standalone benchmark scripts.
+
+Benchmarks run against a throwaway SQLite database so they never touch
+``db.sqlite3``. With ``DB_ENGINE=postgresql`` they use the configured
+PostgreSQL database instead. Run them from the ``account_transfer`` directory, e.g.::
+
+    python -m benchmarks.bench_import --rows 1000000
+"""
+import csv
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import uuid
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+SAMPLE_CSV = PROJECT_DIR.parent / 'accounts.csv'
+
+
+def setup_django(db_name=None, **overrides):
+    """Configure Django against a fresh SQLite database (or PostgreSQL) and migrate it.
+
+    Keyword arguments override settings before Django is set up.
+    """
+    if str(PROJECT_DIR) not in sys.path:
+        sys.path.insert(0, str(PROJECT_DIR))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'account_transfer.settings')
+
+    import django
+    from django.conf import settings
+    from django.core.management import call_command
+
+    if settings.DATABASES['default']['ENGINE'].endswith('sqlite3'):
+        if db_name is None:
+            db_name = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+        settings.DATABASES['default']['NAME'] = db_name
+    # DEBUG keeps every query in memory, which skews long benchmark runs
+    settings.DEBUG = False
+    settings.ALLOWED_HOSTS = ['localhost', 'testserver']
+    # Rate limits would cut throughput benchmarks short; bench_overload sets its own
+    overrides = {'ACCOUNT_THROTTLE_RATES': {}, 'ACCOUNT_TRANSFER_MAX_CONCURRENT': None,
+                 'ACCOUNT_IMPORT_MAX_CONCURRENT': None, **overrides}
+    for name, value in overrides.items():
+        setattr(settings, name, value)
+    django.setup()
+    logging.getLogger('django.request').setLevel(logging.ERROR)
+    call_command('migrate', verbosity=0)
+    return db_name
+
+
+def sample_rows():
+    """Return ``(name, balance)`` pairs from the bundled ``accounts.csv``."""
+    with open(SAMPLE_CSV, newline='') as f:
+        reader = csv.reader(f)
+        next(reader)
+        return [(row[1], row[2]) for row in reader]
+
+
+def generate_accounts(count, seed=0):
+    """Yield ``(id, name, balance)`` rows modelled on ``accounts.csv``."""
+    rng = random.Random(seed)
+    samples = sample_rows()
+    for _ in range(count):
+        name, balance = samples[rng.randrange(len(samples))]
+        yield uuid.UUID(int=rng.getrandbits(128), version=4), name, balance
+
+
+def write_accounts_csv(path, count, seed=0):
+    """Write ``accounts.csv`` scaled up to ``count`` rows with fresh UUIDs."""
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['ID', 'Name', 'Balance'])
+        for account_id, name, balance in generate_accounts(count, seed):
+            writer.writerow([account_id, name, balance])
+    return path
+
+
+def seed_accounts(count, batch_size=5000, seed=0):
+    """Bulk insert ``count`` generated accounts and return their ids."""
+    from django.db import transaction
+
+    from accounts import search
+    from accounts.models import Account
+
+    def flush(batch):
+        with transaction.atomic():
+            Account.objects.bulk_create(batch)
+            search.index_accounts(batch, replace=False)
+
+    ids = []
+    batch = []
+    for account_id, name, balance in generate_accounts(count, seed):
+        ids.append(account_id)
+        batch.append(Account(id=account_id, name=name, balance=balance))
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    flush(batch)
+    return ids
+
+
+def api_client():
+    """A DRF test client that talks to the in-process WSGI handler."""
+    from rest_framework.test import APIClient
+
+    return APIClient(SERVER_NAME='localhost', HTTP_HOST='localhost')
+
+
+def peak_rss_mb():
+    """Peak resident set size of the current process in MiB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
@@ -0,0 +1,58 @@
+"""Gunicorn configuration for production.
+
+Gunicorn loads this file from the working directory, so ``gunicorn`` run in
+``account_transfer`` needs no other arguments. Settings come from the
+environment:
+
+- ``SERVER_INTERFACE``: ``wsgi`` (default) serves ``wsgi.py`` with gthread
+  workers; ``asgi`` serves ``asgi.py`` with uvicorn workers, which run the
+  async views without a thread hop.
+- ``WEB_CONCURRENCY``: worker processes, default ``2 * CPU cores + 1``.
+- ``GUNICORN_THREADS``: request threads per gthread worker, default 8.
+- ``PORT``: listening port, default 8000.
+- ``GUNICORN_TIMEOUT``: seconds before a stuck worker is restarted.
+- ``DJANGO_API_ONLY``: ``1`` loads only what the API needs (see settings.py).
+"""
+import multiprocessing
+import os
+
+SERVER_INTERFACE = os.environ.get('SERVER_INTERFACE', 'wsgi')
+
+if SERVER_INTERFACE == 'asgi':
+    wsgi_app = 'account_transfer.asgi:application'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+else:
+    wsgi_app = 'account_transfer.wsgi:application'
+    # Threads, not sync workers: the transfer and import concurrency limits
+    # (api/accounts/throttling.py) count requests per process, and a sync
+    # worker never has more than one. Keep GUNICORN_THREADS above
+    # ACCOUNT_TRANSFER_MAX_CONCURRENT, so that transfers past the limit are
+    # shed while reads still find a thread.
+    worker_class = 'gthread'
+    threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '30'))
+
+# Import Django and the project once in the master; workers are forked
+# from it and share those pages copy-on-write instead of each importing
+# the app again.
+preload_app = True
+
+accesslog = '-'
+
+
+def when_ready(server):
+    # Django only imports the URLconf, and the views it reaches, on the first
+    # request. Import them in the master as well, so that workers share them
+    # and answer their first request sooner.
+    from django.urls import get_resolver
+    get_resolver().url_patterns
+
+
+def post_fork(server, worker):
+    # Nothing should have connected before the fork, but a socket shared
+    # between processes would corrupt both sides, so make sure.
+    from django.db import connections
+    connections.close_all()
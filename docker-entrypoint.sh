@@ -0,0 +1,8 @@
+#!/bin/sh
+# Apply migrations, then hand the process over to the command (gunicorn by
+# default) so it receives signals from `docker stop` directly.
+set -e
+
+python manage.py migrate --noinput
+
+exec "$@"